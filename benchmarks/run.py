@@ -0,0 +1,312 @@
+"""
+Benchmarks for the hot paths in brain.py and behavior.py, on synthetic
+sessions (see synthetic.py).
+
+Each stage runs in a fresh process, so peak RSS is its own; reports wall
+time (best of --repeat), peak RSS (of the whole process, and how much the
+stage raised it over its setup), and throughput, and compares them to
+saved baselines (benchmarks/baselines.json).
+
+    python benchmarks/run.py --preset small               # compare
+    python benchmarks/run.py --preset small --save        # new baseline
+    python benchmarks/run.py --units 200 --duration 7200  # custom size
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+from benchmarks import synthetic  # noqa: E402
+
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "baselines.json")
+
+# session sizes: units, channels, duration (sec), trials
+PRESETS = {"tiny": {"units": 4, "channels": 1, "duration": 60,
+                    "trials": 20},
+           "small": {"units": 32, "channels": 4, "duration": 600,
+                     "trials": 200},
+           "medium": {"units": 100, "channels": 16, "duration": 1800,
+                      "trials": 600},
+           "large": {"units": 300, "channels": 64, "duration": 7200,
+                     "trials": 2000}}
+
+# time window around sync points, and sliding average window (sec)
+WINDOW = (-0.5, 1.0)
+AVG_WINDOW = 0.1
+
+# stage name: setup function, returns (run function, items, item unit)
+STAGES = dict()
+
+
+def stage(func):
+    STAGES[func.__name__] = func
+    return func
+
+
+@stage
+def get_raster(files, size):
+    import ephyspipe.brain as brain
+    data, unit_names, ntimes = _load_spk(files)
+
+    def run():
+        brain.get_raster(data, unit_names, ntimes)
+
+    return run, len(unit_names) * ntimes, "samples"
+
+
+@stage
+def get_fr(files, size):
+    import ephyspipe.brain as brain
+    raster = brain.get_raster(*_load_spk(files))
+
+    def run():
+        brain.get_fr(raster)
+
+    return run, raster.size, "samples"
+
+
+@stage
+def chop(files, size):
+    import ephyspipe.brain as brain
+    fr = brain.get_fr(brain.get_raster(*_load_spk(files)))
+    sync_points = _sync_points(files)
+
+    def run():
+        brain.chop(fr, sync_points, WINDOW)
+
+    nt = int(round(1000 * (WINDOW[1] - WINDOW[0])))
+    return run, sync_points.shape[0] * nt * fr.shape[0], "values"
+
+
+@stage
+def chop_spikes(files, size):
+    import mat73
+    import ephyspipe.brain as brain
+    data = mat73.loadmat(files["spk"])
+    timestamps = [data[u[0]] for u in data["unit_names"]]
+    sync_points = _sync_points(files)
+
+    def run():
+        brain.chop_spikes(timestamps, sync_points, WINDOW)
+
+    return run, sum(len(ts) for ts in timestamps), "spikes"
+
+
+@stage
+def sliding_avg(files, size):
+    import ephyspipe.brain as brain
+    fr = brain.get_fr(brain.get_raster(*_load_spk(files)))
+    chopped = brain.chop(fr, _sync_points(files), WINDOW)
+    del fr
+    ts = np.arange(WINDOW[0], WINDOW[1], 0.001)
+
+    def run():
+        brain.sliding_avg(chopped, ts, WINDOW, AVG_WINDOW)
+
+    return run, chopped.size, "values"
+
+
+@stage
+def process_raw_lfp(files, size):
+    import ephyspipe.brain as brain
+    sync_points = _sync_points(files)
+
+    def run():
+        brain.process_raw_lfp(files["lfp"], sync_points, WINDOW)
+
+    return run, size["channels"] * int(1000 * size["duration"]), "samples"
+
+
+@stage
+def get_trial_events(files, size):
+    import ephyspipe.behavior as bhv
+    bhv_data, pl2_codes = synthetic.make_events(size["trials"],
+                                                size["duration"])
+
+    def run():
+        bhv.get_trial_events(bhv_data, pl2_codes, synthetic.SYNC_CODE)
+
+    return run, size["trials"], "trials"
+
+
+def _load_spk(files):
+    """Spike data, unit names, and session length, as in process_raw_spk."""
+    import mat73
+    data = mat73.loadmat(files["spk"])
+    unit_names = [u[0] for u in data["unit_names"]]
+    ntimes = int(np.round(1000 * (1 + max(data[u][-1]
+                                          for u in unit_names))))
+
+    return data, unit_names, ntimes
+
+
+def _sync_points(files):
+    """Sync point of each trial, from the synthetic spk file events."""
+    import ephyspipe.behavior as bhv
+    pl2_codes = bhv.load_pl2_codes(files["spk"])
+    bhv_data = {"Trial": np.flatnonzero(
+        pl2_codes["event_codes"] == synthetic.START_CODE)}
+
+    return bhv.get_trial_events(bhv_data, pl2_codes, synthetic.SYNC_CODE)
+
+
+def make_session(data_dir, size, seed=0):
+    """Synthetic spk and lfp files (reused if already there)."""
+    key = "u%(units)d_c%(channels)d_d%(duration)d_t%(trials)d" % size
+    files = {"spk": os.path.join(data_dir, key + "_spk.mat"),
+             "lfp": os.path.join(data_dir, key + "_lfp.mat")}
+    if not os.path.exists(files["spk"]):
+        synthetic.make_spk_file(files["spk"], size["units"],
+                                size["duration"], ntrials=size["trials"],
+                                seed=seed)
+    if not os.path.exists(files["lfp"]):
+        synthetic.make_lfp_file(files["lfp"], size["channels"],
+                                size["duration"], ntrials=size["trials"],
+                                seed=seed)
+
+    return files
+
+
+def run_stage(name, files, size, repeat):
+    """Run one stage (in this process); wall time is best of repeat."""
+    import resource
+    run, nitems, unit = STAGES[name](files, size)
+    setup_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    walls = []
+    for r in range(repeat):
+        tic = time.perf_counter()
+        run()
+        walls.append(time.perf_counter() - tic)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    wall = min(walls)
+    return {"stage": name,
+            "wall_sec": wall,
+            "peak_rss_mb": peak_rss / scale,
+            "stage_rss_mb": (peak_rss - setup_rss) / scale,
+            "throughput": nitems / wall,
+            "unit": unit + "/s"}
+
+
+def run_stages(stages, files, size, repeat):
+    """Run each stage in a fresh (spawned) process."""
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for name in stages:
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(run_stage,
+                                      (name, files, size, repeat)))
+
+    return pd.DataFrame(results)
+
+
+def machine_info():
+    import scipy
+    return {"platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__}
+
+
+def compare(results, baseline, tolerance, min_delta=0.05):
+    """
+    Ratio to baseline for each stage; flag ones over tolerance (for wall
+    time, only if also min_delta sec slower, so quick stages' timer noise
+    isn't flagged).
+    """
+    base = pd.DataFrame(baseline["results"]).set_index("stage")
+    results = results.copy()
+    known = results.stage.isin(base.index)
+    base = base.reindex(results.stage)
+    results["wall_ratio"] = results.wall_sec.values / base.wall_sec.values
+    results["rss_ratio"] = results.peak_rss_mb.values / \
+        base.peak_rss_mb.values
+    slower = (results.wall_ratio > tolerance) & \
+        (results.wall_sec.values - base.wall_sec.values > min_delta)
+    results["regressed"] = known & (slower |
+                                    (results.rss_ratio > tolerance))
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--preset", default="small", choices=PRESETS,
+                        help="session size; default = small")
+    parser.add_argument("--units", type=int)
+    parser.add_argument("--channels", type=int)
+    parser.add_argument("--duration", type=float, help="in sec")
+    parser.add_argument("--trials", type=int)
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES),
+                        default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--data-dir", help="keep synthetic files here; "
+                        "default = temporary directory")
+    parser.add_argument("--baselines", default=BASELINES)
+    parser.add_argument("--save", action="store_true",
+                        help="save results as new baseline for this size")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="flag stages this many times slower (or "
+                        "bigger) than baseline; default = 1.5")
+    parser.add_argument("--min-delta", type=float, default=0.05,
+                        help="only flag stages at least this many sec "
+                        "slower than baseline; default = 0.05")
+    parser.add_argument("--out", help="save results as csv")
+    args = parser.parse_args(argv)
+
+    size = dict(PRESETS[args.preset])
+    for k in size:
+        if getattr(args, k) is not None:
+            size[k] = type(size[k])(getattr(args, k))
+    key = "u%(units)d_c%(channels)d_d%(duration)d_t%(trials)d" % size
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or tmp_dir
+        os.makedirs(data_dir, exist_ok=True)
+        files = make_session(data_dir, size)
+        results = run_stages(args.stages, files, size, args.repeat)
+
+    baselines = dict()
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+
+    status = 0
+    if args.save:
+        baselines[key] = {"machine": machine_info(),
+                          "results": results.to_dict("records")}
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=1)
+    elif key in baselines:
+        if baselines[key]["machine"] != machine_info():
+            print("note: baseline was saved on another machine/setup")
+        results = compare(results, baselines[key], args.tolerance,
+                          args.min_delta)
+        status = int(results.regressed.any())
+
+    print("session: " + key)
+    print(results.to_string(index=False, float_format="%.4g"))
+    if args.out:
+        results.to_csv(args.out, index=False)
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Synthetic sessions for benchmarks: spk, lfp and event files laid out like
+the converted .pl2 files (v7.3 .mat, i.e. HDF5), at any size.
+"""
+import h5py
+import numpy as np
+
+
+# trial start, sync, and stop codes used in get_trial_events
+START_CODE = 9
+SYNC_CODE = 20
+STOP_CODE = 18
+
+
+def make_events(ntrials, duration, seed=0):
+    """
+    Task event codes for evenly spread trials, each with a start, sync,
+    and stop code, plus the matching (minimal) behavior data.
+
+    Parameters:
+    ----------
+    ntrials : int
+        number of trials
+    duration : float
+        session duration, in sec
+    seed : int
+        random seed
+
+    Returns:
+    -------
+    bhv_data : dict
+        behavior data, one "Trial" entry per trial
+    pl2_codes : dict
+        event codes and time stamps (in sec)
+
+    """
+    rng = np.random.default_rng(seed)
+    trial_len = duration / (ntrials + 1)
+    starts = (np.arange(ntrials) + 0.5) * trial_len
+
+    # start, sync point somewhere in first half, stop near the end
+    event_ts = np.stack([starts,
+                         starts + rng.uniform(0.1, 0.5, ntrials) * trial_len,
+                         starts + 0.9 * trial_len], axis=1).reshape(-1)
+    event_codes = np.tile([START_CODE, SYNC_CODE, STOP_CODE], ntrials)
+
+    bhv_data = {"Trial": [np.array(tr + 1) for tr in range(ntrials)]}
+    pl2_codes = {"event_codes": event_codes.astype(float),
+                 "event_ts": event_ts}
+
+    return bhv_data, pl2_codes
+
+
+def make_spk_file(fname, nunits, duration, rate=10, ntrials=100, seed=0):
+    """
+    Spike times for Poisson units, saved like convert_raw_spk.m output.
+
+    Parameters:
+    ----------
+    fname : string
+        path for new file
+    nunits : int
+        number of units
+    duration : float
+        session duration, in sec
+    rate : float
+        mean firing rate, Hz
+    ntrials : int
+        number of trials, for event codes
+    seed : int
+        random seed
+
+    Returns:
+    -------
+    unit_timestamps : list
+        np vectors, spike times for each unit (in sec)
+
+    """
+    rng = np.random.default_rng(seed)
+    unit_names = ["SPK_SPKC%03d%s" % (1 + u // 4, "abcd"[u % 4])
+                  for u in range(nunits)]
+    unit_timestamps = [np.sort(rng.uniform(0, duration,
+                                           rng.poisson(rate * duration)))
+                       for u in range(nunits)]
+
+    _, pl2_codes = make_events(ntrials, duration, seed)
+    with h5py.File(fname, "w", userblock_size=512) as f:
+        for name, ts in zip(unit_names, unit_timestamps):
+            _write_double(f, name, ts.reshape(-1, 1))
+        _write_double(f, "event_codes", pl2_codes["event_codes"][None, :])
+        _write_double(f, "event_ts", pl2_codes["event_ts"][None, :])
+        _write_cellstr(f, "unit_names", unit_names)
+
+    return unit_timestamps
+
+
+def make_lfp_file(fname, nchannels, duration, ntrials=100, seed=0,
+                  block=600000):
+    """
+    LFP with oscillations in each band plus noise, @ 1 kHz, saved like
+    convert_raw_lfp.m output; written in blocks, so sessions can be
+    longer than memory allows.
+
+    Parameters:
+    ----------
+    fname : string
+        path for new file
+    nchannels : int
+        number of channels
+    duration : float
+        session duration, in sec
+    ntrials : int
+        number of trials, for event codes
+    seed : int
+        random seed
+    block : int
+        samples written at once
+
+    """
+    rng = np.random.default_rng(seed)
+    ntimes = int(duration * 1000)
+
+    _, pl2_codes = make_events(ntrials, duration, seed)
+    with h5py.File(fname, "w", userblock_size=512) as f:
+        for ch in range(nchannels):
+            dset = f.create_dataset("FP%03d" % (ch + 1), (1, ntimes),
+                                    dtype=float)
+            dset.attrs["MATLAB_class"] = np.bytes_("double")
+            phases = rng.uniform(0, 2 * np.pi, 7)
+            for first in range(0, ntimes, block):
+                t = np.arange(first, min(first + block, ntimes)) / 1000
+                lfp = rng.normal(0, 1, t.shape[0])
+                for hz, phase in zip([3, 6, 10, 20, 45, 60, 100], phases):
+                    lfp += np.sin(2 * np.pi * hz * t + phase)
+                dset[0, first:first + t.shape[0]] = lfp
+
+        ts = f.create_dataset("lfp_ts", (1, ntimes), dtype=float)
+        ts.attrs["MATLAB_class"] = np.bytes_("double")
+        for first in range(0, ntimes, block):
+            ts[0, first:first + block] = np.arange(
+                first, min(first + block, ntimes), dtype=float)
+        _write_double(f, "event_codes", pl2_codes["event_codes"][None, :])
+        _write_double(f, "event_ts", pl2_codes["event_ts"][None, :])
+
+
+def _write_double(f, name, data):
+    """MATLAB double array."""
+    f[name] = np.asarray(data, dtype=float)
+    f[name].attrs["MATLAB_class"] = np.bytes_("double")
+
+
+def _write_cellstr(f, name, strings):
+    """MATLAB cell array of char vectors (1 x n)."""
+    refs = f.require_group("#refs#")
+    ref_list = []
+    for i, s in enumerate(strings):
+        chars = refs.create_dataset(
+            "%s_%d" % (name, i),
+            data=np.array([ord(c) for c in s], dtype=np.uint16)[:, None])
+        chars.attrs["MATLAB_class"] = np.bytes_("char")
+        chars.attrs["MATLAB_int_decode"] = 2
+        ref_list.append(chars.ref)
+
+    cell = f.create_dataset(name, (1, len(strings)),
+                            dtype=h5py.ref_dtype)
+    cell[0, :] = ref_list
+    cell.attrs["MATLAB_class"] = np.bytes_("cell")
@@ -0,0 +1,196 @@
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+
+class LazyBands:
+    """
+    Bandpassed LFP (see process_raw_lfp with lazy=True), filtered one band
+    at a time, the first time the band is asked for:
+
+        result["beta"].mag  # computes beta only; no other band is touched
+        result["beta"].phs  # already there
+
+    Computed bands are kept in memory up to max_bytes; past that, the
+    least recently used ones are dropped (recomputed if asked for again),
+    or spilled to disk and memory mapped back (read only). Arrays are
+    shared with the cache, so copy before changing them. State compute
+    keeps for later bands (see share, e.g. notched channels) counts
+    against max_bytes too, and is dropped first.
+
+    Parameters:
+    ----------
+    compute : function
+        band index -> (magnitude, phase), 3D np arrays; sync_points x
+        time x channels
+    band_names : list
+        bands, in filter bank order
+    ts_chopped : np vector
+        time for data chopped at sync_points, in sec
+    lfp_meta : pd table
+        meta data; each row corresponds to LFP channel
+    max_bytes : int
+        memory for computed bands and shared state; default = 1 GiB
+    spill_dir : string
+        directory for spilled bands (in a temporary subdirectory, removed
+        by close); None = don't spill
+
+    """
+
+    def __init__(self, compute, band_names, ts_chopped, lfp_meta,
+                 max_bytes=2**30, spill_dir=None):
+        self.compute = compute
+        self.shared = dict()  # key: np array, kept for later bands
+        self.band_names = list(band_names)
+        self.ts_chopped = ts_chopped
+        self.lfp_meta = lfp_meta
+        self.max_bytes = max_bytes
+
+        # (band, "mag" / "phs"): array, least recently used first; and
+        # paths of spilled ones
+        self.computed = OrderedDict()
+        self.spilled = dict()
+        self.lock = threading.RLock()
+
+        self.spill_path = None
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            self.spill_path = tempfile.mkdtemp(dir=spill_dir,
+                                               prefix="bands_")
+            self._cleanup = weakref.finalize(self, shutil.rmtree,
+                                             self.spill_path, True)
+
+    def __getitem__(self, band):
+        if band not in self.band_names:
+            raise KeyError(band)
+
+        return Band(self, band)
+
+    def __iter__(self):
+        return iter(self.band_names)
+
+    def __len__(self):
+        return len(self.band_names)
+
+    def __contains__(self, band):
+        return band in self.band_names
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def keys(self):
+        return list(self.band_names)
+
+    def get(self, band, kind):
+        """
+        Magnitude or phase of band, computed if not there yet.
+
+        Parameters:
+        ----------
+        band : string
+            band name, e.g. "beta"
+        kind : string
+            "mag" or "phs"
+
+        Returns:
+        -------
+        chopped : 3D np array
+            sync_points x time x channels
+
+        """
+        key = (band, kind)
+        with self.lock:
+            if key in self.computed:
+                self.computed.move_to_end(key)
+                return self.computed[key]
+            if key in self.spilled:
+                return np.load(self.spilled[key], mmap_mode="r")
+
+            # filter band; keep both outputs, the one asked for last
+            mag, phs = self.compute(self.band_names.index(band))
+            outputs = {"mag": mag, "phs": phs}
+            for k in sorted(outputs, key=lambda k: k == kind):
+                self.computed[(band, k)] = outputs[k]
+            self._evict()
+
+            return outputs[kind]
+
+    def share(self, key, array):
+        """
+        Keep array for later computes (in shared), if it fits in max_bytes
+        with what's held already.
+
+        Parameters:
+        ----------
+        key : hashable
+            e.g. channel ID
+        array : np array
+            e.g. notched channel
+
+        Returns:
+        -------
+        kept : bool
+            False = no room; not kept
+
+        """
+        with self.lock:
+            if self.nbytes() + array.nbytes > self.max_bytes:
+                return False
+            self.shared[key] = array
+            return True
+
+    def nbytes(self):
+        """Memory held by computed bands and shared state."""
+        return sum(a.nbytes for a in self.computed.values()) + \
+            sum(a.nbytes for a in self.shared.values())
+
+    def close(self):
+        """Drop computed bands (and shared state); remove spilled ones."""
+        with self.lock:
+            self.computed.clear()
+            self.shared.clear()
+            self.spilled.clear()
+            if self.spill_path is not None:
+                self._cleanup()
+
+    def _evict(self):
+        """Drop shared state, then drop (or spill) least recently used
+        bands past max_bytes; the most recent one stays, even if it's
+        bigger on its own."""
+        if self.nbytes() > self.max_bytes:
+            self.shared.clear()
+        while len(self.computed) > 1 and self.nbytes() > self.max_bytes:
+            key, array = self.computed.popitem(last=False)
+            if self.spill_path is not None:
+                path = os.path.join(self.spill_path, "%s_%s.npy" % key)
+                np.save(path, array)
+                self.spilled[key] = path
+
+
+class Band:
+    """One band of LazyBands; magnitude and phase computed on access."""
+
+    def __init__(self, bands, name):
+        self.bands = bands
+        self.name = name
+
+    def __iter__(self):
+        # mag, phs = result["beta"]
+        return iter([self.mag, self.phs])
+
+    @property
+    def mag(self):
+        """Zscored magnitude; sync_points x time x channels."""
+        return self.bands.get(self.name, "mag")
+
+    @property
+    def phs(self):
+        """Phase; sync_points x time x channels."""
+        return self.bands.get(self.name, "phs")
@@ -1,7 +1,21 @@
+import logging
 import mat73
+import h5py
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
+from ephyspipe.instrument import stage
+from ephyspipe.readers import PL2MatReader, open_reader
+
+
+# per trial fields for get_trialinfo (as paths for load_bhv_columns)
+CONDITION_INFO = "TaskObject/CurrentConditionInfo/"
+TRIALINFO_FIELDS = [CONDITION_INFO + "trialtype",
+                    CONDITION_INFO + "amnt",
+                    CONDITION_INFO + "prob"]
+
+logger = logging.getLogger(__name__)
 
 
 def load_raw_bhv(bhv_fnames):
@@ -24,8 +38,9 @@ def load_raw_bhv(bhv_fnames):
     bhv_data = defaultdict(list)
 
     for f in bhv_fnames:
-        print(f)
-        data = mat73.loadmat(f)
+        logger.info("loading %s", f)
+        with stage("load_bhv", fname=f):
+            data = mat73.loadmat(f)
 
         data_vars = data["bhvdata"].keys()
         for v in data_vars:
@@ -34,15 +49,149 @@ def load_raw_bhv(bhv_fnames):
     return bhv_data
 
 
+def load_bhv_columns(bhv_fnames, fields=None, nworkers=1):
+    """
+    Load only some per trial fields of raw bhv (.bhv2 saved as .mat),
+    straight from HDF5 into columns (one entry per trial); consolidate if
+    split across multiple files (assume alpha order). Much faster than
+    load_raw_bhv, which converts every field of every trial.
+
+    Parameters:
+    ----------
+    bhv_fnames : list
+        File path(s) for behavior data
+    fields : list
+        Field names, e.g. "TrialError"; nested fields as paths, e.g.
+        "TaskObject/CurrentConditionInfo/amnt" (first element is taken
+        from struct arrays along the way, as in get_trialinfo); default =
+        Trial, TrialError, Block, Condition, ReactionTime
+    nworkers : int
+        number of processes to load files concurrently; default = 1
+
+    Returns:
+    -------
+    bhv_columns : dict
+        field: np array with one row per trial (or list, if trials don't
+        line up into an array)
+
+    """
+    if fields is None:
+        fields = ["Trial", "TrialError", "Block", "Condition",
+                  "ReactionTime"]
+
+    if nworkers > 1:
+        with ProcessPoolExecutor(nworkers) as executor:
+            per_file = list(executor.map(read_bhv_columns, bhv_fnames,
+                                         [fields] * len(bhv_fnames)))
+    else:
+        per_file = [read_bhv_columns(f, fields) for f in bhv_fnames]
+
+    return stack_bhv_columns(per_file, fields)
+
+
+def stack_bhv_columns(per_file, fields):
+    """
+    Stack per trial fields read from each raw bhv file (in order) into
+    columns (see load_bhv_columns).
+
+    Parameters:
+    ----------
+    per_file : list
+        dicts from read_bhv_columns, one per file
+    fields : list
+        Field names or paths
+
+    Returns:
+    -------
+    bhv_columns : dict
+        field: np array with one row per trial (or list, if trials don't
+        line up into an array)
+
+    """
+    bhv_columns = dict()
+    for field in fields:
+        values = [v for columns in per_file for v in columns[field]]
+        try:
+            column = np.array(values)
+        except ValueError:  # ragged
+            column = None
+        if column is None or column.dtype == object:
+            column = values
+        bhv_columns[field] = column
+
+    return bhv_columns
+
+
+def read_bhv_columns(bhv_fname, fields):
+    """
+    Read per trial fields from one raw bhv file (see load_bhv_columns).
+
+    Parameters:
+    ----------
+    bhv_fname : string
+        File path for behavior data
+    fields : list
+        Field names or paths
+
+    Returns:
+    -------
+    columns : dict
+        field: list with value for each trial
+
+    """
+    columns = dict()
+    with stage("load_bhv", fname=bhv_fname, nfields=len(fields)), \
+            h5py.File(bhv_fname, "r") as f:
+        bhvdata = f["bhvdata"]
+        for field in fields:
+            name, _, path = field.partition("/")
+            trials = bhvdata[name][()].reshape(-1)
+            columns[field] = [_read_mat_value(f, f[tr], path)
+                              for tr in trials]
+
+    return columns
+
+
+def _read_mat_value(f, obj, path):
+    """Follow path (through structs and cells) to a value; MATLAB -> np."""
+    for name in [p for p in path.split("/") if p]:
+        obj = _first_element(f, obj[name])
+    obj = _first_element(f, obj)
+
+    if isinstance(obj, h5py.Group):
+        raise ValueError(obj.name + " is a struct; pick one of its fields")
+    if obj.attrs.get("MATLAB_empty", 0):
+        return np.nan
+
+    value = obj[()]
+    if obj.attrs.get("MATLAB_class", b"") == b"char":
+        return "".join(chr(c) for c in value.T.reshape(-1))
+
+    # MATLAB is column major
+    value = np.squeeze(value.T)
+    if value.ndim == 0:
+        return value.item()
+
+    return value
+
+
+def _first_element(f, obj):
+    """Dereference struct array or cell (saved as references)."""
+    if isinstance(obj, h5py.Dataset) and obj.dtype == object:
+        return f[obj[()].reshape(-1)[0]]
+
+    return obj
+
+
 def load_pl2_codes(spk_fname):
     """
     Load task event codes and corresponding time stamps from
-    raw spk (.pl2 saved as .mat).
+    raw spk (.pl2, or .pl2 saved as .mat).
 
     Parameters:
     ----------
-    spk_fname : string
-        File path for spk data
+    spk_fname : string or PL2MatReader
+        File path for spk (or lfp) data, or open reader
 
     Returns:
     -------
@@ -51,8 +200,11 @@ def load_pl2_codes(spk_fname):
 
     """
 
-    pl2_codes = mat73.loadmat(spk_fname,
-                              only_include=["event_codes", "event_ts"])
+    if isinstance(spk_fname, PL2MatReader):
+        return spk_fname.read_events()
+
+    with open_reader(spk_fname) as reader:
+        pl2_codes = reader.read_events()
 
     return pl2_codes
 
@@ -60,7 +212,9 @@ def load_pl2_codes(spk_fname):
 def get_trial_events(bhv_data, pl2_codes, event):
     """
     For each trial in bhv_data, pull time for this event code
-    (-1 if doesn't exist)
+    (-1 if doesn't exist, or happens more than once); every event is
+    labeled with its trial in one pass, so pulling many codes at once costs
+    about the same as one.
 
     Parameters:
     ----------
@@ -68,13 +222,14 @@ def get_trial_events(bhv_data, pl2_codes, event):
         All task data
     pl2_codes : dict
         Event codes and timestamps from whole session
-    event : int
-        Event code word
+    event : int or list
+        Event code word(s)
 
     Returns:
     -------
-    timestamps : np vector
-        Timestamps corresponding to event within each trial (or -1)
+    timestamps : np vector or 2D np array
+        Timestamps corresponding to event within each trial (or -1);
+        trials x codes if event is a list
 
     """
 
@@ -82,25 +237,40 @@ def get_trial_events(bhv_data, pl2_codes, event):
     start_code = 9
     stop_code = 18
 
-    trial_start = np.where(pl2_codes["event_codes"] == start_code)[0]
-    trial_stop = np.where(pl2_codes["event_codes"] == stop_code)[0]
+    codes = np.asarray(pl2_codes["event_codes"]).reshape(-1)
+    ts = np.asarray(pl2_codes["event_ts"]).reshape(-1)
+
+    trial_start = np.where(codes == start_code)[0]
+    trial_stop = np.where(codes == stop_code)[0]
 
     # check that we have the same number of trials from bhv and pl2 data
     ntr = len(bhv_data["Trial"])
     if trial_start.shape[0] != ntr or trial_stop.shape[0] != ntr:
         raise ValueError("oops! mismatched bhv2 and pl2 trial counts")
 
-    # cycle through all trials, save event time (if exists)
-    timestamps = -1 * np.ones(ntr)
-    for tr in range(ntr):
-
-        # restrict to event codes in this trial
-        codes = pl2_codes["event_codes"][trial_start[tr]:trial_stop[tr]]
-        ts = pl2_codes["event_ts"][trial_start[tr]:trial_stop[tr]]
-
-        idx = np.where(codes == event)[0]
-        if idx.shape[0] == 1:
-            timestamps[tr] = ts[idx]
+    # label every event with its trial: last start at or before it, as long
+    # as it comes before that trial's stop
+    idx = np.arange(codes.shape[0])
+    trial = np.searchsorted(trial_start, idx, side="right") - 1
+    in_trial = (trial >= 0) & (idx < trial_stop[np.maximum(trial, 0)])
+
+    # column for each event code we want
+    events = np.atleast_1d(event)
+    uniq_events, col = np.unique(events, return_inverse=True)
+    code_col = np.searchsorted(uniq_events, codes)
+    code_col[code_col == uniq_events.shape[0]] = 0
+    wanted = in_trial & (uniq_events[code_col] == codes)
+
+    # count each (trial, code), save event time if it happens exactly once
+    flat = trial[wanted] * uniq_events.shape[0] + code_col[wanted]
+    counts = np.bincount(flat, minlength=ntr * uniq_events.shape[0])
+    timestamps = -1 * np.ones(ntr * uniq_events.shape[0])
+    timestamps[flat] = ts[wanted]
+    timestamps[counts != 1] = -1
+
+    timestamps = timestamps.reshape((ntr, -1))[:, col.reshape(-1)]
+    if np.ndim(event) == 0:
+        timestamps = timestamps[:, 0]
 
     return timestamps
 
@@ -112,7 +282,8 @@ def get_trialinfo(bhv_data):
     Parameters:
     ----------
     bhv_data : dict
-        All task data
+        All task data (load_raw_bhv), or columns with at least
+        TRIALINFO_FIELDS (load_bhv_columns)
 
     Returns:
     -------
@@ -120,27 +291,34 @@ def get_trialinfo(bhv_data):
         trials x features; will expand the number of features in the future
     """
 
-    # free vs forced trials
-    trialtype = [obj["CurrentConditionInfo"][0]["trialtype"]
-                 for obj in bhv_data["TaskObject"]]
-
-    # amnt and prob for left and right picture
-    amnt_left = [obj["CurrentConditionInfo"][0]["amnt"][0]
-                 for obj in bhv_data["TaskObject"]]
-    amnt_right = [obj["CurrentConditionInfo"][0]["amnt"][1]
-                  for obj in bhv_data["TaskObject"]]
-
-    prob_left = [obj["CurrentConditionInfo"][0]["prob"][0]
-                 for obj in bhv_data["TaskObject"]]
-    prob_right = [obj["CurrentConditionInfo"][0]["prob"][1]
-                  for obj in bhv_data["TaskObject"]]
+    if TRIALINFO_FIELDS[0] in bhv_data:
+        # already columns
+        trialtype = list(bhv_data[CONDITION_INFO + "trialtype"])
+        amnt = bhv_data[CONDITION_INFO + "amnt"]
+        prob = bhv_data[CONDITION_INFO + "prob"]
+
+    else:
+        # one pass over trials: free vs forced trials, amnt and prob for
+        # left and right picture
+        trialtype = []
+        amnt = []
+        prob = []
+        for obj in bhv_data["TaskObject"]:
+            info = obj["CurrentConditionInfo"][0]
+            trialtype.append(info["trialtype"])
+            amnt.append(info["amnt"])
+            prob.append(info["prob"])
+
+    # left and right picture: first two values of each trial
+    amnt = _left_right(amnt)
+    prob = _left_right(prob)
 
     # make data frame, and add some useful columns
     trialinfo = pd.DataFrame({"trialtype": trialtype,
-                              "amnt_left": amnt_left,
-                              "amnt_right": amnt_right,
-                              "prob_left": prob_left,
-                              "prob_right": prob_right})
+                              "amnt_left": amnt[:, 0],
+                              "amnt_right": amnt[:, 1],
+                              "prob_left": prob[:, 0],
+                              "prob_right": prob[:, 1]})
 
     trialinfo["value_left"] = trialinfo["amnt_left"] * \
         trialinfo["prob_left"]
@@ -150,3 +328,31 @@ def get_trialinfo(bhv_data):
                                         "value_right"]].max(axis=1)
 
     return trialinfo
+
+
+def _left_right(values):
+    """First two of each trial's values (left, right picture); trials x 2
+    np array, whether values are stacked columns or one per trial."""
+    return np.array([np.ravel(v)[:2] for v in values], dtype=float)
+
+
+def load_trialinfo(bhv_fnames, nworkers=1):
+    """
+    Pull some trial info straight from raw bhv (.bhv2 saved as .mat),
+    only reading the fields it needs.
+
+    Parameters:
+    ----------
+    bhv_fnames : list
+        File path(s) for behavior data
+    nworkers : int
+        number of processes to load files concurrently; default = 1
+
+    Returns:
+    -------
+    trialinfo : pd dataframe
+        trials x features (see get_trialinfo)
+    """
+
+    return get_trialinfo(load_bhv_columns(bhv_fnames, TRIALINFO_FIELDS,
+                                          nworkers))
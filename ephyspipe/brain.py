@@ -1,61 +1,124 @@
-import mat73
-import h5py
+import logging
+import os
+import shutil
+import tempfile
+import threading
 import numpy as np
 import pandas as pd
+import scipy.fft as sp_fft
 import scipy.signal as signal
 import scipy.stats as stats
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from ephyspipe.bands import LazyBands
+from ephyspipe.cache import as_cache
+from ephyspipe.filters import ChannelSpectrum, FilterBank, BROADBAND
+from ephyspipe.instrument import add_array, stage
+from ephyspipe.readers import (PL2MatReader, load_spk, open_reader,
+                               select_units)
+from ephyspipe.spikes import SpikeRaster
+from ephyspipe.smoothing import smooth, boxcar_kernel
 
 
-def process_raw_spk(spk_fname, channels=-1):
+logger = logging.getLogger(__name__)
+
+# float dtypes for precision="double" / "single"
+PRECISIONS = {"double": np.float64, "single": np.float32}
+
+# quantized phase (int16): radians * PHASE_SCALE, and NaN
+PHASE_SCALE = 32767 / np.pi
+PHASE_NAN = np.iinfo(np.int16).min
+
+
+class _Scratch(threading.local):
+    """Per-thread scratch buffers, reused across bands and channels."""
+
+    def __init__(self):
+        self.buffers = dict()
+
+    def get(self, name, n, dtype):
+        buf = self.buffers.get(name)
+        if buf is None or buf.shape[0] < n or buf.dtype != dtype:
+            buf = np.empty(n, dtype)
+            self.buffers[name] = buf
+
+        return buf[:n]
+
+
+_scratch = _Scratch()
+
+
+def process_raw_spk(spk_fname, channels=-1, sparse=False, cache=None,
+                    min_rate=0, min_spikes=0):
     """
-    Load raw spk (.pl2 saved as .mat)
+    Load raw spk (.pl2, or .pl2 saved as .mat); units are picked (channels,
+    min_rate, min_spikes) from the file's meta data first, and only their
+    spikes are read (see readers.select_units)
 
     Parameters:
     ----------
     spk_fname : string
-        Path file for raw spk data
+        Path file for raw spk data (.pl2 needs Plexon's pypl2, see
+        readers.PL2Reader)
     channels : list
         Integers, restrict processing to these channel numbers; if -1, use
         all channels
+    sparse : bool
+        default 0 = dense np arrays, 1 = sparse SpikeRaster (memory scales
+        with spike count instead of session duration; fr smoothed lazily)
+    cache : SessionCache or string
+        cache (directory) for outputs; on repeat calls with the same file
+        and parameters, arrays come back as read only np.memmap; None =
+        no cache
+    min_rate : float
+        drop units firing less often (spikes / sec over the session)
+    min_spikes : int
+        drop units with fewer spikes
 
     Returns:
     -------
-    raster : np array
+    raster : np array or SpikeRaster
         spike trains, nunits x ntimes
-    fr : np array
+    fr : np array or SpikeRaster
         firing rates, nunits x ntimes
     unit_meta : pd table
         meta data; each row corresponds to row in raster and fr
 
     """
 
-    # load spk data
-    data = mat73.loadmat(spk_fname)
-
-    # get unique unit names
-    unit_names = [u[0] for u in data["unit_names"]]
-    if channels != -1:
-        unit_names = [u for u in unit_names if int(u[8:11]) in channels]
-
-    # get last spike time in entire session, +1 second
-    last_spk = [data[u][-1] for u in unit_names]
-    max_t = 1 + max(last_spk)
+    if cache is not None:
+        return as_cache(cache).cached(process_raw_spk, spk_fname,
+                                      {"channels": channels,
+                                       "sparse": sparse,
+                                       "min_rate": min_rate,
+                                       "min_spikes": min_spikes})
+
+    # pick units, then load spk data for just those
+    with stage("load", fname=spk_fname), open_reader(spk_fname) as reader:
+        unit_info, max_t = select_units(reader, channels, min_rate,
+                                        min_spikes)
+        unit_names = list(unit_info.ID)
+        data = load_spk(reader, unit_names)
+
+    # session: last spike time of any unit, +1 second
     ts = np.arange(np.round(1000 * max_t))  # ms, corresponding time vector
     ntimes = len(ts)
 
     # get spike trains for all units
-    raster = get_raster(data, unit_names, ntimes)
+    with stage("raster", nunits=len(unit_names), ntimes=ntimes):
+        if sparse:
+            raster = SpikeRaster.from_timestamps(
+                [data[u] for u in unit_names], ntimes)
+        else:
+            raster = get_raster(data, unit_names, ntimes)
 
     # smooth spike trains into firig rates
-    fr = get_fr(raster)
+    with stage("fr", nunits=len(unit_names), ntimes=ntimes):
+        fr = get_fr(raster)
 
     # save some meta data for each unit
-    mean_fr = [len(data[u])/max_t for u in unit_names]
-    channel = [int(u.replace("SPK_SPKC", "")[:3]) for u in unit_names]
     unit_meta = pd.DataFrame({"ID": unit_names,
-                              "channel": channel,
-                              "mean_fr": mean_fr})
+                              "channel": unit_info.channel,
+                              "mean_fr": unit_info.nspikes / max_t})
 
     return raster, fr, unit_meta
 
@@ -87,26 +150,32 @@ def get_raster(data, unit_names, ntimes):
     return raster
 
 
-def get_fr(raster):
+def get_fr(raster, kernel=None):
     """
-    Turn raster (for units x entire session) into firing rates.
+    Turn raster (for units x entire session) into firing rates; all units
+    are smoothed together in one vectorized pass.
 
     Parameters:
     ----------
-    raster : 2D np array
+    raster : 2D np array or SpikeRaster
         units x time, spikes @ 1 kHz
+    kernel : np vector
+        smoothing kernel (see ephyspipe.smoothing); default = 49 ms boxcar
 
     Returns:
     -------
-    fr : 2D np array
-        units x time, firing rates @ 1kHz (per ms; *1000 to get Hz)
+    fr : 2D np array or SpikeRaster
+        units x time, firing rates @ 1kHz (per ms; *1000 to get Hz); for
+        sparse input, smoothing is deferred until data are pulled out
 
     """
-    fr = np.empty(raster.shape)
-    for u in range(raster.shape[0]):
-        fr[u, :] = train_to_fr(raster[u, :])
+    if kernel is None:
+        kernel = boxcar_kernel(49)
+
+    if isinstance(raster, SpikeRaster):
+        return raster.smooth(kernel)
 
-    return fr
+    return smooth(raster, kernel, axis=1)
 
 
 def ts_to_train(timestamps, ntimes):
@@ -137,7 +206,7 @@ def ts_to_train(timestamps, ntimes):
     return train
 
 
-def train_to_fr(train):
+def train_to_fr(train, kernel=None):
     """
     Turn spike train into firing rate.
     Note: can also use this to smooth LFP magnitude!
@@ -146,34 +215,52 @@ def train_to_fr(train):
     ----------
     train : np vector
         1 or 0 to indicate spike in that time window
+    kernel : np vector
+        smoothing kernel (see ephyspipe.smoothing); default = 49 ms boxcar
 
     Returns:
     -------
     train_smoothed : np vector
-        train with 50 ms boxcar smoothing
+        train with 50 ms boxcar smoothing (or other kernel)
 
     """
     # define boxcar smooth
-    box = signal.boxcar(49) / 49
+    if kernel is None:
+        kernel = boxcar_kernel(49)
 
     # apply smoothing
-    train_smoothed = np.convolve(train, box, "same")
+    train_smoothed = smooth(train, kernel)
 
     return train_smoothed
 
 
-def chop(long_brain, sync_points, window):
+def chop(long_brain, sync_points, window, dtype=np.float64, out=None,
+         copy=True, block=2**22):
     """
     Chop up 2 hr session into snippets around sync points.
 
+    All units are gathered in one vectorized pass per block of sync points,
+    straight into a (preallocated) sync_points x time x units output.
+
     Parameters:
     ----------
-    long_brain : 2D np array
+    long_brain : 2D np array or SpikeRaster
         units x time (e.g. spike train, LFP magnitude)
     sync_points : np vector
         sync points across session, e.g. start time for all trials
     window : tuple (2 element)
         time window around sync point (in seconds)
+    dtype : np dtype
+        output dtype, e.g. np.float32 to halve memory; default float64
+    out : 3D np array
+        preallocated output, sync_points x time x units; None = make one
+    copy : bool
+        False = if sync points are evenly spaced (e.g. back to back
+        epochs) and none are missing, return a read only strided view into
+        long_brain instead of copying (ignores dtype and out); True
+        (default) = always copy
+    block : int
+        max values gathered per pass, bounds temporary memory
 
     Returns:
     -------
@@ -189,21 +276,45 @@ def chop(long_brain, sync_points, window):
     nt = t_idx.shape[0]
 
     # sync point index
-    sync_idx = np.round(sync_points * 1000)  # use ms!
+    sync_idx = np.round(np.asarray(sync_points) * 1000)  # use ms!
     sync_idx[sync_idx == -1000] = -1  # manual fix; trials are missing events
     nsync = sync_idx.shape[0]
 
-    # make index matrix
-    tile_time = np.tile(t_idx.reshape(1, -1), (nsync, 1))
-    tile_sync = np.tile(sync_idx.reshape(-1, 1), (1, nt))
-
-    long_idx = (tile_time + tile_sync).astype(int)
-    long_idx[tile_sync == -1] = -1  # same manual fix
+    # first time index of each snippet
+    starts = (sync_idx + t_idx[0]).astype(int)
+    starts[sync_idx == -1] = -1  # same manual fix
 
     # chop up each unit...
-    chopped_brain = np.empty((nsync, nt, nunits))
-    for u in range(nunits):
-        chopped_brain[:, :, u] = long_brain[u, :][long_idx]
+    if isinstance(long_brain, SpikeRaster):
+        # ...or bin only the spikes around each sync point
+        chopped_brain = long_brain.windows(starts, nt)
+        chopped_brain[sync_idx == -1] = long_brain.windows(
+            [long_brain.ntimes - 1], 1)  # same manual fix
+        if out is not None:
+            out[...] = chopped_brain
+            chopped_brain = out
+        else:
+            chopped_brain = chopped_brain.astype(dtype, copy=False)
+    elif not copy and _is_regular(starts, nt, long_brain.shape[1]):
+        # strided view: units x windows x time, then sync x time x units
+        step = starts[1] - starts[0] if nsync > 1 else 1
+        windows = np.lib.stride_tricks.sliding_window_view(
+            long_brain, nt, axis=1)
+        chopped_brain = windows[:, starts[0]::step][:, :nsync].transpose(
+            1, 2, 0)
+    else:
+        if out is None:
+            out = np.empty((nsync, nt, nunits), dtype=dtype)
+
+        # time x units view, so each index pulls out all units at once
+        long_idx = starts.reshape(-1, 1) + np.arange(nt)
+        long_idx[starts == -1] = -1  # same manual fix
+        by_time = long_brain.T
+        nblock = max(1, block // max(1, nt * nunits))
+        for first in range(0, nsync, nblock):
+            last = min(first + nblock, nsync)
+            out[first:last] = by_time[long_idx[first:last]]
+        chopped_brain = out
 
     if nunits == 1:
         chopped_brain = np.squeeze(chopped_brain)
@@ -211,35 +322,95 @@ def chop(long_brain, sync_points, window):
     return chopped_brain
 
 
-def sliding_avg(data, ts, time_range, window, step=0.25):
+def _is_regular(starts, width, ntimes):
+    """Windows evenly spaced, none missing, all inside the session."""
+    if starts.shape[0] == 0 or starts.min() < 0:
+        return False
+    if starts.max() + width > ntimes:
+        return False
+    if starts.shape[0] == 1:
+        return True
+    step = np.diff(starts)
+
+    return step[0] > 0 and np.all(step == step[0])
+
+
+def chop_spikes(timestamps, sync_points, window, kernel=None, fr=True):
+    """
+    Chop firing rates around sync points straight from spike timestamps,
+    without making spike trains or firing rates for the entire session;
+    each spike is read once and only the windows are binned and smoothed.
+    Same output as chop(get_fr(raster), sync_points, window).
+
+    Parameters:
+    ----------
+    timestamps : list
+        np vectors, times each unit fired (in sec); e.g. [data[u] for u in
+        unit_names] from the loaded spk data
+    sync_points : np vector
+        sync points across session, e.g. start time for all trials
+    window : tuple (2 element)
+        time window around sync point (in seconds)
+    kernel : np vector
+        smoothing kernel (see ephyspipe.smoothing); default = 49 ms boxcar
+    fr : bool
+        default 1 = firing rates, 0 = spike trains
+
+    Returns:
+    -------
+    chopped_brain : 3D np array
+        sync_points x time x units
+
+    """
+    # session length as in process_raw_spk: last spike, +1 second
+    last_spk = [np.max(ts) for ts in timestamps if np.size(ts)]
+    ntimes = np.round(1000 * (1 + max(last_spk, default=0)))
+
+    raster = SpikeRaster.from_timestamps(timestamps, ntimes)
+    if fr:
+        raster = get_fr(raster, kernel)
+
+    return chop(raster, sync_points, window)
+
+
+def sliding_avg(data, ts, time_range, window, step=0.25, fs=1000,
+                overwrite=False):
     """
     Downsample by averaging in window offset by step (window fraction)
-    along axis=1 (time). Assume data @ 1 kHz, and window given in
-    seconds; step is fraction of window.
+    along axis=1 (time); window given in seconds, step is fraction of
+    window.
 
-    TODO: make this more flexible for other time units; will still run right
-    now but results could be incorrect...
+    Window sums come from one cumulative sum along time, so the cost is
+    O(ntimes) whatever the window size and step, and several window sizes
+    can share it.
 
     Parameters:
     ----------
-    data : 3D np array
-        sync points x time x sources, sampled at 1 kHz; sources are units
-        or channels
+    data : 3D np array or SpikeRaster
+        sync points x time x sources, sampled at fs; sources are units
+        or channels; SpikeRaster is treated as a single sync point spanning
+        the entire session
     ts : np vector
         timestamps corresponding to time axis in data, assume seconds
     time_range : tuple
         restricted time range from full ts
-    window : float
-        size of averging window
+    window : float or list
+        size of averaging window (in seconds); list = one output for each
+        window size
     step : float
         offset between averaging windows, given by fraction of
         window; must be >0, and 1 = no overlap.
+    fs : float
+        sample rate of data, Hz; default 1 kHz
+    overwrite : bool
+        True = do the cumulative sum in place, in data's (float) dtype,
+        e.g. float32 with no extra session-sized copy; data is overwritten
 
     Returns:
     -------
-    mid_times : np vector
+    mid_times : np vector, or list (if window is list)
         time stamps for smoothed data
-    data_smooth : 2D np array
+    data_smooth : 3D np array, or list (if window is list)
         smoothed data: sync_points x time x sources
     """
 
@@ -255,42 +426,71 @@ def sliding_avg(data, ts, time_range, window, step=0.25):
     adjusted_time_range = np.array([
         np.max([time_range[0], ts[0]]),
         np.min([time_range[1], ts[-1]])])
+    first_idx = np.argmin(np.abs(ts - adjusted_time_range[0]))
+    last_idx = np.argmin(np.abs(ts - adjusted_time_range[1]))
+
+    # cumulative sum along time, shared by all window sizes
+    if not isinstance(data, SpikeRaster):
+        if overwrite:
+            csum = np.cumsum(data, axis=1, out=data)
+        else:
+            csum = np.cumsum(data, axis=1, dtype=np.float64)
+
+    mid_times = []
+    data_smooth = []
+    for win in np.atleast_1d(window):
+        # set window and offset sizes, in samples
+        window_n = np.round(fs * win)
+        offset_n = np.round(window_n * step)
+
+        # find midpoints for averaging windows
+        start_idx = np.floor(first_idx + window_n/2)
+        stop_idx = np.ceil(1 + last_idx - window_n/2)
+        mid_idx = np.arange(start_idx, stop_idx, offset_n).astype(int)
+        mid_times.append(ts[mid_idx])
+
+        # first sample and width of each window
+        starts = mid_idx - int(np.floor(window_n / 2))
+        width = int(np.floor(window_n / 2) + np.ceil(window_n / 2))
+
+        # do sliding averages
+        if isinstance(data, SpikeRaster):
+            data_smooth.append(
+                data.window_mean(starts, width).T.reshape(1, -1, data.nunits))
+        else:
+            data_smooth.append(_window_means(csum, starts, width))
+
+    if np.ndim(window) == 0:
+        return mid_times[0], data_smooth[0]
 
-    # get size of data
-    nsync, ntimes, nsources = data.shape
-
-    # set window and offset sizes, in ms
-    window_ms = np.round(1000 * window)
-    offset_ms = np.round(window_ms * step)
-
-    # find midpoints for averaging windows
-    start_idx = np.floor(np.argmin(np.abs(ts - adjusted_time_range[0]))
-                         + window_ms/2)
-    stop_idx = np.ceil(1 + np.argmin(np.abs(ts - adjusted_time_range[1]))
-                       - window_ms/2)
-    mid_idx = np.arange(start_idx, stop_idx, offset_ms).astype(int)
-    mid_times = ts[mid_idx]
+    return mid_times, data_smooth
 
-    # do sliding averages
-    data_smooth = np.empty((nsync, len(mid_idx), nsources))
-    t_idx = np.arange(-np.floor(window_ms / 2),
-                      np.ceil(window_ms / 2)).astype(int)
 
-    for i in range(len(mid_idx)):
-        data_smooth[:, i, :] = data[:, mid_idx[i] + t_idx, :].mean(axis=1)
+def _window_means(csum, starts, width):
+    """Means over windows along axis 1, from inclusive cumulative sums."""
+    sums = csum[:, starts + width - 1, :]
+    before = csum[:, np.maximum(starts - 1, 0), :]
+    before[:, starts == 0, :] = 0
+    sums -= before
+    sums /= width
 
-    return mid_times, data_smooth
+    return sums
 
 
 def process_raw_lfp(lfp_fname, sync_point, time_range,
-                    channels=-1, broadband=0, nthreads=2):
+                    channels=-1, broadband=0, nthreads=2, nworkers=1,
+                    max_memory=None, events_only=False, pad=None,
+                    zscore_samples=20, method="filtfilt", filter_bank=None,
+                    cache=None, precision="double", quantize=False,
+                    lazy=False, max_bytes=2**30, spill_dir=None):
     """
-    Load raw lfp (.pl2 saved as .mat)
+    Load raw lfp (.pl2, or .pl2 saved as .mat)
 
     Parameters:
     ----------
     lfp_fname : string
-        Path file for raw lfp data
+        Path file for raw lfp data (.pl2 needs Plexon's pypl2, see
+        readers.PL2Reader)
     sync_point : np vector
         Times to sync across session (e.g. trial start)
     time_range : 2 element tuple
@@ -298,9 +498,62 @@ def process_raw_lfp(lfp_fname, sync_point, time_range,
     channels : list
         Integers; restrict to these channels; -1 = all
     broadband : bool
-        default 0 = split into freq bands, 1 = do broadband (2-200 Hz)
+        default 0 = split into freq bands, 1 = do broadband (2-200 Hz);
+        ignored if filter_bank is given
     nthreads : int
         number of threads for threadpool; default = 2
+    nworkers : int
+        number of processes; default = 1 (serial over channels, with
+        nthreads over bands); > 1 spreads (channel, band) pairs across a
+        process pool, with identical results
+    max_memory : int
+        bytes; cap number of processes so their working arrays fit; None =
+        no cap
+    events_only : bool
+        default 0 = filter entire session; 1 = only filter padded segments
+        around sync points, zscore with estimated session statistics (see
+        get_bandpassed_events)
+    pad : int
+        events_only: samples of padding around each segment; None = sized
+        from filter and smoothing kernel lengths
+    zscore_samples : int
+        events_only: number of random blocks for zscore statistics; None =
+        stream through the entire session
+    method : string
+        "filtfilt" (default) = filtfilt + hilbert for each band; "fft" =
+        transform each channel once and apply all bands and the Hilbert
+        step in the frequency domain (see filters.ChannelSpectrum)
+    filter_bank : FilterBank
+        notch and bandpass filters (e.g. custom bands); None = 60/120/180
+        Hz notches and default bands (or broadband), @ 1 kHz
+    cache : SessionCache or string
+        cache (directory) for outputs; on repeat calls with the same file
+        and parameters, arrays come back as read only np.memmap; None =
+        no cache
+    precision : string
+        "double" (default) = float64 / complex128 throughout; "single" =
+        float32 / complex64, with scratch buffers reused across bands and
+        channels (lazy: across channels of a band); about half the memory
+        and bandwidth. Vs double, zscored magnitude is within 1e-4 and
+        phase within ~1e-3 rad (see get_analytic)
+    quantize : bool
+        default 0 = float outputs; 1 = magnitude as float16 (~3
+        significant digits) and phase as int16 (see quantize_phase;
+        resolution 1e-4 rad)
+    lazy : bool
+        default 0 = filter all bands up front; 1 = return a LazyBands
+        instead, which filters each band (all channels) the first time
+        it's asked for, e.g. result["beta"].mag (see bands.LazyBands);
+        can't be cached. Notched channels (session long) are kept while
+        they fit in max_bytes, so later bands only add their bandpass
+        (except with events_only or nworkers > 1, which load each time)
+    max_bytes : int
+        lazy: memory for computed bands and notched channels; notched
+        channels, then least recently used bands are dropped (or
+        spilled) past this; default = 1 GiB
+    spill_dir : string
+        lazy: directory to spill dropped bands to (and memory map back
+        from); None = recompute them
 
     Returns:
     -------
@@ -316,74 +569,192 @@ def process_raw_lfp(lfp_fname, sync_point, time_range,
 
     """
 
-    # get channel names
-    f = h5py.File(lfp_fname, "r")
-    channel_names = [key for key in f.keys() if key.find("FP") == 0]
-    if channels != -1:
-        channel_names = [ch for ch in channel_names if int(ch[2:]) in channels]
+    if cache is not None:
+        if lazy:
+            raise ValueError("can't cache lazy outputs; pick one")
+        params = {"sync_point": sync_point, "time_range": time_range,
+                  "channels": channels, "broadband": broadband,
+                  "events_only": events_only, "pad": pad,
+                  "zscore_samples": zscore_samples, "method": method,
+                  "filter_bank": filter_bank, "precision": precision,
+                  "quantize": quantize}
+        extra = {"nthreads": nthreads, "nworkers": nworkers,
+                 "max_memory": max_memory}
+        return as_cache(cache).cached(process_raw_lfp, lfp_fname, params,
+                                      extra)
+
+    # get notch and bandpass filters (designed once, then reused)
+    if filter_bank is None:
+        if broadband:  # spit out broadband signal
+            filter_bank = FilterBank(bands=BROADBAND)
+        else:  # bandpass into typical frequencies
+            filter_bank = FilterBank()
+    filter_bank.check_fs(1000)  # LFP is handled in ms throughout
+    notch_filts = filter_bank.notch_filts
+    band_filts = filter_bank.band_filts
+    band_names = filter_bank.band_names
+
+    # open file once (closed on errors too): channel names, lfp time, and
+    # bands unless lazy
+    with open_reader(lfp_fname) as reader:
+        channel_names = reader.channel_names
+        if channels != -1:
+            channel_names = [ch for ch in channel_names
+                             if int(ch[2:]) in channels]
+
+        # get lfp time
+        ts_long = reader.read_ts()/1000  # time in seconds
+
+        # get bandpassed signal and chop into trials
+        if not lazy:
+            band_mag_chopped_np, band_phs_chopped_np = \
+                get_bandpassed_channels(
+                    channel_names, reader, ts_long, sync_point, time_range,
+                    notch_filts, band_filts, nthreads, nworkers, max_memory,
+                    events_only, pad, zscore_samples, method, precision,
+                    quantize)
 
-    # get lfp time
-    data = mat73.loadmat(lfp_fname, only_include="lfp_ts")
-    ts_long = data["lfp_ts"]/1000  # time in seconds
+    # get chopped time index
+    ts_chopped = np.arange(time_range[0], time_range[1], 0.001)
 
-    # make notch filters
-    notch_hz = [60, 120, 180]  # Hz
-    notch_filts = [signal.iirnotch(n, n, 1000) for n in notch_hz]
+    # save meta data for these channels
+    lfp_meta = pd.DataFrame({"ID": channel_names})
 
-    # make bandpass filters
-    if broadband:  # spit out broadband signal
-        band_hz = [[2, 200]]
-        band_names = ["broadband"]
-    else:  # bandpass into typical frequencies
-        band_hz = [[2, 4], [4, 8], [8, 12],
-                   [12, 30], [30, 60], [70, 200]]  # Hz
-        band_names = ["delta", "theta", "alpha", "beta", "gamma", "high gamma"]
-    band_filts = [signal.firwin(1000, [b[0], b[1]], pass_zero=False,
-                                fs=1000) for b in band_hz]
+    # each band bandpassed and chopped the first time it's asked for;
+    # notched channels kept for later bands, as far as max_bytes allows
+    if lazy:
+        def compute(b):
+            mag, phs = get_bandpassed_channels(
+                channel_names, lfp_fname, ts_long, sync_point, time_range,
+                notch_filts, [band_filts[b]], nthreads, nworkers,
+                max_memory, events_only, pad, zscore_samples, method,
+                precision, quantize, bands)
+            return mag[0], phs[0]
+
+        bands = LazyBands(compute, band_names, ts_chopped, lfp_meta,
+                          max_bytes, spill_dir)
+        return bands
 
-    # get chopped time index
-    ts_chopped = np.arange(time_range[0], time_range[1], 0.001)
+    return band_mag_chopped_np, band_phs_chopped_np, ts_chopped, lfp_meta
 
-    # init dicts to keep track of all channels
-    band_mag_chopped = dict()
-    band_phs_chopped = dict()
-    for b in band_names:
-        band_mag_chopped[b] = [None] * len(channel_names)
-        band_phs_chopped[b] = [None] * len(channel_names)
-
-    # get bandpassed signal and chop into trials
-    for ch in range(len(channel_names)):  # TODO: PARALLELIZE!
-        print('working on band pass...' + channel_names[ch])
-        # load, notch, and bandpass this channel
-        mag_chopped, phs_chopped = get_bandpassed(
-                                   channel_names[ch],
-                                   lfp_fname,
-                                   ts_long,
-                                   sync_point,
-                                   time_range,
-                                   notch_filts,
-                                   band_filts,
-                                   nthreads)
 
-        # slot in results
-        for b in range(len(band_names)):
-            band_mag_chopped[band_names[b]][ch] = mag_chopped[b]
-            band_phs_chopped[band_names[b]][ch] = phs_chopped[b]
+def get_bandpassed_channels(channel_names, fname, ts, sync_point, time_range,
+                            notch_filts, band_filts, nthreads=2, nworkers=1,
+                            max_memory=None, events_only=False, pad=None,
+                            zscore_samples=20, method="filtfilt",
+                            precision="double", quantize=False,
+                            notched=None):
+    """
+    Get mag and phase for bandpassed LFP channels, chopped into 3D arrays;
+    serial over channels (with threads over bands), or in a process pool.
 
-    # cat all channels together for 3D array: sync_points x time x channels
-    band_mag_chopped_np = [np.stack(band_mag_chopped[b], axis=2)
-                           for b in band_names]
-    band_phs_chopped_np = [np.stack(band_phs_chopped[b], axis=2)
-                           for b in band_names]
+    Parameters:
+    ----------
+    channel_names : list
+        channel IDs
+    fname : string or PL2MatReader
+        path to LFP data, or open reader
+    ts : np vector
+        time stamps for LFP timeseries (in seconds)
+    sync_point : np vector
+        timestamps of events to align
+    time_range : tuple
+        time around sync points
+    notch_filts : list
+        notch filters
+    band_filts : list
+        bandpass filters
+    nthreads, nworkers, max_memory, events_only, pad, zscore_samples,
+    method, precision, quantize :
+        see process_raw_lfp
+    notched : LazyBands
+        keeps notched channels across calls (see get_bandpassed); not
+        used with events_only or nworkers > 1
 
-    # save meta data for these channels
-    lfp_meta = pd.DataFrame({"ID": channel_names})
+    Returns:
+    -------
+    band_mag_chopped_np : list
+        of 3D np arrays with each bandpass magnitude; sync_points x
+        time x channels
+    band_phs_chopped_np : list
+        of 3D np arrays with each bandpass phase; sync_points x time x
+        channels
 
-    return band_mag_chopped_np, band_phs_chopped_np, ts_chopped, lfp_meta
+    """
+    if nworkers > 1:
+        if isinstance(fname, PL2MatReader):
+            fname = fname.fname
+        band_mag_chopped_np, band_phs_chopped_np = get_bandpassed_in_pool(
+            channel_names, fname, ts, sync_point, time_range, notch_filts,
+            band_filts, nworkers, max_memory, events_only, pad,
+            zscore_samples, method, precision)
+
+    elif not isinstance(fname, PL2MatReader):
+        with open_reader(fname) as reader:
+            return get_bandpassed_channels(
+                channel_names, reader, ts, sync_point, time_range,
+                notch_filts, band_filts, nthreads, nworkers, max_memory,
+                events_only, pad, zscore_samples, method, precision,
+                quantize, notched)
+
+    else:
+        # preallocate 3D arrays: sync_points x time x channels
+        nsync = np.size(sync_point)
+        nt = np.arange(time_range[0] * 1000, time_range[1] * 1000).shape[0]
+        out_shape = (nsync, nt, len(channel_names))
+        dtype = PRECISIONS[precision]
+        band_mag_chopped_np = [np.empty(out_shape, dtype) for b in band_filts]
+        band_phs_chopped_np = [np.empty(out_shape, dtype) for b in band_filts]
+
+        # one thread pool for all channels, so its scratch buffers are too
+        with ThreadPoolExecutor(nthreads) as executor:
+            for ch in range(len(channel_names)):
+                logger.info("working on band pass...%s", channel_names[ch])
+                # load, notch, and bandpass this channel
+                if events_only:
+                    mag_chopped, phs_chopped = get_bandpassed_events(
+                                               channel_names[ch],
+                                               fname,
+                                               sync_point,
+                                               time_range,
+                                               notch_filts,
+                                               band_filts,
+                                               pad,
+                                               zscore_samples,
+                                               method=method,
+                                               precision=precision)
+                else:
+                    mag_chopped, phs_chopped = get_bandpassed(
+                                               channel_names[ch],
+                                               fname,
+                                               ts,
+                                               sync_point,
+                                               time_range,
+                                               notch_filts,
+                                               band_filts,
+                                               nthreads,
+                                               method,
+                                               precision,
+                                               notched,
+                                               executor)
+
+                # slot in results
+                for b in range(len(band_filts)):
+                    band_mag_chopped_np[b][:, :, ch] = mag_chopped[b]
+                    band_phs_chopped_np[b][:, :, ch] = phs_chopped[b]
+
+    if quantize:
+        band_mag_chopped_np = [m.astype(np.float16)
+                               for m in band_mag_chopped_np]
+        band_phs_chopped_np = [quantize_phase(p)
+                               for p in band_phs_chopped_np]
+
+    return band_mag_chopped_np, band_phs_chopped_np
 
 
 def get_bandpassed(chname, fname, ts, sync_point, time_range,
-                   notch_filts, band_filts, nthreads):
+                   notch_filts, band_filts, nthreads, method="filtfilt",
+                   precision="double", notched=None, executor=None):
     """
     Get mag and phase for bandpassed LFP channel.
 
@@ -392,8 +763,8 @@ def get_bandpassed(chname, fname, ts, sync_point, time_range,
     ----------
     chname : string
         channel ID
-    lfp_name : string
-        path to LFP data
+    fname : string or PL2MatReader
+        path to LFP data, or open reader
     ts : np vector
         time stamps for LFP timeseries (in seconds)
     sync_point : np vector
@@ -406,6 +777,17 @@ def get_bandpassed(chname, fname, ts, sync_point, time_range,
         bandpass filters
     nthreads : int
         number of threads for threadpool
+    method : string
+        "filtfilt" (default) or "fft" (see process_raw_lfp)
+    precision : string
+        "double" (default) or "single" (see process_raw_lfp)
+    notched : LazyBands
+        keeps notched channels (shared, by channel ID) across calls, e.g.
+        one band at a time, if there's room (see LazyBands.share); None
+        = load and notch each time
+    executor : ThreadPoolExecutor
+        thread pool to run bands in, e.g. shared across channels (so are
+        its threads' scratch buffers); None = new pool of nthreads
 
     Returns:
     -------
@@ -416,23 +798,33 @@ def get_bandpassed(chname, fname, ts, sync_point, time_range,
 
     """
 
-    # load lfp channel
-    data = mat73.loadmat(fname, only_include=chname)
-    channel = data[chname]
-
-    # apply notch filters serially
-    for notch in notch_filts:
-        channel = signal.filtfilt(notch[0], notch[1], channel)
+    # load lfp channel, apply notch filters (or reuse)
+    channel = None
+    if notched is not None:
+        channel = notched.shared.get(chname)
+    if channel is None:
+        channel = get_notched(chname, fname, notch_filts,
+                              dtype=PRECISIONS[precision])
+        if notched is not None:
+            notched.share(chname, channel)
+    if method == "fft":
+        channel = ChannelSpectrum(channel, max([len(b) for b in band_filts]))
 
     # submit each band pass and chop as a thread
-    executor = ThreadPoolExecutor(nthreads)
-    futures = [executor.submit(do_bands_in_parallel,
-                               channel,
-                               band,
-                               time_range,
-                               sync_point) for band in band_filts]
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(nthreads)
+    try:
+        futures = [executor.submit(do_bands_in_parallel,
+                                   channel,
+                                   band,
+                                   time_range,
+                                   sync_point) for band in band_filts]
 
-    outcomes = [f.result() for f in futures]
+        outcomes = [f.result() for f in futures]
+    finally:
+        if own_executor:
+            executor.shutdown()
 
     mag_chopped = [out[0] for out in outcomes]
     phs_chopped = [out[1] for out in outcomes]
@@ -440,6 +832,221 @@ def get_bandpassed(chname, fname, ts, sync_point, time_range,
     return mag_chopped, phs_chopped
 
 
+def get_notched(chname, fname, notch_filts, start=0, stop=None,
+                dtype=np.float64):
+    """
+    Load LFP channel and apply notch filters.
+
+    Parameters:
+    ----------
+    chname : string
+        channel ID
+    fname : string or PL2MatReader
+        path to LFP data, or open reader
+    notch_filts : list
+        notch filters
+    start : int
+        first sample to load; default = 0
+    stop : int
+        last sample to load (exclusive); None = end of session
+    dtype : np dtype
+        float64 (default) or float32; read and filter in this precision
+
+    Returns:
+    -------
+    channel : np vector
+        broadband LFP signal (after notch filtering)
+
+    """
+    def read(reader):
+        last = reader.length(chname) if stop is None else stop
+        return reader.read(chname, np.empty(last - start, dtype), start, last)
+
+    # load lfp channel
+    with stage("load", channel=chname, start=start) as record:
+        if isinstance(fname, PL2MatReader):
+            channel = read(fname)
+        else:
+            with open_reader(fname) as reader:
+                channel = read(reader)
+        add_array(record, channel)
+
+    # apply notch filters serially
+    with stage("notch", channel=chname, nsamples=channel.shape[0]):
+        for notch in notch_filts:
+            channel = signal.filtfilt(np.asarray(notch[0], dtype),
+                                      np.asarray(notch[1], dtype), channel)
+
+    return channel
+
+
+def get_bandpassed_in_pool(channel_names, fname, ts, sync_point, time_range,
+                           notch_filts, band_filts, nworkers,
+                           max_memory=None, events_only=False, pad=None,
+                           zscore_samples=20, method="filtfilt",
+                           precision="double"):
+    """
+    Get mag and phase for all bandpassed LFP channels, spreading
+    (channel, band) pairs across a process pool. Each process writes its
+    chopped results straight into output arrays shared through memory
+    mapped files, so only the work item is pickled.
+
+    Parameters:
+    ----------
+    channel_names : list
+        channel IDs
+    fname : string
+        path to LFP data
+    ts : np vector
+        time stamps for LFP timeseries (in seconds)
+    sync_point : np vector
+        timestamps of events to align
+    time_range : tuple
+        time around sync points
+    notch_filts : list
+        notch filters
+    band_filts : list
+        bandpass filters
+    nworkers : int
+        number of processes
+    max_memory : int
+        bytes; cap number of processes so their working arrays fit; None =
+        no cap
+    events_only : bool
+        only filter padded segments around sync points (see
+        get_bandpassed_events)
+    pad : int
+        events_only: samples of padding around each segment
+    zscore_samples : int
+        events_only: number of random blocks for zscore statistics
+    method : string
+        "filtfilt" (default) or "fft" (see process_raw_lfp)
+    precision : string
+        "double" (default) or "single" (see process_raw_lfp)
+
+    Returns:
+    -------
+    band_mag_chopped_np : list
+        of 3D np arrays with each bandpass magnitude; sync_points x
+        time x channels
+    band_phs_chopped_np : list
+        of 3D np arrays with each bandpass phase; sync_points x time x channels
+
+    """
+    nch = len(channel_names)
+    nbands = len(band_filts)
+    nsync = np.size(sync_point)
+    nt = np.arange(time_range[0] * 1000, time_range[1] * 1000).shape[0]
+
+    # each process holds ~12 full length float arrays (notched channel,
+    # filtfilt padding, complex analytic signal, magnitude, phase...)
+    dtype = PRECISIONS[precision]
+    if max_memory is not None:
+        per_worker = 12 * np.dtype(dtype).itemsize * ts.shape[0]
+        nworkers = int(max(1, min(nworkers, max_memory // per_worker)))
+
+    # preallocate shared outputs; prefer RAM-backed tmpfs
+    shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    out_dir = tempfile.mkdtemp(dir=shm_dir)
+    out_shape = (nbands, nsync, nt, nch)
+    out_fnames = [os.path.join(out_dir, "mag.dat"),
+                  os.path.join(out_dir, "phs.dat")]
+
+    try:
+        for out_fname in out_fnames:
+            np.memmap(out_fname, dtype, "w+", shape=out_shape).flush()
+
+        # channel major, so a chunk of one channel's bands lands on the
+        # same process and the channel is loaded and notched once
+        items = [(ch, b) for ch in range(nch) for b in range(nbands)]
+        with ProcessPoolExecutor(nworkers,
+                                 initializer=_init_pool_worker,
+                                 initargs=(channel_names, fname, sync_point,
+                                           time_range, notch_filts,
+                                           band_filts, out_fnames,
+                                           out_shape, events_only, pad,
+                                           zscore_samples, method,
+                                           precision)) as executor:
+            list(executor.map(_do_pool_item, items, chunksize=nbands))
+
+        outputs = [np.array(np.memmap(out_fname, dtype, "r",
+                                      shape=out_shape))
+                   for out_fname in out_fnames]
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    band_mag_chopped_np = [outputs[0][b] for b in range(nbands)]
+    band_phs_chopped_np = [outputs[1][b] for b in range(nbands)]
+
+    return band_mag_chopped_np, band_phs_chopped_np
+
+
+# per-process state for get_bandpassed_in_pool
+_pool_state = dict()
+
+
+def _init_pool_worker(channel_names, fname, sync_point, time_range,
+                      notch_filts, band_filts, out_fnames, out_shape,
+                      events_only=False, pad=None, zscore_samples=20,
+                      method="filtfilt", precision="double"):
+    """Set up process for get_bandpassed_in_pool; open shared outputs."""
+    _pool_state.clear()
+    _pool_state.update({"channel_names": channel_names,
+                        "reader": open_reader(fname),
+                        "sync_point": sync_point,
+                        "time_range": time_range,
+                        "notch_filts": notch_filts,
+                        "band_filts": band_filts,
+                        "outputs": [np.memmap(out_fname,
+                                              PRECISIONS[precision], "r+",
+                                              shape=out_shape)
+                                    for out_fname in out_fnames],
+                        "events_only": events_only,
+                        "pad": pad,
+                        "zscore_samples": zscore_samples,
+                        "method": method,
+                        "precision": precision,
+                        "notched": (None, None)})
+
+
+def _do_pool_item(item):
+    """Bandpass and chop one (channel, band) pair into shared outputs."""
+    ch, b = item
+    state = _pool_state
+    chname = state["channel_names"][ch]
+
+    if state["events_only"]:
+        mag_chopped, phs_chopped = get_bandpassed_events(
+            chname, state["reader"], state["sync_point"],
+            state["time_range"], state["notch_filts"],
+            [state["band_filts"][b]], state["pad"], state["zscore_samples"],
+            method=state["method"], precision=state["precision"])
+        mag_chopped, phs_chopped = mag_chopped[0], phs_chopped[0]
+
+    else:
+        # reuse notched channel across its bands
+        if state["notched"][0] != chname:
+            logger.info("working on band pass...%s", chname)
+            channel = get_notched(chname, state["reader"],
+                                  state["notch_filts"],
+                                  dtype=PRECISIONS[state["precision"]])
+            if state["method"] == "fft":
+                channel = ChannelSpectrum(
+                    channel, max([len(f) for f in state["band_filts"]]))
+            state["notched"] = (chname, channel)
+
+        mag_chopped, phs_chopped = do_bands_in_parallel(
+            state["notched"][1], state["band_filts"][b],
+            state["time_range"], state["sync_point"])
+
+    # write straight into shared outputs
+    mag_out, phs_out = state["outputs"]
+    mag_out[b, :, :, ch] = mag_chopped.reshape(mag_out.shape[1:3])
+    phs_out[b, :, :, ch] = phs_chopped.reshape(phs_out.shape[1:3])
+    mag_out.flush()
+    phs_out.flush()
+
+
 def do_bands_in_parallel(lfp_channel, band_coeffs,
                          time_range, sync_pictures_ts):
     """
@@ -447,7 +1054,7 @@ def do_bands_in_parallel(lfp_channel, band_coeffs,
 
     Parameters:
     ----------
-    lfp_channel : np vector
+    lfp_channel : np vector or ChannelSpectrum
         broadband LFP signal (after notch filtering)
     band_coeffs : np vector
         coefficients for bandpass
@@ -465,23 +1072,343 @@ def do_bands_in_parallel(lfp_channel, band_coeffs,
 
     """
 
-    # bandpass LFP signal
-    bandpassed = signal.filtfilt(band_coeffs, 1, lfp_channel)
+    # bandpass LFP signal, get smoothed magnitude and phase
+    mag_raw, phs = get_analytic(lfp_channel, band_coeffs)
+
+    # zscore magnitude
+    with stage("zscore", nsamples=mag_raw.shape[0]):
+        if mag_raw.dtype == np.float32:
+            # in place, in the scratch buffer; statistics in float64
+            mag = mag_raw
+            mag_mean = mag.mean(dtype=np.float64)
+            mag_std = mag.std(dtype=np.float64)
+            mag -= mag_mean
+            mag /= mag_std
+        else:
+            mag = stats.zscore(mag_raw)
 
-    # get analytic amplitude
-    analytic = signal.hilbert(bandpassed)
+    # chop by sync points
+    with stage("chop", nsync=len(sync_pictures_ts)) as record:
+        mag_chopped = chop(mag.reshape(1, -1),
+                           sync_pictures_ts, time_range, dtype=mag.dtype)
+        phs_chopped = chop(phs.reshape(1, -1),
+                           sync_pictures_ts, time_range, dtype=phs.dtype)
+        add_array(record, mag_chopped)
 
-    # extract magnitude, zscore
-    mag_raw = train_to_fr(np.abs(analytic))
-    mag = stats.zscore(mag_raw)
+    return mag_chopped, phs_chopped
 
-    # extract phase
-    phs = np.angle(analytic)
 
-    # chop by sync points
-    mag_chopped = chop(mag.reshape(1, -1),
-                       sync_pictures_ts, time_range)
-    phs_chopped = chop(phs.reshape(1, -1),
-                       sync_pictures_ts, time_range)
+def get_analytic(lfp_channel, band_coeffs):
+    """
+    Bandpass LFP signal, then get magnitude and phase of analytic signal.
+
+    Precision follows the channel: float32 (or a ChannelSpectrum of one)
+    is filtered in float32 / complex64, and magnitude and phase are
+    written into per-thread scratch buffers, reused by the next call in
+    the same thread (copy to keep). Against the float64 path, single
+    precision stays within 1e-4 of the band magnitude's standard
+    deviation (i.e. 1e-4 in zscored units) and ~1e-3 rad of phase (more
+    where magnitude is near 0 and phase is ill defined).
+
+    Parameters:
+    ----------
+    lfp_channel : np vector or ChannelSpectrum
+        broadband LFP signal (after notch filtering); for ChannelSpectrum,
+        bandpass and Hilbert transform in one inverse FFT
+    band_coeffs : np vector
+        coefficients for bandpass
+
+    Returns:
+    -------
+    mag_raw : np vector
+        band magnitude, smoothed with 50 ms boxcar (not zscored)
+    phs : np vector
+        band phase
+
+    """
+
+    ntaps = len(band_coeffs)
+    if isinstance(lfp_channel, ChannelSpectrum):
+        with stage("bandpass_hilbert", ntaps=ntaps, nsamples=lfp_channel.n):
+            analytic = lfp_channel.analytic(band_coeffs)
+    elif lfp_channel.dtype == np.float32:
+        # bandpass LFP signal, then analytic signal, in single precision
+        with stage("bandpass", ntaps=ntaps, nsamples=lfp_channel.shape[0]):
+            bandpassed = signal.filtfilt(
+                np.asarray(band_coeffs, np.float32), np.ones(1, np.float32),
+                lfp_channel)
+        with stage("hilbert", nsamples=bandpassed.shape[0]):
+            analytic = _analytic_signal(bandpassed)
+    else:
+        # bandpass LFP signal
+        with stage("bandpass", ntaps=ntaps, nsamples=lfp_channel.shape[0]):
+            bandpassed = signal.filtfilt(band_coeffs, 1, lfp_channel)
+
+        # get analytic amplitude
+        with stage("hilbert", nsamples=bandpassed.shape[0]):
+            analytic = signal.hilbert(bandpassed)
+
+    with stage("magnitude", nsamples=analytic.shape[0]):
+        if analytic.dtype == np.complex64:
+            # magnitude and phase straight into scratch buffers
+            n = analytic.shape[0]
+            mag_raw = np.abs(analytic, out=_scratch.get("mag", n, np.float32))
+            _boxcar_in_place(mag_raw, len(boxcar_kernel()))
+            phs = np.arctan2(analytic.imag, analytic.real,
+                             out=_scratch.get("phs", n, np.float32))
+        else:
+            # extract magnitude
+            mag_raw = train_to_fr(np.abs(analytic))
+
+            # extract phase
+            phs = np.angle(analytic)
+
+    return mag_raw, phs
+
+
+def _analytic_signal(x):
+    """Same as signal.hilbert, but in x's precision and in place."""
+    n = x.shape[0]
+    spectrum = sp_fft.fft(x)
+
+    # double positive frequencies, drop negative ones
+    spectrum[1:(n + 1) // 2] *= 2
+    spectrum[n // 2 + 1:] = 0
+
+    return sp_fft.ifft(spectrum, overwrite_x=True)
+
+
+def _boxcar_in_place(x, width):
+    """
+    Same as smooth(x, boxcar_kernel(width)), overwriting x; running sums
+    in float64 (scratch buffer), so long float32 signals keep precision.
+    """
+    n = x.shape[0]
+    csum = _scratch.get("csum", n + 1, np.float64)
+    csum[0] = 0
+    np.cumsum(x, out=csum[1:], dtype=np.float64)
+
+    # window spans [i - width//2, i + (width-1)//2], as in running_sum
+    before = width // 2
+    after = (width - 1) // 2 + 1
+    if n - after + 1 > before:
+        np.subtract(csum[before + after:], csum[:n - before - after + 1],
+                    out=x[before:n - after + 1], casting="same_kind")
+
+    # edges, clipped to the data
+    head = np.arange(min(before, n))
+    tail = np.arange(max(n - after + 1, head.shape[0]), n)
+    x[head] = csum[np.minimum(head + after, n)]
+    x[tail] = csum[n] - csum[np.maximum(tail - before, 0)]
+
+    x *= 1 / width
+
+    return x
+
+
+def quantize_phase(phs):
+    """
+    Phase as int16: radians * PHASE_SCALE, rounded (resolution ~1e-4
+    rad); NaN (e.g. missing events) as PHASE_NAN.
+    """
+    missing = np.isnan(phs)
+    quantized = np.round(np.where(missing, 0, phs) * PHASE_SCALE)
+    quantized = quantized.astype(np.int16)
+    quantized[missing] = PHASE_NAN
+
+    return quantized
+
+
+def dequantize_phase(quantized):
+    """Phase in radians (float32) from quantize_phase output."""
+    phs = quantized.astype(np.float32) / np.float32(PHASE_SCALE)
+    phs[quantized == PHASE_NAN] = np.nan
+
+    return phs
+
+
+def get_bandpassed_events(chname, fname, sync_point, time_range,
+                          notch_filts, band_filts, pad=None,
+                          zscore_samples=20, zscore_block=10000, seed=0,
+                          method="filtfilt", precision="double"):
+    """
+    Get mag and phase for bandpassed LFP channel, only loading and
+    filtering padded segments around sync points instead of the entire
+    session. Magnitude is zscored with session statistics estimated from
+    a random subsample of blocks (or a streamed pass over the session).
+
+    Results match get_bandpassed up to filter edge effects that leak past
+    the padding and the estimated zscore statistics; sync points that are
+    missing (-1) are NaN.
+
+    Parameters:
+    ----------
+    chname : string
+        channel ID
+    fname : string or PL2MatReader
+        path to LFP data, or open reader
+    sync_point : np vector
+        timestamps of events to align
+    time_range : tuple
+        time around sync points
+    notch_filts : list
+        notch filters
+    band_filts : list
+        bandpass filters
+    pad : int
+        samples to add on both sides of each segment; None = 3x the
+        longest bandpass filter (its filtfilt edge effect) plus the
+        smoothing kernel
+    zscore_samples : int
+        number of random blocks for zscore statistics; None = stream
+        through every block in the session
+    zscore_block : int
+        samples per block for zscore statistics
+    seed : int
+        seed for picking random blocks
+    method : string
+        "filtfilt" (default) or "fft" (see process_raw_lfp)
+    precision : string
+        "double" (default) or "single" (see process_raw_lfp)
+
+    Returns:
+    -------
+    mag_chopped : list
+        2D np arrays with band magntiude, sync points x time
+    phs_chopped : list
+        2D np arrays with band phase, sync points x time
+
+    """
+    if not isinstance(fname, PL2MatReader):
+        with open_reader(fname) as reader:
+            return get_bandpassed_events(chname, reader, sync_point,
+                                         time_range, notch_filts,
+                                         band_filts, pad, zscore_samples,
+                                         zscore_block, seed, method,
+                                         precision)
+    reader = fname
+    ntimes = reader.length(chname)
+
+    ntaps = max([len(b) for b in band_filts])
+    if pad is None:
+        pad = 3 * ntaps + len(boxcar_kernel(49))
+
+    # session level zscore statistics for each band
+    mag_mean, mag_std = get_mag_stats(chname, reader, notch_filts,
+                                      band_filts, pad, zscore_samples,
+                                      zscore_block, seed, method, precision)
+
+    # chop index, same as in chop
+    t_idx = np.arange(time_range[0] * 1000, time_range[1] * 1000)
+    sync_idx = np.round(np.asarray(sync_point, dtype=float) * 1000)
+    long_idx = (t_idx.reshape(1, -1) + sync_idx.reshape(-1, 1)).astype(int)
+    present = np.where(sync_idx != -1000)[0]  # trials missing events
+
+    # padded segments around sync points, merged where they overlap
+    segments = []
+    for tr in present[np.argsort(long_idx[present, 0])]:
+        lo = max(0, long_idx[tr, 0] - pad)
+        hi = min(ntimes, long_idx[tr, -1] + 1 + pad)
+        if segments and lo <= segments[-1][1]:
+            segments[-1][1] = max(hi, segments[-1][1])
+            segments[-1][2].append(tr)
+        else:
+            segments.append([lo, hi, [tr]])
+
+    nsync, nt = long_idx.shape
+    dtype = PRECISIONS[precision]
+    mag_chopped = [np.full((nsync, nt), np.nan, dtype) for b in band_filts]
+    phs_chopped = [np.full((nsync, nt), np.nan, dtype) for b in band_filts]
+
+    # load, notch, and bandpass each segment, then chop
+    for lo, hi, trials in segments:
+        channel = get_notched(chname, reader, notch_filts, lo, hi, dtype)
+        if method == "fft":
+            channel = ChannelSpectrum(channel, ntaps)
+        idx = long_idx[trials] - lo
+        for b in range(len(band_filts)):
+            mag_raw, phs = get_analytic(channel, band_filts[b])
+            with stage("chop", nsync=len(trials)):
+                mag_chopped[b][trials] = (mag_raw[idx] - mag_mean[b]) / \
+                    mag_std[b]
+                phs_chopped[b][trials] = phs[idx]
 
     return mag_chopped, phs_chopped
+
+
+def get_mag_stats(chname, fname, notch_filts, band_filts, pad,
+                  nsamples=20, block=10000, seed=0, method="filtfilt",
+                  precision="double"):
+    """
+    Estimate session mean and standard deviation of band magnitude
+    (smoothed, as in get_analytic) from blocks of the LFP channel.
+
+    Parameters:
+    ----------
+    chname : string
+        channel ID
+    fname : string or PL2MatReader
+        path to LFP data, or open reader
+    notch_filts : list
+        notch filters
+    band_filts : list
+        bandpass filters
+    pad : int
+        samples to add on both sides of each block, for filter edges
+    nsamples : int
+        number of random blocks; None = every block in the session
+    block : int
+        samples per block
+    seed : int
+        seed for picking random blocks
+    method : string
+        "filtfilt" (default) or "fft" (see process_raw_lfp)
+    precision : string
+        "double" (default) or "single" (see process_raw_lfp)
+
+    Returns:
+    -------
+    mag_mean : np vector
+        mean magnitude for each band
+    mag_std : np vector
+        standard deviation of magnitude for each band
+
+    """
+    if not isinstance(fname, PL2MatReader):
+        with open_reader(fname) as reader:
+            return get_mag_stats(chname, reader, notch_filts, band_filts,
+                                 pad, nsamples, block, seed, method,
+                                 precision)
+    reader = fname
+    ntimes = reader.length(chname)
+    ntaps = max([len(b) for b in band_filts])
+
+    # tile session with blocks, maybe pick a few
+    starts = np.arange(0, ntimes, block)
+    if nsamples is not None and nsamples < starts.shape[0]:
+        rng = np.random.default_rng(seed)
+        starts = np.sort(rng.choice(starts, nsamples, replace=False))
+
+    # accumulate sums over valid (unpadded) part of each block
+    n = 0
+    mag_sum = np.zeros(len(band_filts))
+    mag_sumsq = np.zeros(len(band_filts))
+    for start in starts:
+        stop = min(start + block, ntimes)
+        lo = max(0, start - pad)
+        hi = min(ntimes, stop + pad)
+        channel = get_notched(chname, reader, notch_filts, lo, hi,
+                              PRECISIONS[precision])
+        if method == "fft":
+            channel = ChannelSpectrum(channel, ntaps)
+        for b in range(len(band_filts)):
+            mag_raw = get_analytic(channel, band_filts[b])[0]
+            mag_raw = mag_raw[start - lo:stop - lo]
+            mag_sum[b] += mag_raw.sum(dtype=np.float64)
+            mag_sumsq[b] += np.square(mag_raw, dtype=np.float64).sum()
+        n += stop - start
+
+    mag_mean = mag_sum / n
+    mag_std = np.sqrt(mag_sumsq / n - np.square(mag_mean))
+
+    return mag_mean, mag_std
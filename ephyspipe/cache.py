@@ -0,0 +1,333 @@
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from ephyspipe.config import CACHE_DIR
+from ephyspipe.spikes import SpikeRaster
+
+
+# file hashes, by (path, size, modification time)
+_file_hashes = dict()
+
+# part of every cache key; bump when cached outputs change meaning in a way
+# the code hash doesn't catch (e.g. a dependency changes results)
+CACHE_VERSION = 1
+
+# modules whose code makes the cached outputs (see code_hash)
+_CODE_MODULES = ["brain", "filters", "readers", "smoothing", "spikes"]
+
+
+class SessionCache:
+    """
+    On-disk cache of processed session outputs (e.g. from process_raw_spk
+    or process_raw_lfp), content addressed: the key is the hash of the raw
+    data file plus the processing parameters, and the version of the
+    processing code (CACHE_VERSION and code_hash), so outputs of older
+    code are never returned. File hashes are saved in the cache directory
+    too (by path, size and modification time), so new processes don't
+    reread the raw file to find a hit.
+
+    Arrays are saved as uncompressed .npy and come back as read only
+    np.memmap views, so a cache hit costs almost nothing up front and
+    processes analysing the same session share one copy in the page
+    cache.
+
+    Parameters:
+    ----------
+    cache_dir : string
+        directory for cached outputs; default = config.CACHE_DIR (set by
+        EPHYSPIPE_CACHE_DIR)
+
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        if cache_dir is None:
+            raise ValueError("no cache directory; pass cache_dir or set "
+                             "EPHYSPIPE_CACHE_DIR")
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, fname, name, params):
+        """
+        Cache key for outputs of processing step name on file fname.
+
+        Parameters:
+        ----------
+        fname : string
+            raw data file
+        name : string
+            processing step, e.g. "process_raw_spk"
+        params : dict
+            parameters that change the outputs
+
+        Returns:
+        -------
+        key : string
+            hex digest
+
+        """
+        spec = json.dumps([self.file_hash(fname), name, to_jsonable(params),
+                           CACHE_VERSION, code_hash()], sort_keys=True)
+
+        return hashlib.sha1(spec.encode()).hexdigest()
+
+    def file_hash(self, fname):
+        """
+        file_hash, saved in the cache directory by (path, size,
+        modification time), so only the first process to see a file reads
+        it all.
+
+        Parameters:
+        ----------
+        fname : string
+            file path
+
+        Returns:
+        -------
+        digest : string
+            hex digest
+
+        """
+        fname = os.path.abspath(fname)
+        stat = os.stat(fname)
+        file_id = json.dumps([fname, stat.st_size, stat.st_mtime_ns])
+        hash_dir = os.path.join(self.cache_dir, ".hashes")
+        hash_fname = os.path.join(
+            hash_dir, hashlib.sha1(file_id.encode()).hexdigest())
+        if os.path.exists(hash_fname):
+            with open(hash_fname) as f:
+                return f.read()
+
+        # write aside, then move into place
+        digest = file_hash(fname)
+        os.makedirs(hash_dir, exist_ok=True)
+        fd, tmp_fname = tempfile.mkstemp(dir=hash_dir, prefix=".tmp_")
+        with os.fdopen(fd, "w") as f:
+            f.write(digest)
+        os.replace(tmp_fname, hash_fname)
+
+        return digest
+
+    def cached(self, func, fname, params, extra=None):
+        """
+        Return cached outputs of func(fname, **params, **extra), computing
+        and saving them first if they aren't cached yet.
+
+        Parameters:
+        ----------
+        func : function
+            processing step, e.g. brain.process_raw_spk
+        fname : string
+            raw data file
+        params : dict
+            parameters that change the outputs (part of the key)
+        extra : dict
+            parameters that don't (e.g. number of workers)
+
+        Returns:
+        -------
+        outputs : tuple
+            outputs of func; arrays as read only np.memmap
+
+        """
+        key = self.key(fname, func.__name__, params)
+        outputs = self.load(key)
+        if outputs is None:
+            kwargs = dict(params)
+            kwargs.update(extra or dict())
+            self.save(key, func(fname, **kwargs))
+            outputs = self.load(key)
+
+        return outputs
+
+    def load(self, key):
+        """
+        Load cached outputs.
+
+        Parameters:
+        ----------
+        key : string
+            cache key
+
+        Returns:
+        -------
+        outputs : tuple
+            arrays as read only np.memmap; None if not cached
+
+        """
+        path = os.path.join(self.cache_dir, key)
+        manifest = os.path.join(path, "manifest.json")
+        if not os.path.exists(manifest):
+            return None
+
+        with open(manifest) as f:
+            kinds = json.load(f)
+
+        return tuple(_load_item(path, str(i), kinds[i])
+                     for i in range(len(kinds)))
+
+    def save(self, key, outputs):
+        """
+        Save outputs; written to a temporary directory first, then moved
+        into place, so other processes never see a partial entry.
+
+        Parameters:
+        ----------
+        key : string
+            cache key
+        outputs : tuple
+            np arrays, lists of np arrays, pd tables, or SpikeRasters
+
+        """
+        path = os.path.join(self.cache_dir, key)
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp_")
+        try:
+            kinds = [_save_item(tmp_path, str(i), outputs[i])
+                     for i in range(len(outputs))]
+            with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+                json.dump(kinds, f)
+            os.rename(tmp_path, path)
+        except OSError:
+            # someone else saved it first
+            if not os.path.exists(os.path.join(path, "manifest.json")):
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def clear(self):
+        """Remove all cached outputs."""
+        for entry in os.listdir(self.cache_dir):
+            shutil.rmtree(os.path.join(self.cache_dir, entry),
+                          ignore_errors=True)
+
+
+def as_cache(cache):
+    """SessionCache from SessionCache or cache directory."""
+    if isinstance(cache, SessionCache):
+        return cache
+
+    return SessionCache(cache)
+
+
+def file_hash(fname, block=2**24):
+    """
+    SHA-1 of file contents; memoized while size and modification time
+    don't change.
+
+    Parameters:
+    ----------
+    fname : string
+        file path
+    block : int
+        bytes per read
+
+    Returns:
+    -------
+    digest : string
+        hex digest
+
+    """
+    fname = os.path.abspath(fname)
+    stat = os.stat(fname)
+    file_id = (fname, stat.st_size, stat.st_mtime_ns)
+    if file_id not in _file_hashes:
+        sha = hashlib.sha1()
+        with open(fname, "rb") as f:
+            for chunk in iter(lambda: f.read(block), b""):
+                sha.update(chunk)
+        _file_hashes[file_id] = sha.hexdigest()
+
+    return _file_hashes[file_id]
+
+
+@functools.lru_cache(maxsize=None)
+def code_hash():
+    """SHA-1 of the source of the modules making cached outputs (any
+    change to them, e.g. to filtering or smoothing, makes new keys)."""
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    sha = hashlib.sha1()
+    for module in _CODE_MODULES:
+        with open(os.path.join(package_dir, module + ".py"), "rb") as f:
+            sha.update(f.read())
+
+    return sha.hexdigest()
+
+
+def to_jsonable(value):
+    """
+    Turn processing parameters into something json can dump; arrays are
+    replaced by a hash of their contents.
+
+    Parameters:
+    ----------
+    value : anything
+        e.g. dict of parameters
+
+    Returns:
+    -------
+    jsonable : dict, list, string, or number
+
+    """
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(value[k]) for k in value}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        sha = hashlib.sha1(value.tobytes())
+        return ["ndarray", str(value.dtype), list(value.shape),
+                sha.hexdigest()]
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, "key"):  # e.g. FilterBank
+        return [type(value).__name__, value.key]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+
+    raise TypeError("can't use as cache key: " + repr(value))
+
+
+def _save_item(path, name, item):
+    """Save one output; return its kind for the manifest."""
+    if isinstance(item, np.ndarray):
+        np.save(os.path.join(path, name + ".npy"), item)
+        return "array"
+    if isinstance(item, list) and all(isinstance(i, np.ndarray)
+                                      for i in item):
+        for i in range(len(item)):
+            np.save(os.path.join(path, "%s_%d.npy" % (name, i)), item[i])
+        return ["arrays", len(item)]
+    if isinstance(item, pd.DataFrame):
+        item.to_pickle(os.path.join(path, name + ".pkl"))
+        return "table"
+    if isinstance(item, SpikeRaster):
+        np.save(os.path.join(path, name + "_indices.npy"), item.indices)
+        np.save(os.path.join(path, name + "_offsets.npy"), item.offsets)
+        if item.kernel is not None:
+            np.save(os.path.join(path, name + "_kernel.npy"), item.kernel)
+        return ["spikes", item.ntimes, item.kernel is not None]
+
+    raise TypeError("can't cache output of type " + type(item).__name__)
+
+
+def _load_item(path, name, kind):
+    """Load one output, saved by _save_item."""
+    def load(suffix):
+        return np.load(os.path.join(path, name + suffix), mmap_mode="r")
+
+    if kind == "array":
+        return load(".npy")
+    if kind == "table":
+        return pd.read_pickle(os.path.join(path, name + ".pkl"))
+    if kind[0] == "arrays":
+        return [load("_%d.npy" % i) for i in range(kind[1])]
+    if kind[0] == "spikes":
+        kernel = np.array(load("_kernel.npy")) if kind[2] else None
+        return SpikeRaster(load("_indices.npy"), load("_offsets.npy"),
+                           kind[1], kernel)
+
+    raise ValueError("unknown cached output: " + str(kind))
@@ -0,0 +1,353 @@
+import argparse
+import contextlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import ephyspipe.behavior as bhv
+from ephyspipe import instrument
+from ephyspipe.stream import stream_lfp, stream_spk
+
+
+def main(argv=None):
+    """
+    ephyspipe console entry point: process every session in a manifest.
+
+    Each session gets its own output directory (trialinfo.csv, with the
+    sync point of each trial; spk.h5 and lfp.h5, see ephyspipe.stream);
+    sessions whose outputs are up to date are skipped, and sessions that
+    only gained new blocks (files) since the last run just get the new
+    blocks appended. A timing summary for all sessions is saved as
+    summary.csv.
+
+    Parameters:
+    ----------
+    argv : list
+        command line arguments; None = sys.argv
+
+    Returns:
+    -------
+    status : int
+        0 if all sessions ran (or were skipped), 1 otherwise
+
+    """
+    parser = argparse.ArgumentParser(
+        prog="ephyspipe",
+        description="Batch process ephys sessions listed in a manifest.")
+    parser.add_argument("manifest",
+                        help="JSON (list of sessions) or CSV (one row per "
+                        "session); fields: name, bhv, spk, lfp, sync_code, "
+                        "window (lists separated by ';' in CSV); for "
+                        "sessions split into blocks, one spk/lfp file "
+                        "per bhv file")
+    parser.add_argument("-o", "--out-dir", default="ephyspipe_out",
+                        help="output directory; default = ephyspipe_out")
+    parser.add_argument("-n", "--nworkers", type=int, default=1,
+                        help="sessions processed at once; default = 1")
+    parser.add_argument("-m", "--max-memory", type=float, default=None,
+                        help="address space limit per worker, in bytes "
+                        "(e.g. 8e9); default = no limit")
+    parser.add_argument("-b", "--block", type=int, default=600000,
+                        help="LFP samples per streamed block; default = "
+                        "600000")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="reprocess sessions even if up to date")
+    parser.add_argument("-t", "--timings", default=None,
+                        help="JSON lines file for timing of every stage "
+                        "(load, notch, bandpass, ...) in every session")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="log progress")
+    args = parser.parse_args(argv)
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    sessions = load_manifest(args.manifest)
+    summary = run_sessions(sessions, args.out_dir, args.nworkers,
+                           args.max_memory, args.block, args.force,
+                           args.timings)
+    print(summary.to_string(index=False))
+
+    return int(np.any(summary.status == "failed"))
+
+
+def load_manifest(fname):
+    """
+    Load sessions from manifest.
+
+    Parameters:
+    ----------
+    fname : string
+        JSON file with a list of sessions, or CSV file with one row per
+        session; fields: name, bhv (list of paths), spk, lfp (paths; may
+        be left out), sync_code (int), window (2 element, in sec). For a
+        session recorded in blocks (e.g. one spk and lfp file per bhv
+        file), spk and lfp are lists too, in recording order
+
+    Returns:
+    -------
+    sessions : list
+        dicts, one per session, with all fields
+
+    """
+    if fname.endswith(".csv"):
+        table = pd.read_csv(fname, dtype=str, keep_default_na=False)
+        sessions = table.to_dict("records")
+        for session in sessions:
+            session["bhv"] = session["bhv"].split(";")
+            for kind in ["spk", "lfp"]:
+                if ";" in session.get(kind, ""):
+                    session[kind] = session[kind].split(";")
+            session["window"] = [float(w)
+                                 for w in session["window"].split(";")]
+    else:
+        with open(fname) as f:
+            sessions = json.load(f)
+
+    for session in sessions:
+        if isinstance(session["bhv"], str):
+            session["bhv"] = [session["bhv"]]
+        session["bhv"] = [os.path.abspath(b) for b in session["bhv"]]
+        for kind in ["spk", "lfp"]:
+            path = session.get(kind) or None
+            if isinstance(path, list):
+                session[kind] = [os.path.abspath(p) for p in path]
+            else:
+                session[kind] = os.path.abspath(path) if path else None
+        if not session.get("name"):
+            session["name"] = os.path.splitext(
+                os.path.basename(session["bhv"][0]))[0]
+        session["sync_code"] = int(session["sync_code"])
+        session["window"] = [float(w) for w in session["window"]]
+
+    return sessions
+
+
+def run_sessions(sessions, out_dir, nworkers=1, max_memory=None,
+                 block=600000, force=False, timings=None):
+    """
+    Process sessions, spread across a pool of worker processes.
+
+    Parameters:
+    ----------
+    sessions : list
+        dicts, one per session (see load_manifest)
+    out_dir : string
+        output directory; one subdirectory per session
+    nworkers : int
+        sessions processed at once
+    max_memory : int
+        bytes; address space limit for each worker process (a session
+        that goes over it fails with MemoryError); None = no limit
+    block : int
+        LFP samples per streamed block
+    force : bool
+        reprocess sessions even if up to date
+    timings : string
+        JSON lines file for timing of every stage in every session (see
+        instrument.JsonLinesSink); None = don't record
+
+    Returns:
+    -------
+    summary : pd table
+        one row per session: name, status, and time spent (in sec) in
+        each step
+
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    args = [(s, os.path.join(out_dir, s["name"]), block, force)
+            for s in sessions]
+
+    if timings is not None:
+        timings = os.path.abspath(timings)
+
+    if nworkers > 1 or max_memory is not None:
+        with ProcessPoolExecutor(nworkers, initializer=_init_worker,
+                                 initargs=(max_memory, timings)) as executor:
+            rows = list(executor.map(_run_session_safely, args))
+    else:
+        if timings is None:
+            recording = contextlib.nullcontext()
+        else:
+            recording = instrument.recording(timings)
+        with recording:
+            rows = [_run_session_safely(a) for a in args]
+
+    summary = pd.DataFrame(rows)
+    summary.to_csv(os.path.join(out_dir, "summary.csv"), index=False)
+
+    return summary
+
+
+def run_session(session, session_dir, block=600000, force=False):
+    """
+    Process one session: trial info and sync points from behavior, then
+    chopped spikes and LFP (streamed, see ephyspipe.stream), one block at
+    a time (see session_blocks). If the outputs are up to date except for
+    blocks added since, only those are processed and appended.
+
+    Parameters:
+    ----------
+    session : dict
+        session fields (see load_manifest)
+    session_dir : string
+        output directory for this session
+    block : int
+        LFP samples per streamed block
+    force : bool
+        reprocess even if up to date
+
+    Returns:
+    -------
+    timing : dict
+        name, status ("done", "appended" or "skipped"), and time spent (in
+        sec) in each step
+
+    """
+    timing = {"name": session["name"], "status": "skipped"}
+    blocks = session_blocks(session)
+    stamp = _session_stamp(session, block)
+    done_fname = os.path.join(session_dir, "done.json")
+    ndone = 0
+    if not force and os.path.exists(done_fname):
+        with open(done_fname) as f:
+            previous = json.load(f)
+        if previous == stamp:
+            return timing
+        if previous.get("options") == stamp["options"] and \
+                previous["blocks"] == stamp["blocks"][:len(previous[
+                    "blocks"])]:
+            ndone = len(previous["blocks"])
+
+    os.makedirs(session_dir, exist_ok=True)
+    if os.path.exists(done_fname):
+        os.remove(done_fname)
+
+    timing.update({"bhv_sec": 0, "spk_sec": 0, "lfp_sec": 0})
+    for k in range(ndone, len(blocks)):
+        # trial info, and sync point for each trial (in block's time)
+        tic = time.perf_counter()
+        columns = bhv.load_bhv_columns(blocks[k]["bhv"],
+                                       ["Trial"] + bhv.TRIALINFO_FIELDS)
+        pl2_codes = bhv.load_pl2_codes(blocks[k]["spk"] or
+                                       blocks[k]["lfp"])
+        sync_points = bhv.get_trial_events(columns, pl2_codes,
+                                           session["sync_code"])
+        trialinfo = bhv.get_trialinfo(columns)
+        trialinfo["sync"] = sync_points
+        trialinfo["block"] = k
+        trialinfo.to_csv(os.path.join(session_dir, "trialinfo.csv"),
+                         index=False, mode="a" if k else "w",
+                         header=not k)
+        timing["bhv_sec"] += time.perf_counter() - tic
+
+        # chopped spikes and lfp, after earlier blocks
+        tic = time.perf_counter()
+        if blocks[k]["spk"]:
+            stream_spk(blocks[k]["spk"], os.path.join(session_dir, "spk.h5"),
+                       sync_points, session["window"], append=k > 0)
+        timing["spk_sec"] += time.perf_counter() - tic
+
+        tic = time.perf_counter()
+        if blocks[k]["lfp"]:
+            stream_lfp(blocks[k]["lfp"], os.path.join(session_dir, "lfp.h5"),
+                       sync_points, session["window"], block=block,
+                       append=k > 0)
+        timing["lfp_sec"] += time.perf_counter() - tic
+
+    # mark outputs as up to date
+    with open(done_fname, "w") as f:
+        json.dump(stamp, f)
+    timing["status"] = "appended" if ndone else "done"
+
+    return timing
+
+
+def session_blocks(session):
+    """
+    Split session into blocks, processed (and appended) in order: if spk
+    / lfp are lists of files, one block per bhv file, with its own spk /
+    lfp file (LFP recording continues across files); otherwise a single
+    block with all bhv files.
+
+    Parameters:
+    ----------
+    session : dict
+        session fields (see load_manifest)
+
+    Returns:
+    -------
+    blocks : list
+        dicts with bhv (list of paths), spk, lfp (path or None)
+
+    """
+    kinds = [k for k in ["spk", "lfp"] if isinstance(session[k], list)]
+    if not kinds:
+        return [{"bhv": session["bhv"], "spk": session["spk"],
+                 "lfp": session["lfp"]}]
+
+    nblocks = len(session["bhv"])
+    if any(len(session[k]) != nblocks for k in kinds):
+        raise ValueError("session %s: need one spk / lfp file per bhv file"
+                         % session["name"])
+
+    return [{"bhv": [session["bhv"][b]],
+             "spk": session["spk"][b] if "spk" in kinds else None,
+             "lfp": session["lfp"][b] if "lfp" in kinds else None}
+            for b in range(nblocks)]
+
+
+def _run_session_safely(args):
+    """run_session, but a failed session doesn't stop the others."""
+    session, session_dir, block, force = args
+    tic = time.perf_counter()
+    try:
+        timing = run_session(session, session_dir, block, force)
+    except Exception as err:
+        timing = {"name": session["name"], "status": "failed",
+                  "error": "%s: %s" % (type(err).__name__, err)}
+    timing["total_sec"] = time.perf_counter() - tic
+
+    return timing
+
+
+def _session_stamp(session, block):
+    """Processing options, plus size and modification time of every input
+    in each block; outputs are up to date while this matches, and only
+    need new blocks appended while the options and earlier blocks do."""
+    options = {k: session[k] for k in ["name", "sync_code", "window"]}
+    options["block"] = block
+    options["blocks"] = isinstance(session["spk"], list) or \
+        isinstance(session["lfp"], list)
+    blocks = [[[f, os.stat(f).st_size, os.stat(f).st_mtime_ns]
+               for f in b["bhv"] + [b[k] for k in ["spk", "lfp"] if b[k]]]
+              for b in session_blocks(session)]
+
+    return {"options": options, "blocks": blocks}
+
+
+def _init_worker(max_memory, timings):
+    """Set up worker process: timings sink, memory cap."""
+    instrument.disable()  # sinks inherited from parent, if forked
+    if timings is not None:
+        instrument.enable(timings)
+    _limit_memory(max_memory)
+
+
+def _limit_memory(max_memory):
+    """Cap address space of worker process (Unix only)."""
+    if max_memory is None:
+        return
+    try:
+        import resource
+    except ImportError:  # e.g. Windows
+        return
+
+    soft = int(max_memory)
+    hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
@@ -1,5 +1,9 @@
+import os
 from pathlib import Path
 from os.path import join as pjoin
 
 
 TESTDATADIR = pjoin(Path(__file__).parent, "tests/sample_data")
+
+# where to save reusable results (e.g. filter designs); None = don't save
+CACHE_DIR = os.environ.get("EPHYSPIPE_CACHE_DIR")
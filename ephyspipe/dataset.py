@@ -0,0 +1,376 @@
+import os
+import h5py
+import numpy as np
+import pandas as pd
+from ephyspipe.instrument import add_array, stage
+
+
+def save_dataset(fname, trialinfo, ts_chopped, spk=None, unit_meta=None,
+                 lfp=None, lfp_meta=None, chunk_bytes=2**20,
+                 compression=None):
+    """
+    Save chopped spikes and / or LFP, with trial and unit / channel meta
+    data, to one HDF5 file (see TrialDataset to read it back).
+
+    Chopped arrays (sync_points x time x sources) are stored in chunks of
+    consecutive trials x all time x one source, so reading some trials of
+    a few units / channels only touches their chunks.
+
+    File:
+        ts_chopped : time for data chopped at sync points, in sec
+        trials/ : trial info, one dataset per column
+        spk/units/ : unit meta data, one dataset per column
+        spk/<name> : e.g. spk/fr; sync_points x time x units
+        lfp/channels/ : channel meta data, one dataset per column
+        lfp/mag/<band>, lfp/phs/<band> : sync_points x time x channels
+
+    Parameters:
+    ----------
+    fname : string
+        Path file for dataset (HDF5); overwritten
+    trialinfo : pd table
+        one row per sync point (e.g. get_trialinfo, plus sync points)
+    ts_chopped : np vector
+        time for data chopped at sync_points, in sec
+    spk : dict
+        chopped spike data by name, e.g. {"fr": fr_chopped, "raster":
+        raster_chopped}; 3D np arrays (or h5py datasets), sync_points x
+        time x units (or as squeezed by chop, for a single unit)
+    unit_meta : pd table
+        meta data; each row corresponds to unit (see process_raw_spk)
+    lfp : dict
+        band name: (magnitude, phase), 3D np arrays (or h5py datasets),
+        sync_points x time x channels (or squeezed, for a single
+        channel); or LazyBands (bands are filtered one at a time as
+        they're saved)
+    lfp_meta : pd table
+        meta data; each row corresponds to LFP channel (see
+        process_raw_lfp)
+    chunk_bytes : int
+        target chunk size; default = 1 MiB
+    compression : string
+        h5py compression for chopped arrays (e.g. "gzip"); default = None
+
+    Returns:
+    -------
+    fname : string
+        Path file for dataset
+
+    """
+    ntrials = trialinfo.shape[0]
+    nt = np.size(ts_chopped)
+    with h5py.File(fname, "w") as out:
+        out["ts_chopped"] = ts_chopped
+        _write_table(out.create_group("trials"), trialinfo)
+
+        if spk is not None:
+            _write_table(out.create_group("spk/units"), unit_meta)
+            shape = (ntrials, nt, unit_meta.shape[0])
+            for name in spk:
+                _write_chopped(out["spk"], name, spk[name], shape,
+                               chunk_bytes, compression)
+
+        if lfp is not None:
+            # channel numbers, to query by, as in process_raw_lfp
+            lfp_meta = lfp_meta.copy()
+            if "channel" not in lfp_meta:
+                lfp_meta["channel"] = [int(ch[2:]) for ch in lfp_meta.ID]
+            _write_table(out.create_group("lfp/channels"), lfp_meta)
+            out["lfp"].attrs["band_names"] = list(lfp)
+            shape = (ntrials, nt, lfp_meta.shape[0])
+            for band in lfp:
+                mag, phs = lfp[band]
+                _write_chopped(out["lfp"], "mag/" + band, mag, shape,
+                               chunk_bytes, compression)
+                _write_chopped(out["lfp"], "phs/" + band, phs, shape,
+                               chunk_bytes, compression)
+
+    return fname
+
+
+def session_to_dataset(session_dir, fname=None, chunk_bytes=2**20,
+                       compression=None):
+    """
+    Gather a processed session (see the ephyspipe command: trialinfo.csv,
+    spk.h5, lfp.h5) into one dataset; stores are copied a chunk of trials
+    at a time.
+
+    Parameters:
+    ----------
+    session_dir : string
+        output directory of session
+    fname : string
+        Path file for dataset; default = dataset.h5 in session_dir
+    chunk_bytes : int
+        target chunk size; default = 1 MiB
+    compression : string
+        h5py compression for chopped arrays; default = None
+
+    Returns:
+    -------
+    fname : string
+        Path file for dataset
+
+    """
+    if fname is None:
+        fname = os.path.join(session_dir, "dataset.h5")
+    trialinfo = pd.read_csv(os.path.join(session_dir, "trialinfo.csv"))
+    spk_fname = os.path.join(session_dir, "spk.h5")
+    lfp_fname = os.path.join(session_dir, "lfp.h5")
+
+    spk = unit_meta = lfp = lfp_meta = None
+    ts_chopped = None
+    files = []
+    try:
+        if os.path.exists(spk_fname):
+            files.append(h5py.File(spk_fname, "r"))
+            store = files[-1]
+            ts_chopped = store["ts_chopped"][()]
+            spk = {name: store[name] for name in ["raster", "fr"]}
+            unit_meta = pd.DataFrame({
+                "ID": store["unit_names"].asstr()[()],
+                "channel": store["channel"][()],
+                "mean_fr": store["mean_fr"][()]})
+        if os.path.exists(lfp_fname):
+            files.append(h5py.File(lfp_fname, "r"))
+            store = files[-1]
+            ts_chopped = store["ts_chopped"][()]
+            lfp = {b: (store["mag/" + b], store["phs/" + b])
+                   for b in store["band_names"][()].astype(str)}
+            lfp_meta = pd.DataFrame(
+                {"ID": store["channel_names"][()].astype(str)})
+
+        return save_dataset(fname, trialinfo, ts_chopped, spk, unit_meta,
+                            lfp, lfp_meta, chunk_bytes, compression)
+    finally:
+        for f in files:
+            f.close()
+
+
+class TrialDataset:
+    """
+    Dataset saved with save_dataset, opened for queries; trial and unit /
+    channel tables are loaded up front, chopped arrays are read on demand
+    (only the chunks a query needs), e.g. forced trials, channel 12, beta
+    band, -0.5 to 1 sec:
+
+        with TrialDataset("dataset.h5") as ds:
+            mag, ts, trials, channels = ds.lfp(
+                "beta", trials="trialtype == 'forced'", channels=[12],
+                time_range=(-0.5, 1))
+
+    Parameters:
+    ----------
+    fname : string
+        Path file for dataset
+
+    """
+
+    def __init__(self, fname):
+        self.file = h5py.File(fname, "r")
+        self.ts_chopped = self.file["ts_chopped"][()]
+        self.trials = _read_table(self.file["trials"])
+        self.units = None
+        self.channels = None
+        self.band_names = []
+        if "spk" in self.file:
+            self.units = _read_table(self.file["spk/units"])
+        if "lfp" in self.file:
+            self.channels = _read_table(self.file["lfp/channels"])
+            self.band_names = list(self.file["lfp"].attrs["band_names"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def spk(self, name="fr", trials=None, channels=None, units=None,
+            time_range=None):
+        """
+        Read chopped spike data for some trials, units and time.
+
+        Parameters:
+        ----------
+        name : string
+            "fr" or "raster" (or other name given to save_dataset)
+        trials : string, or np vector
+            query on trial table (e.g. "trialtype == 'forced'"), boolean
+            mask or trial indices; None = all trials
+        channels : list
+            Integers; units on these channels; None = all
+        units : list
+            unit names (e.g. "SPK_SPKC001a"); None = all
+        time_range : 2 element tuple
+            time around sync points, in sec (from start, up to stop); None
+            = all
+
+        Returns:
+        -------
+        chopped : 3D np array
+            trials x time x units, in file order
+        ts_chopped : np vector
+            time, in sec
+        trials : pd table
+            trial info for the rows of chopped
+        units : pd table
+            meta data for the units of chopped
+
+        """
+        cols = _select_sources(self.units, channels, units)
+        return self._query("spk/" + name, trials, cols, self.units,
+                           time_range)
+
+    def lfp(self, band, kind="mag", trials=None, channels=None,
+            time_range=None):
+        """
+        Read chopped LFP for one band, for some trials, channels and time.
+
+        Parameters:
+        ----------
+        band : string
+            band name, e.g. "beta"
+        kind : string
+            "mag" (zscored magnitude) or "phs" (phase)
+        trials : string, or np vector
+            query on trial table (e.g. "trialtype == 'forced'"), boolean
+            mask or trial indices; None = all trials
+        channels : list
+            Integers; restrict to these channels; None = all
+        time_range : 2 element tuple
+            time around sync points, in sec (from start, up to stop); None
+            = all
+
+        Returns:
+        -------
+        chopped : 3D np array
+            trials x time x channels, in file order
+        ts_chopped : np vector
+            time, in sec
+        trials : pd table
+            trial info for the rows of chopped
+        channels : pd table
+            meta data for the channels of chopped
+
+        """
+        if band not in self.band_names:
+            raise KeyError(band)
+        cols = _select_sources(self.channels, channels)
+        return self._query("lfp/%s/%s" % (kind, band), trials, cols,
+                           self.channels, time_range)
+
+    def select_trials(self, trials=None):
+        """Trial indices (sorted) for query string, mask or indices."""
+        ntrials = self.trials.shape[0]
+        if trials is None:
+            return np.arange(ntrials)
+        if isinstance(trials, str):
+            return np.flatnonzero(self.trials.eval(trials).to_numpy())
+        trials = np.asarray(trials)
+        if trials.dtype == bool:
+            return np.flatnonzero(trials)
+
+        return np.unique(np.arange(ntrials)[trials])
+
+    def _query(self, name, trials, cols, sources, time_range):
+        """Read rows x time slice x cols of chopped array name."""
+        rows = self.select_trials(trials)
+        times = _time_slice(self.ts_chopped, time_range)
+        dset = self.file[name]
+
+        with stage("query", dataset=name) as record:
+            chopped = np.empty((rows.shape[0],
+                                self.ts_chopped[times].shape[0],
+                                cols.shape[0]), dtype=dset.dtype)
+
+            # runs of consecutive trials, read one source at a time, touch
+            # only the chunks holding them
+            breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+            starts = np.concatenate([[0], breaks])
+            stops = np.concatenate([breaks, [rows.shape[0]]])
+            for j, col in enumerate(cols):
+                for start, stop in zip(starts, stops):
+                    chopped[start:stop, :, j] = dset[
+                        rows[start]:rows[stop - 1] + 1, times, col]
+            add_array(record, chopped)
+
+        return (chopped, self.ts_chopped[times],
+                self.trials.iloc[rows].reset_index(drop=True),
+                sources.iloc[cols].reset_index(drop=True))
+
+
+def _write_table(group, table):
+    """Save pd table to group, one dataset per column (strings as
+    variable length UTF-8)."""
+    group.attrs["columns"] = [str(c) for c in table.columns]
+    for c in table.columns:
+        values = table[c].to_numpy()
+        if values.dtype == object:
+            group.create_dataset(str(c), dtype=h5py.string_dtype(),
+                                 data=values.astype(str).astype(object))
+        else:
+            group[str(c)] = values
+
+
+def _read_table(group):
+    """Load pd table saved with _write_table."""
+    columns = dict()
+    for c in group.attrs["columns"]:
+        dset = group[c]
+        if h5py.check_string_dtype(dset.dtype) is not None:
+            columns[c] = dset.asstr()[()].astype(object)
+        else:
+            columns[c] = dset[()]
+
+    return pd.DataFrame(columns)
+
+
+def _write_chopped(group, name, chopped, shape, chunk_bytes, compression):
+    """Save chopped array (np array or h5py dataset) to group in trial
+    major chunks, copying a chunk of trials at a time; shape is trials x
+    time x units / channels, as expected from the tables."""
+    if chopped.ndim < 3:
+        # chop squeezes out a single unit / channel (or trial)
+        if np.size(chopped) != np.prod(shape):
+            raise ValueError("%s has shape %s, expected %s"
+                             % (name, chopped.shape, shape))
+        chopped = np.reshape(chopped, shape)
+    nsync, nt, nsources = chopped.shape
+    if nsync != shape[0]:
+        raise ValueError("%s has %d sync points, trial info has %d rows"
+                         % (name, nsync, shape[0]))
+
+    itemsize = np.dtype(chopped.dtype).itemsize
+    rows = int(max(1, min(nsync, chunk_bytes // (nt * itemsize))))
+    out = group.create_dataset(name, chopped.shape, dtype=chopped.dtype,
+                               chunks=(rows, nt, 1) if nsync else None,
+                               compression=compression)
+    for first in range(0, nsync, rows):
+        out[first:first + rows] = chopped[first:first + rows]
+
+
+def _select_sources(table, channels=None, names=None):
+    """Column indices of units / channels on channels, or with names."""
+    if table is None:
+        raise KeyError("no such data in dataset")
+    keep = np.ones(table.shape[0], dtype=bool)
+    if channels is not None:
+        keep &= table.channel.isin(channels).to_numpy()
+    if names is not None:
+        keep &= table.ID.isin(names).to_numpy()
+
+    return np.flatnonzero(keep)
+
+
+def _time_slice(ts_chopped, time_range):
+    """Slice of ts_chopped from time_range[0] up to time_range[1]."""
+    if time_range is None:
+        return slice(None)
+    eps = 1e-9  # ts_chopped from np.arange; don't lose edges to rounding
+    start, stop = np.searchsorted(ts_chopped,
+                                  [time_range[0] - eps, time_range[1] - eps])
+
+    return slice(int(start), int(stop))
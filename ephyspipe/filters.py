@@ -0,0 +1,290 @@
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+import scipy.fft as sp_fft
+import scipy.signal as signal
+from ephyspipe.config import CACHE_DIR
+from ephyspipe.instrument import stage
+
+
+# typical LFP frequency bands, Hz
+DEFAULT_BANDS = {"delta": [2, 4],
+                 "theta": [4, 8],
+                 "alpha": [8, 12],
+                 "beta": [12, 30],
+                 "gamma": [30, 60],
+                 "high gamma": [70, 200]}
+BROADBAND = {"broadband": [2, 200]}
+
+# designed coefficients, by filter bank spec
+_designs = dict()
+
+
+class FilterBank:
+    """
+    Notch and bandpass filters for LFP, designed once per spec.
+
+    Designs are memoized in-process, and saved to (then loaded from)
+    cache_dir, so batch jobs over many sessions don't redesign the same
+    filters; zero-phase frequency responses used by ChannelSpectrum are
+    memoized in-process for each FFT length (see band_response).
+
+    Parameters:
+    ----------
+    fs : float
+        sample rate, Hz; process_raw_lfp and stream_lfp only take 1000
+        (see check_fs)
+    notch_hz : list
+        line noise frequencies to notch out (1 Hz wide), Hz
+    bands : dict
+        band name: [low, high] edges in Hz, in output order; default =
+        DEFAULT_BANDS
+    ntaps : int
+        bandpass (FIR) filter length
+    cache_dir : string
+        directory for saved designs; default = config.CACHE_DIR (set by
+        EPHYSPIPE_CACHE_DIR); None = don't save
+
+    """
+
+    def __init__(self, fs=1000, notch_hz=(60, 120, 180), bands=None,
+                 ntaps=1000, cache_dir=CACHE_DIR):
+        if bands is None:
+            bands = DEFAULT_BANDS
+        self.fs = fs
+        self.notch_hz = [float(n) for n in notch_hz]
+        self.bands = {b: [float(bands[b][0]), float(bands[b][1])]
+                      for b in bands}
+        self.ntaps = int(ntaps)
+        self.cache_dir = cache_dir
+
+        spec = json.dumps([self.fs, self.notch_hz, list(self.bands.items()),
+                           self.ntaps])
+        self.key = hashlib.sha1(spec.encode()).hexdigest()
+
+        if self.key not in _designs:
+            _designs[self.key] = self._load() or self._design()
+        self.notch_filts, self.band_filts = _designs[self.key]
+
+    @property
+    def band_names(self):
+        return list(self.bands.keys())
+
+    def check_fs(self, fs=1000):
+        """
+        Raise ValueError unless filters were designed for sample rate fs;
+        process_raw_lfp and stream_lfp handle 1 kHz LFP only (time stamps
+        in ms, chopping and smoothing in 1 ms steps).
+        """
+        if self.fs != fs:
+            raise ValueError("filter bank designed for %g Hz, but LFP is "
+                             "processed at %g Hz" % (self.fs, fs))
+
+    def response(self, band, nfft):
+        """
+        Zero-phase response |H|^2 of band filter, at rfft frequencies.
+
+        Parameters:
+        ----------
+        band : string or int
+            band name or index
+        nfft : int
+            FFT length
+
+        Returns:
+        -------
+        response : np vector
+            read only, nfft // 2 + 1
+
+        """
+        if not isinstance(band, int):
+            band = self.band_names.index(band)
+
+        return band_response(self.band_filts[band], nfft)
+
+    def _design(self):
+        """Design filters; save them if there is a cache_dir."""
+        notch_filts = [signal.iirnotch(n, n, self.fs) for n in self.notch_hz]
+        band_filts = [signal.firwin(self.ntaps, self.bands[b],
+                                    pass_zero=False, fs=self.fs)
+                      for b in self.bands]
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            arrays = dict()
+            for i in range(len(notch_filts)):
+                arrays["notch_b%d" % i] = notch_filts[i][0]
+                arrays["notch_a%d" % i] = notch_filts[i][1]
+            for i in range(len(band_filts)):
+                arrays["band%d" % i] = band_filts[i]
+
+            # write aside, then move into place in one step, so other
+            # processes never load a half written file
+            fd, tmp_fname = tempfile.mkstemp(dir=self.cache_dir,
+                                             suffix=".npz.tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, **arrays)
+                os.replace(tmp_fname, self._cache_fname())
+            except BaseException:
+                os.remove(tmp_fname)
+                raise
+
+        return notch_filts, band_filts
+
+    def _load(self):
+        """Load saved filters, if any."""
+        if self.cache_dir is None or not os.path.exists(self._cache_fname()):
+            return None
+
+        with np.load(self._cache_fname()) as saved:
+            notch_filts = [(saved["notch_b%d" % i], saved["notch_a%d" % i])
+                           for i in range(len(self.notch_hz))]
+            band_filts = [saved["band%d" % i] for i in range(len(self.bands))]
+
+        return notch_filts, band_filts
+
+    def _cache_fname(self):
+        return os.path.join(self.cache_dir, "filterbank_" + self.key + ".npz")
+
+
+class ChannelSpectrum:
+    """
+    Spectrum of one (notched) LFP channel, shared by a bank of bandpass
+    filters: the channel is transformed once, and each band is a zero-phase
+    filter (|H|^2, same as filtfilt) plus Hilbert transform applied in the
+    frequency domain, i.e. one inverse FFT per band.
+
+    Like filtfilt, the channel is padded at both ends with its odd
+    extension (padlen samples) before filtering, and the bandpassed signal
+    (real part) matches filtfilt to floating point precision. The Hilbert
+    step only differs from signal.hilbert on the filtered channel in how
+    edges are handled (signal.hilbert wraps the channel around, here it
+    sees the padded channel). The difference decays with distance from
+    the session edges: beyond 10 s in, it is < 0.5% of the mean band
+    magnitude for 2-4 Hz, and smaller for higher bands.
+
+    Precision follows the channel: float32 in, complex64 spectrum and
+    analytic signal out.
+
+    Parameters:
+    ----------
+    lfp_channel : np vector
+        broadband LFP signal (after notch filtering)
+    ntaps : int
+        longest bandpass filter that will be applied
+    padlen : int
+        samples of odd extension at each end; None = 3 * ntaps, as in
+        filtfilt
+
+    """
+
+    def __init__(self, lfp_channel, ntaps=1000, padlen=None):
+        if padlen is None:
+            padlen = 3 * ntaps
+        self.n = lfp_channel.shape[0]
+        self.padlen = min(padlen, self.n - 1)
+        self.ntaps = ntaps
+
+        # odd extension at both ends, as in filtfilt
+        extended = odd_ext(lfp_channel, self.padlen)
+
+        # room for the filter to spill over without wrapping around
+        self.nfft = sp_fft.next_fast_len(extended.shape[0] + 2 * ntaps)
+        with stage("fft", nsamples=self.n, nfft=self.nfft):
+            self.spectrum = sp_fft.rfft(extended, self.nfft)
+
+    def response(self, band_coeffs):
+        """Zero-phase response |H|^2 of band filter, at rfft frequencies."""
+        return band_response(band_coeffs, self.nfft)
+
+    def analytic(self, band_coeffs):
+        """
+        Analytic signal of bandpassed channel.
+
+        Parameters:
+        ----------
+        band_coeffs : np vector
+            coefficients for bandpass (FIR)
+
+        Returns:
+        -------
+        analytic : np vector
+            complex (complex64 for float32 channel), same length as
+            channel
+
+        """
+        if band_coeffs.shape[0] > self.ntaps:
+            raise ValueError("bandpass filter is longer than ntaps")
+
+        # analytic signal: double positive frequencies, drop negative
+        response = self.response(band_coeffs)
+        half = self.spectrum * response.astype(self.spectrum.real.dtype,
+                                               copy=False)
+        half[1:(self.nfft + 1) // 2] *= 2
+
+        full = np.zeros(self.nfft, dtype=self.spectrum.dtype)
+        full[:half.shape[0]] = half
+        analytic = sp_fft.ifft(full)
+
+        return analytic[self.padlen:self.padlen + self.n]
+
+
+def band_response(band_coeffs, nfft):
+    """
+    Zero-phase response |H|^2 of FIR filter (i.e. filtfilt), at rfft
+    frequencies; memoized for the most recent filters and FFT lengths.
+
+    Parameters:
+    ----------
+    band_coeffs : np vector
+        coefficients for bandpass (FIR)
+    nfft : int
+        FFT length
+
+    Returns:
+    -------
+    response : np vector
+        read only, nfft // 2 + 1
+
+    """
+    coeffs = np.ascontiguousarray(band_coeffs, dtype=float)
+    return _band_response(coeffs.tobytes(), int(nfft))
+
+
+@functools.lru_cache(maxsize=16)
+def _band_response(coeffs_bytes, nfft):
+    coeffs = np.frombuffer(coeffs_bytes)
+    response = np.abs(sp_fft.rfft(coeffs, nfft)) ** 2
+    response.flags.writeable = False
+
+    return response
+
+
+def odd_ext(x, padlen):
+    """
+    Odd extension of x at both ends (as in scipy's filtfilt).
+
+    Parameters:
+    ----------
+    x : np vector
+        signal
+    padlen : int
+        samples to add at each end
+
+    Returns:
+    -------
+    extended : np vector
+        length x + 2 * padlen
+
+    """
+    if padlen < 1:
+        return x
+
+    left = 2 * x[0] - x[padlen:0:-1]
+    right = 2 * x[-1] - x[-2:-(padlen + 2):-1]
+
+    return np.concatenate([left, x, right])
@@ -0,0 +1,211 @@
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+
+logger = logging.getLogger("ephyspipe")
+
+# where stage records go; empty = instrumentation off
+_sinks = []
+_options = {"profile": False, "trace_memory": False}
+
+# record fields LoggerSink leaves out
+_NOT_LOGGED = ("stage", "seconds", "profile", "pid", "thread", "start")
+
+# only one cProfile profiler can run at a time
+_profile_lock = threading.Lock()
+
+
+class LoggerSink:
+    """
+    Send stage records to a logger, one line per stage.
+
+    Parameters:
+    ----------
+    log : logging.Logger
+        default = "ephyspipe" logger
+    level : int
+        logging level; default = INFO
+
+    """
+
+    def __init__(self, log=None, level=logging.INFO):
+        self.log = log or logger
+        self.level = level
+
+    def __call__(self, record):
+        info = ", ".join("%s=%s" % (k, record[k]) for k in record
+                         if k not in _NOT_LOGGED)
+        self.log.log(self.level, "%s: %.4f s (%s)", record["stage"],
+                     record["seconds"], info)
+
+
+class JsonLinesSink:
+    """
+    Append stage records to a file, one JSON object per line; safe to
+    share between threads and (forked) processes: each line goes out in
+    a single write to a file opened for appending, so lines don't
+    interleave, however long (on local file systems; NFS doesn't make
+    appends atomic).
+
+    Parameters:
+    ----------
+    fname : string
+        path for JSON lines file
+
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        line = (json.dumps(record, default=str) + "\n").encode()
+        with self.lock:
+            fd = os.open(self.fname, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+
+def enable(sink, profile=False, trace_memory=False):
+    """
+    Send stage records to sink.
+
+    Parameters:
+    ----------
+    sink : callable, logging.Logger, or string
+        function called with each record (dict); logger (see LoggerSink);
+        or path for JSON lines file (see JsonLinesSink)
+    profile : bool
+        run cProfile over each stage; record gets the top functions by
+        cumulative time (outermost stage only, if stages are nested or
+        run in parallel threads)
+    trace_memory : bool
+        run tracemalloc over each stage; record gets bytes allocated (and
+        still held) by the stage, and peak bytes allocated for the
+        outermost stage (slows the pipeline down a lot)
+
+    Returns:
+    -------
+    sink : callable
+        to pass to disable
+
+    """
+    if isinstance(sink, logging.Logger):
+        sink = LoggerSink(sink)
+    elif isinstance(sink, str):
+        sink = JsonLinesSink(sink)
+    _sinks.append(sink)
+    _options["profile"] = profile
+    _options["trace_memory"] = trace_memory
+
+    return sink
+
+
+def disable(sink=None):
+    """Stop sending stage records to sink; None = to any sink."""
+    if sink is None:
+        del _sinks[:]
+    elif sink in _sinks:
+        _sinks.remove(sink)
+    if not _sinks:
+        _options["profile"] = False
+        _options["trace_memory"] = False
+
+
+@contextlib.contextmanager
+def recording(sink, profile=False, trace_memory=False):
+    """Send stage records to sink inside a with block (see enable)."""
+    sink = enable(sink, profile, trace_memory)
+    try:
+        yield sink
+    finally:
+        disable(sink)
+
+
+@contextlib.contextmanager
+def stage(name, **info):
+    """
+    Time a pipeline stage, and send its record to the sinks.
+
+    Parameters:
+    ----------
+    name : string
+        stage, e.g. "load", "notch", "bandpass"
+    info : keyword arguments
+        added to record, e.g. channel="FP001"
+
+    Yields:
+    -------
+    record : dict
+        add more info inside the with block, e.g. with add_array
+
+    """
+    record = dict(info)
+    if not _sinks:
+        yield record
+        return
+
+    record["stage"] = name
+    record["pid"] = os.getpid()
+    record["thread"] = threading.get_ident()
+    record["start"] = time.time()
+
+    # maybe profile / trace memory
+    profiler = None
+    if _options["profile"] and _profile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        profiler.enable()
+    traced_here = False
+    mem_before = None  # not tracing; options may change before exit
+    if _options["trace_memory"]:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            traced_here = True
+        mem_before = tracemalloc.get_traced_memory()[0]
+
+    tic = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - tic
+
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats(
+                "cumulative").print_stats(15)
+            record["profile"] = out.getvalue()
+        if mem_before is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            record["alloc_bytes"] = current - mem_before
+            if traced_here:  # peak only covers outermost stage
+                record["peak_alloc_bytes"] = peak - mem_before
+                tracemalloc.stop()
+
+        emit(record)
+
+
+def add_array(record, array, prefix=""):
+    """Add shape, dtype and size (bytes) of np array to stage record."""
+    if _sinks:
+        record[prefix + "shape"] = list(array.shape)
+        record[prefix + "dtype"] = str(array.dtype)
+        record[prefix + "nbytes"] = int(array.nbytes)
+
+
+def emit(record):
+    """Send record to every sink."""
+    for sink in list(_sinks):
+        sink(record)
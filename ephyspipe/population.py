@@ -0,0 +1,247 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from ephyspipe.spikes import window_spikes
+
+
+def cross_correlogram(ts_a, ts_b, max_lag=0.05, bin_size=0.001,
+                      block=2**16):
+    """
+    Cross-correlogram of two units straight from spike timestamps: the
+    spikes of b within max_lag of each spike of a are found with two
+    binary searches (see window_spikes), and their time differences
+    histogrammed; no spike trains are made.
+
+    Parameters:
+    ----------
+    ts_a, ts_b : np vector
+        times each unit fired (in sec)
+    max_lag : float
+        largest lag, in sec
+    bin_size : float
+        lag bin width, in sec
+    block : int
+        spikes of a handled at once (bounds memory for dense units)
+
+    Returns:
+    -------
+    counts : np vector
+        number of spike pairs in each lag bin; positive lag = b fires
+        after a. For a unit with itself, each spike is paired with itself
+        too (at lag 0; see cross_correlograms)
+    lags : np vector
+        center of each lag bin, in sec
+
+    """
+    ts_a = np.sort(np.asarray(ts_a, dtype=float).ravel())
+    ts_b = np.sort(np.asarray(ts_b, dtype=float).ravel())
+    nbins = int(round(2 * max_lag / bin_size))
+    lags = -max_lag + bin_size * (np.arange(nbins) + 0.5)
+
+    counts = np.zeros(nbins, dtype=np.int64)
+    for first in range(0, ts_a.shape[0], block):
+        a = ts_a[first:first + block]
+
+        # every (a, b) pair within max_lag, and its bin
+        win, b = window_spikes(ts_b, a - max_lag, a + max_lag)
+        bins = np.floor((b - a[win] + max_lag) / bin_size).astype(np.int64)
+        bins = bins[(bins >= 0) & (bins < nbins)]
+        counts += np.bincount(bins, minlength=nbins)
+
+    return counts, lags
+
+
+def cross_correlograms(timestamps, max_lag=0.05, bin_size=0.001,
+                       pairs=None, nthreads=2):
+    """
+    Cross-correlograms for pairs of units, spread across threads (see
+    cross_correlogram).
+
+    Parameters:
+    ----------
+    timestamps : list
+        np vectors, times each unit fired (in sec); e.g. [data[u] for u in
+        unit_names] from the loaded spk data
+    max_lag : float
+        largest lag, in sec
+    bin_size : float
+        lag bin width, in sec
+    pairs : list
+        (u, v) unit index pairs; default = every pair with u <= v, so
+        autocorrelograms too (without each spike paired with itself)
+    nthreads : int
+        number of threads; default = 2
+
+    Returns:
+    -------
+    ccgs : 2D np array
+        pairs x lags; spike pair counts, positive lag = v fires after u
+    lags : np vector
+        center of each lag bin, in sec
+    pairs : 2D np array
+        pairs x 2; (u, v) for each row of ccgs
+
+    """
+    # sort each unit once, not once per pair
+    timestamps = [np.sort(np.asarray(ts, dtype=float).ravel())
+                  for ts in timestamps]
+    if pairs is None:
+        pairs = np.array([(u, v) for u in range(len(timestamps))
+                          for v in range(u, len(timestamps))],
+                         dtype=np.int64).reshape(-1, 2)
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+
+    def do_pair(pair):
+        u, v = pair
+        counts, _ = cross_correlogram(timestamps[u], timestamps[v], max_lag,
+                                      bin_size)
+        if u == v:  # drop each spike paired with itself
+            counts[int(np.floor(max_lag / bin_size))] -= \
+                timestamps[u].shape[0]
+        return counts
+
+    nbins = int(round(2 * max_lag / bin_size))
+    lags = -max_lag + bin_size * (np.arange(nbins) + 0.5)
+    with ThreadPoolExecutor(nthreads) as executor:
+        ccgs = list(executor.map(do_pair, pairs))
+    ccgs = np.array(ccgs, dtype=np.int64).reshape(-1, nbins)
+
+    return ccgs, lags, pairs
+
+
+def psth_by_condition(chopped, conditions):
+    """
+    Average chopped data (e.g. firing rates) over the trials of each
+    condition, for all conditions at once as one matrix product (trials
+    to conditions) over the trial axis.
+
+    Parameters:
+    ----------
+    chopped : 3D np array
+        sync_points x time x units (e.g. chop, or chop_spikes)
+    conditions : np vector
+        condition of each sync point, e.g. trialinfo.trialtype; trials with
+        missing (NaN) condition are left out
+
+    Returns:
+    -------
+    psth : 3D np array
+        conditions x time x units; mean over trials, leaving out NaN
+        values (e.g. missing sync point or unit)
+    sem : 3D np array
+        conditions x time x units; standard error of the mean (NaN with
+        fewer than two trials)
+    labels : np vector
+        condition of each row of psth, sorted
+
+    """
+    nsync = chopped.shape[0]
+    codes, labels = pd.factorize(np.asarray(conditions), sort=True)
+    keep = codes >= 0
+    codes = codes[keep]
+
+    # trials -> conditions; NaN values (e.g. missing sync point or unit)
+    # count as zero in the sums, and don't count as trials
+    onehot = np.zeros((labels.shape[0], codes.shape[0]))
+    onehot[codes, np.arange(codes.shape[0])] = 1
+    flat = chopped.reshape(nsync, -1)[keep]
+    valid = ~np.isnan(flat)
+    ntrials = onehot @ valid
+    with np.errstate(divide="ignore", invalid="ignore"):
+        psth = onehot @ np.where(valid, flat, 0) / ntrials
+
+        # spread around each condition's mean
+        resid = np.where(valid, flat - psth[codes], 0)
+        sem = np.sqrt(onehot @ resid**2 / (ntrials * (ntrials - 1)))
+
+    shape = (labels.shape[0],) + chopped.shape[1:]
+
+    return psth.reshape(shape), sem.reshape(shape), np.asarray(labels)
+
+
+def trial_correlations(chopped, nthreads=2, block=64):
+    """
+    Correlation between units over time, within each trial; as batched
+    matrix products (units x time times time x units, for every trial),
+    a block of trials per thread.
+
+    Parameters:
+    ----------
+    chopped : 3D np array
+        sync_points x time x units
+    nthreads : int
+        number of threads; default = 2
+    block : int
+        trials per matrix product
+
+    Returns:
+    -------
+    corr : 3D np array
+        sync_points x units x units; NaN for units that don't change
+        within a trial (e.g. no spikes), or with NaN values in it (e.g.
+        missing sync point or unit)
+
+    """
+    nsync, _, nunits = chopped.shape
+    corr = np.empty((nsync, nunits, nunits))
+
+    def do_block(first):
+        snippet = chopped[first:first + block].astype(np.float64)
+        snippet -= snippet.mean(axis=1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            snippet /= np.sqrt(np.sum(snippet**2, axis=1, keepdims=True))
+        corr[first:first + block] = np.matmul(
+            snippet.transpose(0, 2, 1), snippet)
+
+    with ThreadPoolExecutor(nthreads) as executor:
+        list(executor.map(do_block, range(0, nsync, block)))
+
+    return corr
+
+
+def noise_correlations(chopped, conditions=None):
+    """
+    Noise correlations: correlation between units of trial to trial
+    fluctuations in response (summed over time), after removing the mean
+    response to each condition.
+
+    Parameters:
+    ----------
+    chopped : 3D np array
+        sync_points x time x units
+    conditions : np vector
+        condition of each sync point; None = all trials in one condition
+
+    Returns:
+    -------
+    corr : 2D np array
+        units x units; each pair over the trials where neither is NaN
+        (e.g. missing sync point or unit); NaN for units that never
+        change
+
+    """
+    response = chopped.sum(axis=1, dtype=np.float64)
+    if conditions is None:
+        conditions = np.zeros(response.shape[0])
+
+    # residuals from each condition's mean; NaN responses (e.g. missing
+    # sync point or unit) are left out, and count as zero residual
+    codes, _ = pd.factorize(np.asarray(conditions))
+    response = response[codes >= 0]
+    codes = codes[codes >= 0]
+    valid = ~np.isnan(response)
+    response = np.where(valid, response, 0)
+    means = np.zeros((codes.max(initial=-1) + 1, response.shape[1]))
+    counts = np.zeros(means.shape)
+    np.add.at(means, codes, response)
+    np.add.at(counts, codes, valid)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means /= counts
+    resid = np.where(valid, response - means[codes], 0)
+
+    # each pair over the trials both units have
+    with np.errstate(divide="ignore", invalid="ignore"):
+        norm = (resid**2).T @ valid
+        corr = resid.T @ resid / np.sqrt(norm * norm.T)
+
+    return corr
@@ -0,0 +1,432 @@
+import sys
+import h5py
+import numpy as np
+import pandas as pd
+
+
+# OfflineSorter letters for sorted units 1, 2, ... (see make_name.m)
+UNIT_LETTERS = "abcdef"
+
+
+class PL2MatReader:
+    """
+    Reader for raw lfp or spk (.pl2 saved as v7.3 .mat, i.e. HDF5).
+
+    Opens the file once and keeps an index of its LFP channels; datasets
+    are read straight into (preallocated) np vectors, whole or in time
+    chunks. Use as a context manager, or call close() when done.
+
+    Parameters:
+    ----------
+    fname : string
+        Path file for raw lfp or spk data
+
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.file = h5py.File(fname, "r")
+
+        # index of lfp channels, in file order
+        self.channel_names = [key for key in self.file.keys()
+                              if key.find("FP") == 0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def length(self, name):
+        """Number of samples in dataset name."""
+        dset = self.file[name]
+        if dset.attrs.get("MATLAB_empty", 0):
+            return 0
+
+        return int(np.prod(dset.shape))
+
+    def read(self, name, out=None, start=0, stop=None, chunk_size=None):
+        """
+        Read a vector dataset (e.g. LFP channel, spike times).
+
+        Parameters:
+        ----------
+        name : string
+            dataset name, e.g. "FP001"
+        out : np vector
+            preallocated buffer, length stop - start; None = make one
+        start : int
+            first sample
+        stop : int
+            last sample (exclusive); None = end
+        chunk_size : int
+            samples per read; None = read all at once
+
+        Returns:
+        -------
+        data : np vector
+            float64 unless out has another dtype
+
+        """
+        if stop is None:
+            stop = self.length(name)
+        if out is None:
+            out = np.empty(stop - start)
+        if stop <= start:
+            return out
+
+        if chunk_size is None:
+            chunk_size = stop - start
+
+        dset = self.file[name]
+        for first in range(start, stop, chunk_size):
+            last = min(first + chunk_size, stop)
+            dset.read_direct(out, self._selection(dset, first, last),
+                             np.s_[first - start:last - start])
+
+        return out
+
+    def iter_chunks(self, name, chunk_size, start=0, stop=None):
+        """
+        Read a vector dataset in time chunks.
+
+        Parameters:
+        ----------
+        name : string
+            dataset name, e.g. "FP001"
+        chunk_size : int
+            samples per chunk
+        start : int
+            first sample
+        stop : int
+            last sample (exclusive); None = end
+
+        Yields:
+        -------
+        first : int
+            index of first sample in chunk
+        chunk : np vector
+            samples in chunk; buffer is reused, copy to keep
+
+        """
+        if stop is None:
+            stop = self.length(name)
+
+        buffer = np.empty(min(chunk_size, max(stop - start, 0)))
+        for first in range(start, stop, chunk_size):
+            last = min(first + chunk_size, stop)
+            chunk = buffer[:last - first]
+            yield first, self.read(name, chunk, first, last)
+
+    def read_ts(self):
+        """LFP time stamps (in ms)."""
+        return self.read("lfp_ts")
+
+    def read_events(self):
+        """Task event codes and corresponding time stamps."""
+        return {"event_codes": self.read("event_codes"),
+                "event_ts": self.read("event_ts")}
+
+    def read_unit_names(self):
+        """Names of sorted units (spk), e.g. "SPK_SPKC001a"."""
+        refs = self.file["unit_names"][()].reshape(-1)
+
+        # MATLAB chars, saved as uint16
+        return ["".join(chr(c) for c in self.file[r][()].reshape(-1))
+                for r in refs]
+
+    def read_unit_info(self):
+        """
+        Meta data for each sorted unit, from dataset shapes plus the last
+        spike of each unit; no other spikes are read.
+
+        Returns:
+        -------
+        unit_info : pd table
+            one row per unit: ID, channel, nspikes, last_spk (in sec; NaN
+            for units without spikes)
+
+        """
+        unit_names = self.read_unit_names()
+        nspikes = np.array([self.length(u) for u in unit_names],
+                           dtype=np.int64)
+        last_spk = np.array([self.read(u, start=n - 1)[0] if n else np.nan
+                             for u, n in zip(unit_names, nspikes)])
+
+        return pd.DataFrame({"ID": unit_names,
+                             "channel": unit_channels(unit_names),
+                             "nspikes": nspikes,
+                             "last_spk": last_spk})
+
+    @staticmethod
+    def _selection(dset, first, last):
+        """Slice into MATLAB vector, saved as 1 x n or n x 1."""
+        if len(dset.shape) == 1:
+            return np.s_[first:last]
+        if dset.shape[0] == 1:
+            return np.s_[0, first:last]
+
+        return np.s_[first:last, 0]
+
+
+class PL2Reader(PL2MatReader):
+    """
+    Reader for raw lfp or spk straight from Plexon .pl2 files, skipping
+    the MATLAB conversion; same interface and names as PL2MatReader on the
+    converted .mat: LFP channels ("FP..."), "lfp_ts" (sample number, i.e.
+    ms @ 1 kHz), units named as in matlab/functions/make_name.m (e.g.
+    "SPK_SPKC001a"), and "event_codes" / "event_ts" from the Strobed
+    channel.
+
+    The .pl2 layout isn't published, so data are read with Plexon's Python
+    PL2 SDK (pypl2, optional dependency). pypl2 is a ctypes wrapper around
+    Plexon's PL2FileReader.dll: Windows only (ImportError elsewhere), and
+    not on PyPI (download it from Plexon); elsewhere, convert to .mat with
+    matlab/convert_raw_*.m. There are no partial reads, so data come one
+    whole channel at a time; the last channel read is kept, so time chunks
+    of one channel only load it once, and units on one spike channel share
+    a load. Spike counts come from the file header, but the last spike of
+    a unit (read_unit_info, select_units) needs its channel loaded, so
+    picking units from .pl2 still reads every spike channel once (unlike
+    .mat, where only the picked units are read). LFP comes back in mV (the
+    .mat has raw A/D values); zscored magnitude and phase don't change.
+
+    Parameters:
+    ----------
+    fname : string
+        Path file for raw .pl2 data
+    max_units : int
+        sorted units per spike channel to look for; default = 6, as in
+        load_spk_pl2.m
+
+    """
+
+    def __init__(self, fname, max_units=6):
+        if not sys.platform.startswith("win"):
+            raise ImportError("reading .pl2 needs Plexon's Python PL2 SDK "
+                              "(pypl2), which only runs on Windows (this is "
+                              "%s); convert to .mat with "
+                              "matlab/convert_raw_*.m" % sys.platform)
+        try:
+            import pypl2
+        except ImportError:
+            raise ImportError("reading .pl2 needs Plexon's Python PL2 SDK "
+                              "(pypl2); or convert to .mat with "
+                              "matlab/convert_raw_*.m")
+        self.fname = fname
+        self.pypl2 = pypl2
+        self.loaded = (None, None)
+        self.loaded_spikes = (None, None)
+
+        # spike, event, and analog channels: (channel, name, counts)
+        spk_info, evt_info, ad_info = pypl2.pl2_info(fname)
+
+        # index of lfp channels, in file order, and their lengths
+        self.counts = {_decode(ad[1]): int(ad[2]) for ad in ad_info}
+        self.channel_names = [ch for ch in self.counts if ch.find("FP") == 0]
+        if self.channel_names:
+            self.counts["lfp_ts"] = self.counts[self.channel_names[0]]
+        for evt in evt_info:
+            if _decode(evt[1]) == "Strobed":
+                self.counts["event_codes"] = int(evt[2])
+                self.counts["event_ts"] = int(evt[2])
+
+        # sorted units on each spike channel, until the first empty one;
+        # unit counts start with unsorted spikes
+        self.units = dict()
+        for spk in spk_info:
+            chname = _decode(spk[1])
+            for u in range(1, min(len(spk[2]), max_units + 1)):
+                if not spk[2][u]:
+                    break
+                name = chname + UNIT_LETTERS[u - 1]
+                while name in self.units:  # repeat letter until unique
+                    name += UNIT_LETTERS[u - 1]
+                self.units[name] = (chname, u)
+                self.counts[name] = int(spk[2][u])
+
+    def close(self):
+        self.loaded = (None, None)
+        self.loaded_spikes = (None, None)
+
+    def length(self, name):
+        """Number of samples in channel (or unit) name."""
+        return self.counts.get(name, 0)
+
+    def read(self, name, out=None, start=0, stop=None, chunk_size=None):
+        """
+        Read a channel, unit, or events (see PL2MatReader.read).
+
+        Parameters:
+        ----------
+        name : string
+            channel or unit name, e.g. "FP001", "SPK_SPKC001a"
+        out : np vector
+            preallocated buffer, length stop - start; None = make one
+        start : int
+            first sample
+        stop : int
+            last sample (exclusive); None = end
+        chunk_size : int
+            ignored; the whole channel is loaded once
+
+        Returns:
+        -------
+        data : np vector
+            float64 unless out has another dtype
+
+        """
+        if stop is None:
+            stop = self.length(name)
+        if out is None:
+            out = np.empty(stop - start)
+        if stop <= start:
+            return out
+
+        out[:] = self._load(name)[start:stop]
+
+        return out
+
+    def read_unit_names(self):
+        """Names of sorted units (spk), e.g. "SPK_SPKC001a"."""
+        return list(self.units)
+
+    def _load(self, name):
+        """Whole channel (or unit, events) as np vector; keeps the last."""
+        if self.loaded[0] == name:
+            return self.loaded[1]
+
+        if name in self.units:
+            chname, u = self.units[name]
+            ts, units = self._load_spikes(chname)
+            data = ts[units == u]
+        elif name in ["event_codes", "event_ts"]:
+            events = self.pypl2.pl2_events(self.fname, "Strobed")
+            data = np.asarray(events[2 if name == "event_codes" else 1],
+                              dtype=float)
+        elif name == "lfp_ts":
+            data = np.arange(1, self.length(name) + 1, dtype=float)
+        else:
+            data = np.asarray(self.pypl2.pl2_ad(self.fname, name)[4],
+                              dtype=float)
+        self.loaded = (name, data)
+
+        return data
+
+    def _load_spikes(self, chname):
+        """Spike times and unit numbers on a spike channel; keeps the
+        last, so units on one channel only load it once."""
+        if self.loaded_spikes[0] != chname:
+            spikes = self.pypl2.pl2_spikes(self.fname, chname)
+            self.loaded_spikes = (chname, (np.asarray(spikes[1], dtype=float),
+                                           np.asarray(spikes[2])))
+
+        return self.loaded_spikes[1]
+
+
+def open_reader(fname):
+    """PL2Reader for .pl2 files, PL2MatReader for .pl2 saved as .mat."""
+    if is_pl2(fname):
+        return PL2Reader(fname)
+
+    return PL2MatReader(fname)
+
+
+def is_pl2(fname):
+    """True for raw Plexon .pl2 file (instead of converted .mat)."""
+    return str(fname).lower().endswith(".pl2")
+
+
+def load_spk(spk_fname, unit_names=None):
+    """
+    Load raw spk, as mat73.loadmat does for .pl2 saved as .mat: spike
+    times (in sec) for each unit name, plus "unit_names" (one element
+    lists) and "event_codes" / "event_ts". Only the datasets of unit_names
+    are read.
+
+    Parameters:
+    ----------
+    spk_fname : string or PL2MatReader
+        Path file for raw spk data, or open reader
+    unit_names : list
+        units to load (see select_units); None = all units
+
+    Returns:
+    -------
+    data : dict
+        spk data, with unit spike times (np vectors) plus some meta data
+
+    """
+    if not isinstance(spk_fname, PL2MatReader):
+        with open_reader(spk_fname) as reader:
+            return load_spk(reader, unit_names)
+
+    reader = spk_fname
+    if unit_names is None:
+        unit_names = reader.read_unit_names()
+    data = {u: reader.read(u) for u in unit_names}
+    data["unit_names"] = [[u] for u in unit_names]
+    data.update(reader.read_events())
+
+    return data
+
+
+def select_units(reader, channels=-1, min_rate=0, min_spikes=0):
+    """
+    Pick units to load from their meta data (see read_unit_info), without
+    reading their spikes.
+
+    Parameters:
+    ----------
+    reader : PL2MatReader
+        open reader for raw spk data
+    channels : list
+        Integers, restrict to units on these channel numbers; if -1, use
+        all channels
+    min_rate : float
+        drop units firing less often (spikes / sec over the session, i.e.
+        up to the last spike of any unit, +1 second)
+    min_spikes : int
+        drop units with fewer spikes
+
+    Returns:
+    -------
+    unit_info : pd table
+        one row per selected unit, in file order: ID, channel, nspikes,
+        last_spk (in sec)
+    duration : float
+        session length, in sec: last spike of any unit (selected or not),
+        +1 second; rates and spike trains should use this, so they don't
+        change with the selection
+
+    """
+    unit_info = reader.read_unit_info()
+    duration = 1 + (unit_info.last_spk.max() if unit_info.shape[0] else 0)
+    if np.isnan(duration):  # no spikes at all
+        duration = 1.0
+
+    keep = (unit_info.nspikes >= min_spikes) & \
+        (unit_info.nspikes >= min_rate * duration)
+    if channels != -1:
+        keep &= unit_info.channel.isin(channels)
+
+    return unit_info[keep].reset_index(drop=True), duration
+
+
+def unit_channels(unit_names):
+    """Channel numbers from unit names (e.g. "SPK_SPKC012a" -> 12)."""
+    names = np.char.replace(np.asarray(unit_names, dtype=str), "SPK_SPKC",
+                            "")
+
+    return names.astype("U3").astype(np.int64)
+
+
+def _decode(name):
+    """Channel name from pypl2 (bytes or string)."""
+    if isinstance(name, bytes):
+        name = name.decode("ascii")
+
+    return name.strip("\x00").strip()
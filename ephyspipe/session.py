@@ -0,0 +1,210 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import ephyspipe.behavior as bhv
+from ephyspipe.brain import chop, process_raw_lfp, process_raw_spk
+from ephyspipe.dataset import save_dataset
+from ephyspipe.filters import BROADBAND, FilterBank
+
+
+class Session:
+    """
+    One session, with spikes and LFP chopped at sync points taken from
+    behavior (see load_session).
+
+    Parameters:
+    ----------
+    bhv_columns : dict
+        per trial fields (see load_bhv_columns)
+    trialinfo : pd table
+        trial info (see get_trialinfo), plus sync point of each trial
+    pl2_codes : dict
+        Event codes and timestamps from whole session
+    sync_points : np vector
+        time of sync code in each trial (-1 if missing)
+    ts_chopped : np vector
+        time for data chopped at sync_points, in sec
+    spk : dict
+        "raster" and "fr": 3D np arrays, sync_points x time x units; None
+        = no spk file
+    unit_meta : pd table
+        meta data; each row corresponds to unit
+    lfp : dict
+        band name: (magnitude, phase), 3D np arrays, sync_points x time x
+        channels; or LazyBands; None = no lfp file
+    lfp_meta : pd table
+        meta data; each row corresponds to LFP channel
+
+    """
+
+    def __init__(self, bhv_columns, trialinfo, pl2_codes, sync_points,
+                 ts_chopped, spk=None, unit_meta=None, lfp=None,
+                 lfp_meta=None):
+        self.bhv_columns = bhv_columns
+        self.trialinfo = trialinfo
+        self.pl2_codes = pl2_codes
+        self.sync_points = sync_points
+        self.ts_chopped = ts_chopped
+        self.spk = spk
+        self.unit_meta = unit_meta
+        self.lfp = lfp
+        self.lfp_meta = lfp_meta
+
+    def save(self, fname, **kwargs):
+        """Save as trial aligned dataset (see dataset.save_dataset)."""
+        return save_dataset(fname, self.trialinfo, self.ts_chopped,
+                            self.spk, self.unit_meta, self.lfp,
+                            self.lfp_meta, **kwargs)
+
+
+def load_session(bhv_fnames, spk_fname, lfp_fname, sync_code, time_range,
+                 **kwargs):
+    """
+    Load a session (see load_session_async), from outside an event loop;
+    in a running loop (e.g. a notebook), await load_session_async instead.
+    """
+    return asyncio.run(load_session_async(bhv_fnames, spk_fname, lfp_fname,
+                                          sync_code, time_range, **kwargs))
+
+
+async def load_session_async(bhv_fnames, spk_fname, lfp_fname, sync_code,
+                             time_range, fields=None, nthreads=4,
+                             executor=None, spk_kwargs=None,
+                             lfp_kwargs=None):
+    """
+    Load behavior, event codes, spikes and LFP for a session concurrently,
+    each in a worker thread, and chop spikes and LFP at the sync code.
+
+    Every bhv file, the event codes and the spikes are read at once;
+    decoding one (e.g. spike trains into firing rates) overlaps reading
+    the others. LFP is chopped as it's filtered, so it starts as soon as
+    behavior and event codes give the sync points, while spikes finish.
+
+    Parameters:
+    ----------
+    bhv_fnames : list
+        File path(s) for behavior data (.bhv2 saved as .mat)
+    spk_fname : string
+        Path file for raw spk data; None = no spikes
+    lfp_fname : string
+        Path file for raw lfp data; None = no LFP
+    sync_code : int
+        event code to sync on, e.g. stimulus onset
+    time_range : 2 element tuple
+        Time range around sync points, in sec
+    fields : list
+        more per trial fields to load (see load_bhv_columns), on top of
+        trial info
+    nthreads : int
+        number of threads (if no executor); default = 4
+    executor : concurrent.futures.Executor
+        to run loads in; default = new thread pool, shut down when done.
+        On error, loads not started yet are cancelled, and the new pool
+        waits for running ones to finish
+    spk_kwargs : dict
+        more arguments for process_raw_spk, e.g. {"channels": [1, 2]}
+    lfp_kwargs : dict
+        more arguments for process_raw_lfp, e.g. {"nworkers": 8}
+
+    Returns:
+    -------
+    session : Session
+        all data, synced
+
+    """
+    fields = ["Trial"] + bhv.TRIALINFO_FIELDS + list(fields or [])
+    spk_kwargs = spk_kwargs or dict()
+    lfp_kwargs = lfp_kwargs or dict()
+    loop = asyncio.get_running_loop()
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(nthreads)
+
+    futures = []
+
+    def run(f, *args, **kw):
+        future = loop.run_in_executor(executor, functools.partial(f, *args,
+                                                                  **kw))
+        futures.append(future)
+        return future
+
+    try:
+        # start reading everything that doesn't need sync points
+        bhv_reads = [run(bhv.read_bhv_columns, f, fields)
+                     for f in bhv_fnames]
+        codes_read = run(bhv.load_pl2_codes, spk_fname or lfp_fname)
+        spk_read = None
+        if spk_fname is not None:
+            spk_read = run(process_raw_spk, spk_fname, **spk_kwargs)
+
+        # sync points, as soon as behavior and event codes are in
+        bhv_columns = bhv.stack_bhv_columns(
+            await asyncio.gather(*bhv_reads), fields)
+        pl2_codes = await codes_read
+        sync_points = bhv.get_trial_events(bhv_columns, pl2_codes,
+                                           sync_code)
+        trialinfo = bhv.get_trialinfo(bhv_columns)
+        trialinfo["sync"] = sync_points
+
+        # lfp, while spikes finish
+        lfp_read = None
+        if lfp_fname is not None:
+            lfp_read = run(process_raw_lfp, lfp_fname, sync_points,
+                           time_range, **lfp_kwargs)
+
+        spk, unit_meta = await _gather_spk(spk_read, run, sync_points,
+                                           time_range)
+        lfp, ts_chopped, lfp_meta = await _gather_lfp(
+            lfp_read, lfp_kwargs,
+            np.arange(time_range[0], time_range[1], 0.001))
+    except BaseException:
+        # don't start what's left
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+
+    return Session(bhv_columns, trialinfo, pl2_codes, sync_points,
+                   ts_chopped, spk, unit_meta, lfp, lfp_meta)
+
+
+async def _gather_spk(spk_read, run, sync_points, time_range):
+    """Chopped raster and firing rates, and unit meta data, once spikes are
+    in (see load_session_async); None, None if no spikes."""
+    if spk_read is None:
+        return None, None
+
+    raster, fr, unit_meta = await spk_read
+    chopped = await asyncio.gather(run(chop, raster, sync_points, time_range),
+                                   run(chop, fr, sync_points, time_range))
+
+    return dict(zip(["raster", "fr"], chopped)), unit_meta
+
+
+async def _gather_lfp(lfp_read, lfp_kwargs, ts_chopped):
+    """Bands by name, time for chopped data and channel meta data, once LFP
+    is in (see load_session_async); None, ts_chopped, None if no LFP."""
+    if lfp_read is None:
+        return None, ts_chopped, None
+
+    lfp = await lfp_read
+    if not isinstance(lfp, tuple):  # lazy
+        return lfp, lfp.ts_chopped, lfp.lfp_meta
+    mag, phs, ts_chopped, lfp_meta = lfp
+
+    return dict(zip(_band_names(lfp_kwargs), zip(mag, phs))), ts_chopped, \
+        lfp_meta
+
+
+def _band_names(lfp_kwargs):
+    """Bands process_raw_lfp filters into, given its arguments."""
+    filter_bank = lfp_kwargs.get("filter_bank")
+    if filter_bank is None:
+        filter_bank = FilterBank(
+            bands=BROADBAND if lfp_kwargs.get("broadband") else None)
+
+    return filter_bank.band_names
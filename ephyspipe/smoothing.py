@@ -0,0 +1,163 @@
+import numpy as np
+import scipy.signal as signal
+
+
+def boxcar_kernel(width=49):
+    """
+    Flat smoothing kernel.
+
+    Parameters:
+    ----------
+    width : int
+        number of samples; default 49 (~50 ms boxcar @ 1 kHz)
+
+    Returns:
+    -------
+    kernel : np vector
+        normalized to sum to 1
+
+    """
+    return np.ones(width) / width
+
+
+def gaussian_kernel(sigma, truncate=4):
+    """
+    Gaussian smoothing kernel.
+
+    Parameters:
+    ----------
+    sigma : float
+        standard deviation, in samples
+    truncate : float
+        cut kernel off at this many standard deviations
+
+    Returns:
+    -------
+    kernel : np vector
+        normalized to sum to 1; odd length, centered
+
+    """
+    half = int(np.ceil(truncate * sigma))
+    kernel = signal.windows.gaussian(2 * half + 1, sigma)
+
+    return kernel / kernel.sum()
+
+
+def exponential_kernel(tau, truncate=5):
+    """
+    Causal exponential smoothing kernel: each sample only sees the past.
+
+    Parameters:
+    ----------
+    tau : float
+        decay time constant, in samples
+    truncate : float
+        cut kernel off at this many time constants
+
+    Returns:
+    -------
+    kernel : np vector
+        normalized to sum to 1; left half is zero so "same" convolution
+        (centered kernel) is causal
+
+    """
+    decay = np.exp(-np.arange(int(np.ceil(truncate * tau)) + 1) / tau)
+    kernel = np.concatenate([np.zeros(decay.shape[0] - 1), decay])
+
+    return kernel / kernel.sum()
+
+
+def smooth(data, kernel=None, axis=-1, method="auto"):
+    """
+    Smooth all rows of data in one vectorized pass; same output as
+    np.convolve(row, kernel, "same") for each row (zero padded edges).
+
+    Parameters:
+    ----------
+    data : np array
+        e.g. units x time, spike trains
+    kernel : np vector
+        smoothing kernel; default = 49 sample boxcar
+    axis : int
+        time axis to smooth along
+    method : string
+        "running" = running sums (boxcar only; O(ntimes) for any width),
+        "fft" = FFT convolution, "direct" = direct convolution, or
+        "auto" (default) = running sums for boxcar, else FFT for long
+        kernels and direct for short ones
+
+    Returns:
+    -------
+    smoothed : np array
+        same shape as data
+
+    """
+    if kernel is None:
+        kernel = boxcar_kernel()
+    kernel = np.asarray(kernel, dtype=float)
+    data = np.asarray(data, dtype=float)
+
+    if method == "auto":
+        if np.all(kernel == kernel[0]):
+            method = "running"
+        elif kernel.shape[0] > 64:
+            method = "fft"
+        else:
+            method = "direct"
+
+    if method == "running":
+        if not np.all(kernel == kernel[0]):
+            raise ValueError("running sums only work for boxcar kernels")
+        return running_sum(data, kernel.shape[0], axis) * kernel[0]
+
+    # line kernel up with time axis
+    shape = [1] * data.ndim
+    shape[axis] = kernel.shape[0]
+    kernel = kernel.reshape(shape)
+
+    if method == "fft":
+        return signal.fftconvolve(data, kernel, mode="same",
+                                  axes=axis % data.ndim)
+    if method == "direct":
+        return signal.convolve(data, kernel, mode="same", method="direct")
+
+    raise ValueError("Unknown smoothing method: " + str(method))
+
+
+def running_sum(data, width, axis=-1):
+    """
+    Sum over a centered window of width samples; window spans
+    [i - width//2, i + (width-1)//2], which lines up with "same"
+    convolution. Edges are zero padded.
+
+    Parameters:
+    ----------
+    data : np array
+        e.g. units x time
+    width : int
+        number of samples in window
+    axis : int
+        time axis
+
+    Returns:
+    -------
+    summed : np array
+        same shape as data
+
+    """
+    data = np.moveaxis(data, axis, -1)
+    ntimes = data.shape[-1]
+
+    # cumulative sum, with leading 0
+    csum = np.zeros(data.shape[:-1] + (ntimes + 1,))
+    np.cumsum(data, axis=-1, out=csum[..., 1:])
+
+    # window edges, clipped to the data
+    t = np.arange(ntimes)
+    hi = np.minimum(t + (width - 1) // 2 + 1, ntimes)
+    lo = np.maximum(t - width // 2, 0)
+
+    summed = csum[..., hi]
+    summed -= csum[..., lo]
+
+    return np.moveaxis(summed, -1, axis)
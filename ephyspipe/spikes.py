@@ -0,0 +1,263 @@
+import numpy as np
+from ephyspipe.smoothing import smooth
+
+
+class SpikeRaster:
+    """
+    Sparse spike trains for units x entire session, @ 1 kHz.
+
+    Stored CSR-style: the sorted spike time indices (ms) of every unit are
+    concatenated into one vector, and offsets mark where each unit starts
+    and stops. Memory scales with the number of spikes rather than session
+    duration; dense snippets are only made when data are pulled out.
+
+    If a smoothing kernel is attached (see get_fr), it is applied lazily to
+    whatever is pulled out, with the same "same" edge handling as smoothing
+    the dense trains for the entire session.
+
+    Parameters:
+    ----------
+    indices : np vector
+        spike time indices (ms) for all units, sorted within each unit
+    offsets : np vector
+        nunits + 1; spikes for unit u are indices[offsets[u]:offsets[u+1]]
+    ntimes : int
+        index of max time point
+    kernel : np vector
+        smoothing kernel; None (default) = raw spike trains
+
+    """
+
+    def __init__(self, indices, offsets, ntimes, kernel=None):
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.ntimes = int(ntimes)
+        self.kernel = kernel
+
+    @classmethod
+    def from_timestamps(cls, timestamps, ntimes):
+        """
+        Make sparse raster from spike timestamps.
+
+        Parameters:
+        ----------
+        timestamps : list
+            np vectors, times each unit fired (in sec)
+        ntimes : int
+            index of max time point
+
+        Returns:
+        -------
+        raster : SpikeRaster
+            spike trains, nunits x ntimes
+
+        """
+        # closest ms time stamp; repeats collapse into one spike, like trains
+        units = [np.unique(np.round(1000 * np.atleast_1d(ts)).astype(int))
+                 for ts in timestamps]
+
+        offsets = np.zeros(len(units) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(u) for u in units])
+        if len(units):
+            indices = np.concatenate(units)
+        else:
+            indices = np.zeros(0, dtype=np.int64)
+
+        return cls(indices, offsets, ntimes)
+
+    @property
+    def nunits(self):
+        return self.offsets.shape[0] - 1
+
+    @property
+    def shape(self):
+        return (self.nunits, self.ntimes)
+
+    @property
+    def nspikes(self):
+        return self.indices.shape[0]
+
+    def unit(self, u):
+        """Spike time indices (ms) for unit u."""
+        return self.indices[self.offsets[u]:self.offsets[u + 1]]
+
+    def smooth(self, kernel):
+        """Same spikes, with smoothing kernel applied lazily."""
+        return SpikeRaster(self.indices, self.offsets, self.ntimes, kernel)
+
+    def toarray(self, start=0, stop=None):
+        """
+        Make dense units x time snippet.
+
+        Parameters:
+        ----------
+        start : int
+            first time index
+        stop : int
+            last time index (exclusive); None = end of session
+
+        Returns:
+        -------
+        dense : 2D np array
+            units x (stop - start); spike trains, or firing rates if
+            smoothing kernel is attached
+
+        """
+        if stop is None:
+            stop = self.ntimes
+
+        if self.kernel is None:
+            return self._trains(start, stop)
+
+        # pad by kernel length so cut edges see their neighboring spikes
+        margin = len(self.kernel)
+        lo = max(0, start - margin)
+        hi = min(self.ntimes, stop + margin)
+        smoothed = smooth(self._trains(lo, hi), self.kernel, axis=1)
+
+        return smoothed[:, start - lo:stop - lo]
+
+    def take(self, idx):
+        """
+        Pull out values at arbitrary time indices.
+
+        Parameters:
+        ----------
+        idx : np array
+            time indices, within [0, ntimes)
+
+        Returns:
+        -------
+        values : np array
+            nunits x idx.shape
+
+        """
+        idx = np.asarray(idx)
+        lo = idx.min()
+        hi = idx.max() + 1
+        return self.toarray(lo, hi)[:, idx - lo]
+
+    def windows(self, starts, width):
+        """
+        Pull out fixed width windows (e.g. trials), only binning the spikes
+        that fall inside them; never makes the trains for the entire
+        session.
+
+        Parameters:
+        ----------
+        starts : np vector
+            first time index of each window
+        width : int
+            number of time points in each window
+
+        Returns:
+        -------
+        chopped : 3D np array
+            windows x time x units; spike trains, or firing rates if
+            smoothing kernel is attached
+
+        """
+        starts = np.asarray(starts, dtype=np.int64).reshape(-1)
+
+        if self.kernel is None:
+            return self._binned(starts, width)
+
+        # pad by kernel length so window edges see their neighboring spikes
+        margin = len(self.kernel)
+        binned = self._binned(starts - margin, width + 2 * margin)
+        smoothed = smooth(binned, self.kernel, axis=1)
+
+        return smoothed[:, margin:margin + width, :]
+
+    def window_mean(self, starts, width, block=60000):
+        """
+        Average over windows of fixed width; goes through the session in
+        blocks, so never holds more than units x block dense values.
+
+        Parameters:
+        ----------
+        starts : np vector
+            first time index of each window, ascending
+        width : int
+            number of time points in each window
+        block : int
+            time points per block
+
+        Returns:
+        -------
+        means : 2D np array
+            units x windows
+
+        """
+        starts = np.asarray(starts, dtype=int)
+        means = np.empty((self.nunits, starts.shape[0]))
+
+        first = 0
+        while first < starts.shape[0]:
+            # all windows that fit in this block
+            last = np.searchsorted(starts, starts[first] + block, "right")
+            lo = starts[first]
+            hi = starts[last - 1] + width
+            dense = self.toarray(lo, hi)
+
+            csum = np.zeros((dense.shape[0], dense.shape[1] + 1))
+            np.cumsum(dense, axis=1, out=csum[:, 1:])
+            win = starts[first:last] - lo
+            means[:, first:last] = (csum[:, win + width] - csum[:, win]) / width
+
+            first = last
+
+        return means
+
+    def _binned(self, starts, width):
+        """Dense 0/1 spike trains in windows, windows x time x units."""
+        binned = np.zeros((starts.shape[0], width, self.nunits))
+        for u in range(self.nunits):
+            win, spikes = window_spikes(self.unit(u), starts, starts + width)
+            binned[win, spikes - starts[win], u] = 1
+
+        return binned
+
+    def _trains(self, start, stop):
+        """Dense 0/1 spike trains between start and stop."""
+        trains = np.zeros((self.nunits, stop - start))
+        for u in range(self.nunits):
+            spikes = self.unit(u)
+            spikes = spikes[np.searchsorted(spikes, start):
+                            np.searchsorted(spikes, stop)]
+            trains[u, spikes - start] = 1
+
+        return trains
+
+
+def window_spikes(spikes, starts, stops):
+    """
+    Find the spikes in each window with two binary searches per window;
+    windows may overlap.
+
+    Parameters:
+    ----------
+    spikes : np vector
+        sorted spike time indices for one unit
+    starts : np vector
+        first time index of each window
+    stops : np vector
+        last time index of each window (exclusive)
+
+    Returns:
+    -------
+    win : np vector
+        window index for each (window, spike) pair
+    spk : np vector
+        spike time index for each (window, spike) pair
+
+    """
+    lo = np.searchsorted(spikes, starts)
+    counts = np.searchsorted(spikes, stops) - lo
+
+    # position in spikes of each pair: lo of its window, plus its rank
+    win = np.repeat(np.arange(starts.shape[0]), counts)
+    first = np.repeat(lo - np.cumsum(counts) + counts, counts)
+    pos = first + np.arange(win.shape[0])
+
+    return win, spikes[pos]
@@ -0,0 +1,560 @@
+import os
+import h5py
+import numpy as np
+from ephyspipe.brain import chop, get_analytic, get_fr, get_notched
+from ephyspipe.filters import ChannelSpectrum, FilterBank, BROADBAND
+from ephyspipe.readers import (PL2MatReader, open_reader, select_units,
+                               unit_channels)
+from ephyspipe.smoothing import boxcar_kernel
+from ephyspipe.spikes import SpikeRaster
+
+
+def stream_spk(spk_fname, out_fname, sync_point, time_range, channels=-1,
+               kernel=None, block=2**22, append=False):
+    """
+    Chop spike trains and firing rates around sync points, one unit (and
+    block of sync points) at a time, written to an HDF5 store as they are
+    made; never holds session-long trains, or all chopped units, in
+    memory. Same output as chop(process_raw_spk(...)[i], ...).
+
+    Store:
+        raster, fr : sync points x time x units
+        ts_chopped : time for data chopped at sync points, in sec
+        unit_names, channel, mean_fr, nspikes : meta data, one per unit
+
+    Parameters:
+    ----------
+    spk_fname : string
+        Path file for raw spk data
+    out_fname : string
+        Path file for output store (HDF5)
+    sync_point : np vector
+        Times to sync across session (e.g. trial start)
+    time_range : 2 element tuple
+        Time range around sync points, in sec
+    channels : list
+        Integers, restrict processing to these channel numbers; if -1, use
+        all channels
+    kernel : np vector
+        smoothing kernel for firing rates; default = 49 ms boxcar
+    block : int
+        max values (sync points x time) chopped at once
+    append : bool
+        default 0 = new store (overwritten); 1 = spk_fname is the next
+        block of a session split across files: add its sync points (in
+        this file's time) after the ones already stored, without touching
+        earlier blocks. Units are matched by name; units new in this
+        block get a new column, and units missing from a block are NaN
+        for its sync points. mean_fr covers all blocks so far.
+
+    Returns:
+    -------
+    out_fname : string
+        Path file for output store
+
+    """
+    sync_point = np.asarray(sync_point, dtype=float)
+    ts_chopped = np.arange(time_range[0], time_range[1], 0.001)
+    nt = np.arange(time_range[0] * 1000, time_range[1] * 1000).shape[0]
+    nsync = sync_point.shape[0]
+    rows = max(1, block // nt)
+    append = append and os.path.exists(out_fname)
+
+    with open_reader(spk_fname) as reader, \
+            h5py.File(out_fname, "r+" if append else "w") as out:
+        unit_info, max_t = select_units(reader, channels)
+        unit_names = list(unit_info.ID)
+        nunits = len(unit_names)
+
+        # session length as in process_raw_spk: last spike of any unit, +1
+        # second (selected or not)
+        nspikes = unit_info.nspikes.to_numpy()
+        ntimes = np.round(1000 * max_t)
+
+        if append:
+            _check_store(out, ts_chopped=ts_chopped)
+        else:
+            _create_spk_store(out, ts_chopped, max(1, min(nsync, rows)))
+
+        # column for each unit; new units go after the stored ones
+        stored = list(out["unit_names"].asstr()[()])
+        new_units = [u for u in unit_names if u not in stored]
+        cols = [(stored + new_units).index(u) for u in unit_names]
+        nold = out["raster"].shape[0]
+        nunits_all = len(stored) + len(new_units)
+        for name in ["raster", "fr"]:
+            out[name].resize((nold + nsync, nt, nunits_all))
+        for name in ["unit_names", "channel", "mean_fr", "nspikes"]:
+            out[name].resize((nunits_all,))
+        if new_units:
+            out["unit_names"][len(stored):] = new_units
+            out["channel"][len(stored):] = unit_channels(new_units)
+
+        # mean firing rate over all blocks so far
+        out.attrs["duration"] += max_t
+        all_nspikes = out["nspikes"][()]
+        all_nspikes[cols] += nspikes
+        out["nspikes"][:] = all_nspikes
+        out["mean_fr"][:] = all_nspikes / out.attrs["duration"]
+
+        for u in range(nunits):
+            raster = SpikeRaster.from_timestamps(
+                [reader.read(unit_names[u])], ntimes)
+            fr = get_fr(raster, kernel)
+
+            # chop a block of sync points at a time
+            for first in range(0, nsync, rows):
+                last = min(first + rows, nsync)
+                sync_block = sync_point[first:last]
+                snippet = np.s_[nold + first:nold + last, :, cols[u]]
+                out["raster"][snippet] = chop(
+                    raster, sync_block, time_range).reshape(last - first, nt)
+                out["fr"][snippet] = chop(
+                    fr, sync_block, time_range).reshape(last - first, nt)
+
+    return out_fname
+
+
+def stream_lfp(lfp_fname, out_fname, sync_point, time_range, channels=-1,
+               broadband=0, filter_bank=None, block=600000, pad=None,
+               method="filtfilt", append=False):
+    """
+    Notch and bandpass LFP, and chop around sync points, streaming each
+    channel through in time blocks; peak memory scales with block (plus
+    padding) instead of session duration.
+
+    Each block is loaded with pad samples of overlap on both sides,
+    filtered (zero phase), and only its unpadded middle is kept
+    (overlap-save), so the blocks line up into the session-long signal.
+    Chopped magnitude and phase are written to the HDF5 store as each
+    block arrives, a run of sync points at a time (windows split across
+    blocks once complete); session statistics for the magnitude zscore
+    are summed on the way, and the chopped magnitude is zscored in a
+    second pass over the store.
+
+    Results match process_raw_lfp up to filter edge effects that leak past
+    the padding; sync points that are missing (-1), or window samples
+    outside the session, are NaN.
+
+    Store:
+        mag/<band>, phs/<band> : sync points x time x channels
+        ts_chopped : time for data chopped at sync points, in sec
+        channel_names : LFP channel IDs
+        band_names : bands, in filter bank order
+        sync_point : sync points, in sec from start of first file
+
+    Parameters:
+    ----------
+    lfp_fname : string
+        Path file for raw lfp data
+    out_fname : string
+        Path file for output store (HDF5)
+    sync_point : np vector
+        Times to sync across session (e.g. trial start)
+    time_range : 2 element tuple
+        Time range around sync points, in sec
+    channels : list
+        Integers; restrict to these channels; -1 = all
+    broadband : bool
+        default 0 = split into freq bands, 1 = do broadband (2-200 Hz);
+        ignored if filter_bank is given
+    filter_bank : FilterBank
+        notch and bandpass filters; None = defaults (see process_raw_lfp)
+    block : int
+        samples per block, not counting padding
+    pad : int
+        samples of overlap on both sides of each block; None = 3x the
+        longest bandpass filter (its filtfilt edge effect) plus the
+        smoothing kernel
+    method : string
+        "filtfilt" (default) or "fft" (see process_raw_lfp)
+    append : bool
+        default 0 = new store (overwritten); 1 = lfp_fname continues the
+        recording in the store (e.g. a session split across files): its
+        sync points (in this file's time) go after the ones stored. Only
+        this file is filtered, plus the last 2 x pad samples of the
+        previous one (kept in the store), so windows across the junction
+        come out as if the files were one; zscore statistics cover all
+        files so far (the stored magnitude is rescaled in place).
+
+    Returns:
+    -------
+    out_fname : string
+        Path file for output store
+
+    """
+    if filter_bank is None:
+        if broadband:
+            filter_bank = FilterBank(bands=BROADBAND)
+        else:
+            filter_bank = FilterBank()
+    filter_bank.check_fs(1000)  # LFP is handled in ms throughout
+    band_names = filter_bank.band_names
+    nbands = len(band_names)
+    if pad is None:
+        ntaps = max([len(b) for b in filter_bank.band_filts])
+        pad = 3 * ntaps + len(boxcar_kernel(49))
+    append = append and os.path.exists(out_fname)
+
+    # first time index of each window, same as in chop
+    ts_chopped = np.arange(time_range[0], time_range[1], 0.001)
+    t_idx = np.arange(time_range[0] * 1000, time_range[1] * 1000)  # use ms!
+    nt = t_idx.shape[0]
+    sync_idx = np.round(np.asarray(sync_point, dtype=float) * 1000)
+    nsync = sync_idx.shape[0]
+
+    with open_reader(lfp_fname) as reader, \
+            h5py.File(out_fname, "r+" if append else "w") as out:
+        channel_names = reader.channel_names
+        if channels != -1:
+            channel_names = [ch for ch in channel_names
+                             if int(ch[2:]) in channels]
+        nch = len(channel_names)
+
+        if append:
+            _check_store(out, ts_chopped=ts_chopped,
+                         channel_names=channel_names, band_names=band_names,
+                         pad=pad, filter_key=filter_bank.key)
+        else:
+            # about 1 MB chunks: a run of sync points, one channel
+            rows = int(max(1, min(nsync, 2**20 // (nt * 8))))
+            _create_lfp_store(out, ts_chopped, channel_names, band_names,
+                              pad, filter_bank.key, rows)
+        mag_out = [out["mag/" + b] for b in band_names]
+        phs_out = [out["phs/" + b] for b in band_names]
+
+        # new sync points, in sec from start of first file
+        nprev = int(out.attrs["nsamples"])
+        nold = out["sync_point"].shape[0]
+        out["sync_point"].resize((nold + nsync,))
+        out["sync_point"][nold:] = np.where(sync_idx != -1000,
+                                            (sync_idx + nprev) / 1000, -1)
+        for dset in mag_out + phs_out:
+            dset.resize((nold + nsync, nt, nch))
+
+        # first time index of each window, old and new sync points
+        all_sync_idx = np.round(out["sync_point"][()] * 1000)
+        starts = (all_sync_idx + t_idx[0]).astype(int)
+        present = np.where(all_sync_idx != -1000)[0]  # trials missing events
+
+        old_mean = out["mag_mean"][()]
+        old_std = out["mag_std"][()]
+        mag_mean = np.zeros((nbands, nch))
+        mag_std = np.zeros((nbands, nch))
+        tails = out["tail"][()]
+        ntimes = nprev + reader.length(channel_names[0])
+        ntail = min(2 * pad, ntimes)
+        new_tails = np.empty((nch, ntail))
+
+        for ch in range(nch):
+            # this file, after the tail of the previous one; stored
+            # sync points are zscored with the previous statistics
+            joined = _AfterTail(reader, tails[ch])
+            origin = nprev - tails.shape[1]  # sample of joined[0]
+            writer = _ChoppedWriter(
+                mag_out + phs_out, ch, starts, present, nold,
+                np.concatenate([old_mean[:, ch], np.zeros(nbands)]),
+                np.concatenate([old_std[:, ch], np.ones(nbands)]),
+                max(0, nprev - pad))
+            sums = _stream_channel(joined, channel_names[ch], origin, nprev,
+                                   ntimes, filter_bank, block, pad, method,
+                                   writer)
+
+            # zscore statistics: final samples are summed for good, the
+            # last pad samples only for now
+            mag_sum = out["mag_sum"][:, ch] + sums[0]
+            mag_sumsq = out["mag_sumsq"][:, ch] + sums[1]
+            out["mag_sum"][:, ch] = mag_sum
+            out["mag_sumsq"][:, ch] = mag_sumsq
+            mag_mean[:, ch] = (mag_sum + sums[2]) / ntimes
+            mag_std[:, ch] = np.sqrt((mag_sumsq + sums[3]) / ntimes -
+                                     np.square(mag_mean[:, ch]))
+            new_tails[ch] = joined.read(channel_names[ch],
+                                        start=ntimes - ntail - origin,
+                                        stop=ntimes - origin)
+
+        # second pass: zscore chopped magnitude with session statistics
+        _zscore_store(mag_out, nold, old_mean, old_std, mag_mean, mag_std,
+                      max(1, block // nt))
+        out["mag_mean"][...] = mag_mean
+        out["mag_std"][...] = mag_std
+        del out["tail"]
+        out["tail"] = new_tails
+        out.attrs["nsamples"] = ntimes
+
+    return out_fname
+
+
+def _stream_channel(reader, chname, origin, nprev, ntimes, filter_bank,
+                    block, pad, method, writer):
+    """
+    Filter one channel in time blocks, from pad samples before the end of
+    the previous file (redone now), passing band magnitude and phase to
+    writer (see stream_lfp).
+
+    Returns:
+    -------
+    sums : 2D np array
+        4 x bands: sum and sum of squares of magnitude up to the last pad
+        samples (final), then of the last pad samples (redone by the next
+        file, if appended)
+
+    """
+    nbands = len(filter_bank.band_filts)
+    final = ntimes - pad
+    sums = np.zeros((4, nbands))
+    for start in range(max(0, nprev - pad), ntimes, block):
+        stop = min(start + block, ntimes)
+        channel, lo = _read_block(reader, chname, filter_bank, origin,
+                                  start, stop, ntimes, pad, method)
+        analytic = _filter_block(channel, filter_bank.band_filts,
+                                 start - lo, stop - lo)
+
+        split = min(max(final, start), stop) - start
+        valid, edge = analytic[:nbands, :split], analytic[:nbands, split:]
+        sums += [valid.sum(axis=1), np.square(valid).sum(axis=1),
+                 edge.sum(axis=1), np.square(edge).sum(axis=1)]
+        writer.add(start, analytic)
+    writer.close()
+
+    return sums
+
+
+def _read_block(reader, chname, filter_bank, origin, start, stop, ntimes,
+                pad, method):
+    """
+    Load and notch samples start:stop of a channel (reader sample 0 is
+    origin), with up to pad samples of overlap on both sides; returns the
+    block and its first sample.
+    """
+    lo = max(origin, start - pad)
+    hi = min(ntimes, stop + pad)
+    channel = get_notched(chname, reader, filter_bank.notch_filts,
+                          lo - origin, hi - origin)
+    if method == "fft":
+        ntaps = max([len(b) for b in filter_bank.band_filts])
+        channel = ChannelSpectrum(channel, ntaps)
+
+    return channel, lo
+
+
+def _filter_block(channel, band_filts, first, last):
+    """
+    Band magnitude and phase of a loaded block, samples first:last (its
+    unpadded middle); 2D np array, magnitude of each band then phase of
+    each band x samples.
+    """
+    nbands = len(band_filts)
+    analytic = np.empty((2 * nbands, last - first))
+    for b in range(nbands):
+        mag_raw, phs = get_analytic(channel, band_filts[b])
+        analytic[b] = mag_raw[first:last]
+        analytic[nbands + b] = phs[first:last]
+
+    return analytic
+
+
+def _zscore_store(mag_out, nold, old_mean, old_std, mag_mean, mag_std,
+                  rows):
+    """
+    Zscore chopped magnitude in the store with session statistics, rows
+    sync points at a time; the first nold are zscored with the old ones.
+    """
+    nrows = mag_out[0].shape[0]
+    for b in range(len(mag_out)):
+        for first in range(0, nrows, rows):
+            last = min(first + rows, nrows)
+            for lo, hi in [(first, min(last, nold)),
+                           (max(first, nold), last)]:
+                if hi <= lo:
+                    continue
+                mag = mag_out[b][lo:hi]
+                if lo < nold:
+                    mag = mag * old_std[b] + old_mean[b]
+                mag_out[b][lo:hi] = (mag - mag_mean[b]) / mag_std[b]
+
+
+def _create_spk_store(out, ts_chopped, rows):
+    """Empty spk store, growing along sync points and units."""
+    nt = ts_chopped.shape[0]
+    out["ts_chopped"] = ts_chopped
+    out.attrs["duration"] = 0.0
+    for name in ["raster", "fr"]:
+        out.create_dataset(name, (0, nt, 0), dtype=np.float64,
+                           maxshape=(None, nt, None), chunks=(rows, nt, 1),
+                           fillvalue=np.nan)
+    out.create_dataset("unit_names", (0,), dtype=h5py.string_dtype(),
+                       maxshape=(None,))
+    out.create_dataset("channel", (0,), dtype=int, maxshape=(None,))
+    for name in ["mean_fr", "nspikes"]:
+        out.create_dataset(name, (0,), dtype=np.float64, maxshape=(None,))
+
+
+def _create_lfp_store(out, ts_chopped, channel_names, band_names, pad,
+                      filter_key, rows):
+    """
+    Empty lfp store, growing along sync points, in chunks of rows sync
+    points x time x 1 channel; plus state to append.
+    """
+    nt = ts_chopped.shape[0]
+    nch = len(channel_names)
+    out["ts_chopped"] = ts_chopped
+    out["channel_names"] = np.array(channel_names, dtype="S")
+    out["band_names"] = np.array(band_names, dtype="S")
+    out.create_dataset("sync_point", (0,), dtype=np.float64,
+                       maxshape=(None,))
+    for kind in ["mag", "phs"]:
+        for b in band_names:
+            out.create_dataset(kind + "/" + b, (0, nt, nch),
+                               dtype=np.float64, maxshape=(None, nt, nch),
+                               chunks=(rows, nt, 1), fillvalue=np.nan)
+
+    # raw tail of recording, zscore sums and statistics so far
+    out["tail"] = np.zeros((nch, 0))
+    for name in ["mag_sum", "mag_sumsq", "mag_mean"]:
+        out[name] = np.zeros((len(band_names), nch))
+    out["mag_std"] = np.ones((len(band_names), nch))
+    out.attrs["nsamples"] = 0
+    out.attrs["pad"] = pad
+    out.attrs["filter_key"] = filter_key
+
+
+def _check_store(out, **expected):
+    """Raise ValueError if store was made with other settings."""
+    for name, value in expected.items():
+        if name in out:
+            stored = out[name][()]
+            if stored.dtype.kind == "S":
+                stored = stored.astype(str)
+        else:
+            stored = out.attrs.get(name)
+        if not np.array_equal(np.asarray(stored), np.asarray(value)):
+            raise ValueError("can't append to %s: %s doesn't match"
+                             % (out.filename, name))
+
+
+class _AfterTail(PL2MatReader):
+    """Reader for this file's channels, after the raw tail of the last."""
+
+    def __init__(self, reader, tail):
+        self.reader = reader
+        self.tail = tail
+
+    def close(self):
+        pass
+
+    def length(self, name):
+        return self.tail.shape[0] + self.reader.length(name)
+
+    def read(self, name, out=None, start=0, stop=None, chunk_size=None):
+        if stop is None:
+            stop = self.length(name)
+        if out is None:
+            out = np.empty(stop - start)
+
+        # tail, then this file
+        ntail = self.tail.shape[0]
+        split = min(max(ntail, start), stop)
+        out[:split - start] = self.tail[start:split]
+        self.reader.read(name, out[split - start:], split - ntail,
+                         stop - ntail)
+
+        return out
+
+
+class _ChoppedWriter:
+    """
+    Windows around sync points for one channel of the store, gathered
+    across time blocks and written a run of sync points at a time (see
+    stream_lfp); windows split across blocks wait in memory until done.
+
+    Parameters:
+    ----------
+    dsets : list
+        HDF5 datasets, sync points x time x channels, one per signal
+    ch : int
+        channel to write
+    starts : np vector
+        first sample of each window
+    present : np vector
+        sync points to write (others are missing)
+    nold : int
+        sync points stored before; written as (signal - offset) / scale
+    offset, scale : np vector
+        one per dataset, for sync points stored before
+    keep_before : int
+        stored windows are kept up to this sample (filled in after)
+
+    """
+
+    def __init__(self, dsets, ch, starts, present, nold, offset, scale,
+                 keep_before):
+        self.dsets = dsets
+        self.ch = ch
+        self.starts = starts
+        self.present = present
+        self.nold = nold
+        self.offset = offset
+        self.scale = scale
+        self.keep_before = keep_before
+        self.nt = dsets[0].shape[1]
+        self.pending = dict()  # sync point: rows so far
+
+    def add(self, start, signals):
+        """Add samples of signals (datasets x samples) from start on."""
+        nt, starts = self.nt, self.starts
+        stop = start + signals.shape[1]
+        trials = self.present[(starts[self.present] < stop) &
+                              (starts[self.present] + nt > start)]
+
+        # whole windows in one go, windows split across blocks one by one
+        whole = (starts[trials] >= start) & (starts[trials] + nt <= stop)
+        done = signals[:, starts[trials[whole], None] - start +
+                       np.arange(nt)]
+        for tr in trials[~whole]:
+            if tr not in self.pending:
+                self.pending[tr] = self._stored_rows(tr)
+            first = max(start, starts[tr])
+            last = min(stop, starts[tr] + nt)
+            self.pending[tr][:, first - starts[tr]:last - starts[tr]] = \
+                signals[:, first - start:last - start]
+
+        finished = [tr for tr in self.pending if starts[tr] + nt <= stop]
+        self._write(np.concatenate([trials[whole], finished]).astype(int),
+                    np.concatenate([done, self._pop(finished)], axis=1))
+
+    def close(self):
+        """Write windows running past the end of the data."""
+        finished = list(self.pending)
+        self._write(np.array(finished, dtype=int), self._pop(finished))
+
+    def _pop(self, trials):
+        """Rows of pending sync points, datasets x trials x time."""
+        rows = [self.pending.pop(tr) for tr in trials]
+        if not rows:
+            return np.empty((len(self.dsets), 0, self.nt))
+        return np.stack(rows, axis=1)
+
+    def _stored_rows(self, tr):
+        """Rows stored so far for a sync point (unscaled), or NaN."""
+        if tr >= self.nold or self.starts[tr] >= self.keep_before:
+            return np.full((len(self.dsets), self.nt), np.nan)
+        rows = np.stack([dset[tr, :, self.ch] for dset in self.dsets])
+        return rows * self.scale[:, None] + self.offset[:, None]
+
+    def _write(self, trials, values):
+        """Write values (datasets x trials x time), one run at a time."""
+        if trials.shape[0] == 0:
+            return
+        order = np.argsort(trials)
+        trials, values = trials[order], values[:, order]
+        old = trials < self.nold
+        values[:, old] = (values[:, old] - self.offset[:, None, None]) / \
+            self.scale[:, None, None]
+
+        # runs of consecutive sync points
+        breaks = np.flatnonzero(np.diff(trials) != 1) + 1
+        for first, last in zip(np.r_[0, breaks], np.r_[breaks, len(trials)]):
+            snippet = np.s_[trials[first]:trials[last - 1] + 1, :, self.ch]
+            for dset, value in zip(self.dsets, values):
+                dset[snippet] = value[first:last]
@@ -76,3 +76,89 @@ def test_trialinfo():
     # compare!
     assert np.all(output["trialtype"] == sample_trialtypes)
     assert np.all(output["amnt_right"] == sample_amnt_right)
+
+
+def test_events_many_codes():
+    # load mini bhv and spk samples
+    sample_bhv = [pjoin(TESTDATADIR, "sample_bhv.mat")]
+    sample_bhv_data = bhv.load_raw_bhv(sample_bhv)
+    sample_spk = pjoin(TESTDATADIR, "sample_spk.mat")
+    sample_pl2_codes = bhv.load_pl2_codes(sample_spk)
+
+    # start code; code repeated in some trials; missing code
+    events = [9, 51, 99, 20]
+
+    # expected times: 51 happens once only in 2nd trial
+    sample_table = np.array([[12.658175, -1, -1, 127.87405],
+                             [134.670925, 135.5842, -1, 136.371025],
+                             [139.243075, -1, -1, 140.936075]])
+
+    # extract sync points for all codes at once
+    output = bhv.get_trial_events(sample_bhv_data, sample_pl2_codes, events)
+
+    # compare!
+    assert output.shape == (3, len(events))
+    assert np.allclose(output, sample_table)
+    for e in range(len(events)):
+        assert np.all(output[:, e] == bhv.get_trial_events(
+            sample_bhv_data, sample_pl2_codes, events[e]))
+
+
+def test_bhv_columns():
+    # load mini bhv sample, twice as if session was split in two files
+    sample_bhv = [pjoin(TESTDATADIR, "sample_bhv.mat")] * 2
+    fields = ["Trial", "TrialError", "TaskObject/CurrentConditionInfo/amnt",
+              "TaskObject/CurrentConditionInfo/trialtype"]
+
+    # expected outputs
+    sample_Trial = np.array([1, 2, 3, 1, 2, 3])
+    sample_amnt_right = np.array([5, 0, 1, 5, 0, 1])
+    sample_trialtypes = ["free", "forced", "free"] * 2
+
+    # load columns, serially and in parallel
+    output = bhv.load_bhv_columns(sample_bhv, fields)
+    output_parallel = bhv.load_bhv_columns(sample_bhv, fields, nworkers=2)
+
+    # compare!
+    assert np.all(output["Trial"] == sample_Trial)
+    assert np.all(output["TrialError"] == 0)
+    assert output["TaskObject/CurrentConditionInfo/amnt"].shape == (6, 2)
+    assert np.all(output["TaskObject/CurrentConditionInfo/amnt"][:, 1] ==
+                  sample_amnt_right)
+    assert np.all(output["TaskObject/CurrentConditionInfo/trialtype"] ==
+                  sample_trialtypes)
+    for field in fields:
+        assert np.all(output[field] == output_parallel[field])
+
+
+def test_load_trialinfo():
+    # load mini bhv sample, fully and only trial info fields
+    sample_bhv = [pjoin(TESTDATADIR, "sample_bhv.mat")]
+    expected = bhv.get_trialinfo(bhv.load_raw_bhv(sample_bhv))
+
+    output = bhv.load_trialinfo(sample_bhv)
+
+    # compare!
+    assert np.all(output.columns == expected.columns)
+    assert np.all(output["trialtype"] == expected["trialtype"])
+    assert np.allclose(output.drop(columns="trialtype"),
+                       expected.drop(columns="trialtype"))
+
+
+def test_trialinfo_columns():
+    # columns with a third picture, vs the same trials as task data
+    columns = {bhv.CONDITION_INFO + "trialtype": ["free", "forced"],
+               bhv.CONDITION_INFO + "amnt": np.array([[1, 5, 9], [2, 0, 9]]),
+               bhv.CONDITION_INFO + "prob": np.array([[.5, 1, 0],
+                                                      [.2, 0, 0]])}
+    bhv_data = {"TaskObject": [
+        {"CurrentConditionInfo": [{"trialtype": trialtype, "amnt": amnt,
+                                   "prob": prob}]}
+        for trialtype, amnt, prob in zip(*columns.values())]}
+
+    output = bhv.get_trialinfo(columns)
+
+    # compare! left and right picture only, same both ways
+    assert output.amnt_left.tolist() == [1, 2]
+    assert output.prob_right.tolist() == [1, 0]
+    assert output.equals(bhv.get_trialinfo(bhv_data))
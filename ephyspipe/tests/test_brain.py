@@ -1,6 +1,11 @@
 import ephyspipe.brain as brain
+import h5py
+import mat73
 import numpy as np
+import pytest
 from ephyspipe.config import TESTDATADIR
+from ephyspipe.filters import FilterBank
+from ephyspipe.readers import PL2MatReader
 from os.path import join as pjoin
 
 
@@ -72,6 +77,46 @@ def test_chop():
     assert np.all(output == fake_chopped)
 
 
+def test_chop_out_and_view():
+    # make fake brain data
+    rng = np.random.default_rng(0)
+    fake_data = rng.random((4, 5000))
+    window = (-0.1, 0.2)
+
+    # reference: one unit at a time
+    sync_points = np.array([0.5, 1.2, -1, 3.3])
+    sync_idx = np.round(sync_points * 1000).astype(int)
+    expected = np.empty((4, 300, 4))
+    for u in range(4):
+        for s in range(4):
+            if sync_points[s] == -1:
+                expected[s, :, u] = fake_data[u, -1]
+            else:
+                expected[s, :, u] = fake_data[u, sync_idx[s] - 100:
+                                              sync_idx[s] + 200]
+
+    # preallocated float32 output, gathered a few values at a time
+    out = np.empty((4, 300, 4), dtype=np.float32)
+    output = brain.chop(fake_data, sync_points, window, out=out, block=1000)
+    assert output is out
+    assert np.allclose(output, expected, atol=1e-6)
+    assert brain.chop(fake_data, sync_points, window,
+                      dtype=np.float32).dtype == np.float32
+
+    # back to back epochs come back as a view
+    epochs = np.arange(0.1, 4.7, 0.3)
+    view = brain.chop(fake_data, epochs, window, copy=False)
+    assert np.shares_memory(view, fake_data)
+    assert not view.flags.writeable
+
+    # compare!
+    assert np.all(view == brain.chop(fake_data, epochs, window))
+
+    # missing events can't be a view
+    assert not np.shares_memory(
+        brain.chop(fake_data, sync_points, window, copy=False), fake_data)
+
+
 def test_sliding_avg():
     # make fake data
     nsync = 5
@@ -89,6 +134,45 @@ def test_sliding_avg():
     assert np.all(data_smooth[:, :, 0] == fake_smooth)
 
 
+def test_sliding_avg_cumsum():
+    # make fake data @ 500 Hz
+    rng = np.random.default_rng(0)
+    fake_data = rng.random((3, 1000, 2))
+    ts = np.arange(1000) / 500 - 0.5
+    t_range = (-0.2, 1.2)
+
+    # expected: average each window directly
+    def expected(window, step):
+        window_n = np.round(500 * window)
+        start_idx = np.floor(np.argmin(np.abs(ts + 0.2)) + window_n/2)
+        stop_idx = np.ceil(1 + np.argmin(np.abs(ts - 1.2)) - window_n/2)
+        mid_idx = np.arange(start_idx, stop_idx,
+                            np.round(window_n * step)).astype(int)
+        t_idx = np.arange(-np.floor(window_n / 2),
+                          np.ceil(window_n / 2)).astype(int)
+        return ts[mid_idx], np.stack([fake_data[:, m + t_idx, :].mean(axis=1)
+                                      for m in mid_idx], axis=1)
+
+    # several window sizes in one call
+    times, smoothed = brain.sliding_avg(fake_data, ts, t_range, [0.05, 0.1],
+                                        step=0.5, fs=500)
+    for i, window in enumerate([0.05, 0.1]):
+        fake_times, fake_smooth = expected(window, 0.5)
+        assert np.all(times[i] == fake_times)
+        assert np.allclose(smoothed[i], fake_smooth)
+
+    # in place, float32
+    data32 = fake_data.astype(np.float32)
+    output_times, output = brain.sliding_avg(data32, ts, t_range, 0.05,
+                                             fs=500, overwrite=True)
+    fake_times, fake_smooth = expected(0.05, 0.25)
+
+    # compare!
+    assert output.dtype == np.float32
+    assert np.all(output_times == fake_times)
+    assert np.allclose(output, fake_smooth, atol=1e-4)
+
+
 def test_raw_spk():
     # use saved mini sample data
     sample_spk = pjoin(TESTDATADIR, "sample_spk.mat")
@@ -109,11 +193,23 @@ def test_raw_spk():
     # process sample data
     output = brain.process_raw_spk(sample_spk, channels=-1)
 
+    # only units with 3+ spikes, or by session rate
+    output_some = brain.process_raw_spk(sample_spk, min_spikes=3)
+    output_rate = brain.process_raw_spk(sample_spk, min_rate=0.03)
+
     # compare!
     assert np.all(output[0] == sample_raster)
     assert np.all(output[1] == sample_fr)
     assert np.all(output[2].ID == unit_names)
 
+    # same session length, and rates, whatever is selected
+    assert np.all(output_some[0] == sample_raster[:1])
+    assert list(output_some[2].ID) == unit_names[:1]
+    assert np.allclose(output_some[2].mean_fr, 4 / 82.67)
+    assert np.allclose(output_some[2].mean_fr, output[2].mean_fr[:1])
+    assert list(output_rate[2].ID) == unit_names[:1]
+    assert np.all(output_rate[2].mean_fr >= 0.03)
+
 
 def test_raw_lfp():
     # use saved mini sample lfp
@@ -134,3 +230,248 @@ def test_raw_lfp():
     assert np.all(output_magmeans == expected_magmeans)
     assert output[2].shape[0] == ntimes
     assert np.all(output[3].ID == channel_names)
+
+
+def test_sparse_spk():
+    # use saved mini sample data
+    sample_spk = pjoin(TESTDATADIR, "sample_spk.mat")
+    sync_points = np.array([20, 80.01, 81.6])
+    window = (-0.05, 0.05)
+
+    # dense and sparse versions
+    raster, fr, _ = brain.process_raw_spk(sample_spk)
+    sparse_raster, sparse_fr, meta = brain.process_raw_spk(sample_spk,
+                                                           sparse=True)
+
+    # compare!
+    assert sparse_raster.shape == raster.shape
+    assert np.all(sparse_raster.toarray() == raster)
+    assert np.allclose(brain.chop(sparse_fr, sync_points, window),
+                       brain.chop(fr, sync_points, window))
+    assert np.all(brain.chop(sparse_raster, sync_points, window) ==
+                  brain.chop(raster, sync_points, window))
+
+
+def test_sparse_sliding_avg():
+    # make some fake spikes
+    ntimes = 500
+    fake_ts = [np.array([0.010, 0.011, 0.250]), np.array([0.100])]
+    sparse = brain.get_fr(
+        brain.SpikeRaster.from_timestamps(fake_ts, ntimes))
+    ts = np.arange(ntimes) / 1000
+    t_range = (ts[0], ts[-1])
+
+    # dense version, as a single sync point
+    dense = sparse.toarray().T.reshape((1, ntimes, -1))
+    fake_times, fake_smooth = brain.sliding_avg(dense, ts, t_range, 0.02)
+
+    # get sparse sliding averages
+    output_times, output = brain.sliding_avg(sparse, ts, t_range, 0.02)
+
+    # compare!
+    assert np.all(output_times == fake_times)
+    assert np.allclose(output, fake_smooth)
+
+
+def test_chop_spikes():
+    # use saved mini sample data
+    sample_spk = pjoin(TESTDATADIR, "sample_spk.mat")
+    data = mat73.loadmat(sample_spk)
+    timestamps = [data["SPK_SPKC001a"], data["SPK_SPKC001b"]]
+    sync_points = np.array([20, -1, 80.01, 81.6])
+    window = (-0.05, 0.05)
+
+    # expected: chop full session rasters and firing rates
+    raster, fr, _ = brain.process_raw_spk(sample_spk)
+    fake_fr = brain.chop(fr, sync_points, window)
+    fake_trains = brain.chop(raster, sync_points, window)
+
+    # chop straight from timestamps
+    output_fr = brain.chop_spikes(timestamps, sync_points, window)
+    output_trains = brain.chop_spikes(timestamps, sync_points, window,
+                                      fr=False)
+
+    # compare!
+    assert output_fr.shape == fake_fr.shape
+    assert np.allclose(output_fr, fake_fr)
+    assert np.all(output_trains == fake_trains)
+
+
+def test_raw_lfp_pool():
+    # use saved mini sample lfp
+    sample_lfp = pjoin(TESTDATADIR, "sample_lfp.mat")
+    sync_points = np.array([3, 6, 9])
+    time_range = (-0.01, 0.01)
+
+    # process LFP sample serially and in process pool
+    serial = brain.process_raw_lfp(sample_lfp, sync_points, time_range)
+    pooled = brain.process_raw_lfp(sample_lfp, sync_points, time_range,
+                                   nworkers=2, max_memory=10**9)
+
+    # compare! bit-identical
+    for b in range(len(serial[0])):
+        assert np.array_equal(serial[0][b], pooled[0][b])
+        assert np.array_equal(serial[1][b], pooled[1][b])
+    assert np.all(serial[3].ID == pooled[3].ID)
+
+
+def make_fake_lfp(fname, nchannels=2, ntimes=60000, seed=1):
+    # sines in each band plus noise, with slow amplitude modulation
+    rng = np.random.default_rng(seed)
+    t = np.arange(ntimes) / 1000
+    with h5py.File(fname, "w") as f:
+        for ch in range(nchannels):
+            lfp = rng.normal(0, 1, ntimes)
+            for hz in [3, 6, 10, 20, 45, 100]:
+                lfp += np.sin(2 * np.pi * hz * t + rng.uniform(0, 6)) * \
+                    (1 + 0.5 * np.sin(2 * np.pi * 0.3 * t))
+            f["FP%03d" % (ch + 1)] = lfp.reshape(1, -1)
+        f["lfp_ts"] = 1000 * t.reshape(1, -1)
+
+
+def test_raw_lfp_events_only(tmp_path):
+    # make fake lfp, long enough for padding around events
+    fake_lfp = str(tmp_path / "fake_lfp.mat")
+    make_fake_lfp(fake_lfp, nchannels=1, ntimes=30000)
+    sync_points = np.array([8, 12.5, -1, 21])
+    time_range = (-0.5, 0.5)
+
+    # filter entire session vs only around events
+    full = brain.process_raw_lfp(fake_lfp, sync_points, time_range)
+    output = brain.process_raw_lfp(fake_lfp, sync_points, time_range,
+                                   events_only=True, zscore_samples=None)
+
+    # compare! close, up to edge effects; missing event is nan
+    present = sync_points != -1
+    for b in range(len(full[0])):
+        mag_diff = full[0][b][present] - output[0][b][present]
+        phs_diff = np.angle(np.exp(1j * (full[1][b][present] -
+                                         output[1][b][present])))
+        assert np.abs(mag_diff).max() < 0.05
+        assert np.abs(phs_diff).max() < 0.01
+        assert np.all(np.isnan(output[0][b][~present]))
+    assert np.all(output[3].ID == full[3].ID)
+
+
+def test_raw_lfp_fft(tmp_path):
+    # make fake lfp, with events far from edges
+    fake_lfp = str(tmp_path / "fake_lfp.mat")
+    make_fake_lfp(fake_lfp, nchannels=1, ntimes=40000)
+    sync_points = np.array([15, 20, 25])
+    time_range = (-0.5, 0.5)
+
+    # filtfilt + hilbert vs one fft per channel, serial and in pool
+    full = brain.process_raw_lfp(fake_lfp, sync_points, time_range)
+    output = brain.process_raw_lfp(fake_lfp, sync_points, time_range,
+                                   method="fft")
+    pooled = brain.process_raw_lfp(fake_lfp, sync_points, time_range,
+                                   method="fft", nworkers=2)
+
+    # compare!
+    for b in range(len(full[0])):
+        phs_diff = np.angle(np.exp(1j * (full[1][b] - output[1][b])))
+        assert np.abs(full[0][b] - output[0][b]).max() < 0.01
+        assert np.abs(phs_diff).max() < 0.01
+        assert np.array_equal(output[0][b], pooled[0][b])
+
+
+def test_raw_lfp_single(tmp_path):
+    # make fake lfp, with events far from edges
+    fake_lfp = str(tmp_path / "fake_lfp.mat")
+    make_fake_lfp(fake_lfp, nchannels=1, ntimes=40000)
+    sync_points = np.array([15, -1, 25])
+    time_range = (-0.5, 0.5)
+
+    # double vs single precision, both methods and events only
+    for kwargs in [dict(), dict(method="fft"), dict(events_only=True)]:
+        full = brain.process_raw_lfp(fake_lfp, sync_points, time_range,
+                                     **kwargs)
+        output = brain.process_raw_lfp(fake_lfp, sync_points, time_range,
+                                       precision="single", **kwargs)
+
+        # compare!
+        for b in range(len(full[0])):
+            phs_diff = np.angle(np.exp(1j * (full[1][b] - output[1][b])))
+            assert output[0][b].dtype == np.float32
+            assert output[1][b].dtype == np.float32
+            assert np.nanmax(np.abs(full[0][b] - output[0][b])) < 1e-4
+            assert np.nanmax(np.abs(phs_diff)) < 1e-3
+            assert np.array_equal(np.isnan(full[0][b]),
+                                  np.isnan(output[0][b]))
+
+
+def test_raw_lfp_scratch(tmp_path, monkeypatch):
+    # make fake lfp; count new scratch buffers
+    fake_lfp = str(tmp_path / "fake_lfp.mat")
+    make_fake_lfp(fake_lfp, nchannels=2, ntimes=20000)
+    new_buffers = []
+    get = brain._Scratch.get
+
+    def counted_get(scratch, name, n, dtype):
+        old = scratch.buffers.get(name)
+        buf = get(scratch, name, n, dtype)
+        if scratch.buffers[name] is not old:
+            new_buffers.append(name)
+        return buf
+
+    monkeypatch.setattr(brain._Scratch, "get", counted_get)
+    brain.process_raw_lfp(fake_lfp, np.array([5, 15]), (-0.5, 0.5),
+                          nthreads=2, precision="single")
+
+    # compare! each buffer made at most once per thread, for all channels
+    # and bands
+    assert 0 < len(new_buffers) <= 2 * 3
+
+
+def test_raw_lfp_closes(monkeypatch):
+    # lfp time can't be read; keep track of open readers
+    readers = []
+    init = PL2MatReader.__init__
+
+    def tracked_init(reader, fname):
+        init(reader, fname)
+        readers.append(reader)
+
+    def read_ts(reader):
+        raise OSError("bad lfp_ts")
+
+    monkeypatch.setattr(PL2MatReader, "__init__", tracked_init)
+    monkeypatch.setattr(PL2MatReader, "read_ts", read_ts)
+
+    with pytest.raises(OSError):
+        brain.process_raw_lfp(pjoin(TESTDATADIR, "sample_lfp.mat"),
+                              np.array([3, 6]), (-0.01, 0.01))
+
+    # compare! file closed anyway
+    assert len(readers) == 1
+    assert not readers[0].file.id.valid
+
+
+def test_quantize_phase():
+    # phase over full circle, plus missing
+    phs = np.append(np.linspace(-np.pi, np.pi, 1001), np.nan)
+    quantized = brain.quantize_phase(phs)
+    restored = brain.dequantize_phase(quantized)
+
+    # compare!
+    assert quantized.dtype == np.int16
+    assert np.abs(restored[:-1] - phs[:-1]).max() < 1e-4
+    assert np.isnan(restored[-1])
+
+
+def test_raw_lfp_custom_bands():
+    # use saved mini sample lfp
+    sample_lfp = pjoin(TESTDATADIR, "sample_lfp.mat")
+    sync_points = np.array([3, 6, 9])
+    time_range = (-0.01, 0.01)
+    bank = FilterBank(bands={"gamma": [30, 60], "theta": [4, 8]})
+
+    # process with default and custom bands
+    full = brain.process_raw_lfp(sample_lfp, sync_points, time_range)
+    output = brain.process_raw_lfp(sample_lfp, sync_points, time_range,
+                                   filter_bank=bank)
+
+    # compare! custom bands come out in their given order
+    assert len(output[0]) == 2
+    assert np.array_equal(output[0][0], full[0][4])
+    assert np.array_equal(output[1][1], full[1][1])
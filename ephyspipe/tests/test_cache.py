@@ -0,0 +1,94 @@
+import ephyspipe.brain as brain
+import ephyspipe.cache
+from ephyspipe.cache import SessionCache, file_hash
+from ephyspipe.config import TESTDATADIR
+from os.path import join as pjoin
+import numpy as np
+import shutil
+
+
+def test_cache_spk(tmp_path):
+    # use saved mini sample data
+    sample_spk = pjoin(TESTDATADIR, "sample_spk.mat")
+    cache = SessionCache(str(tmp_path / "cache"))
+
+    # process without, then twice with cache
+    raster, fr, meta = brain.process_raw_spk(sample_spk)
+    first = brain.process_raw_spk(sample_spk, cache=cache)
+    second = brain.process_raw_spk(sample_spk, cache=cache)
+
+    # compare! cached arrays are memory mapped
+    assert isinstance(second[1], np.memmap)
+    assert np.all(second[0] == raster)
+    assert np.all(second[1] == fr)
+    assert np.all(first[1] == second[1])
+    assert np.all(second[2].ID == meta.ID)
+
+    # other parameters get their own entry
+    sparse = brain.process_raw_spk(sample_spk, sparse=True, cache=cache)
+    assert np.allclose(sparse[1].toarray(), fr)
+    entries = [p for p in (tmp_path / "cache").iterdir()
+               if p.name != ".hashes"]
+    assert len(entries) == 2
+
+
+def test_cache_lfp(tmp_path):
+    # use saved mini sample lfp
+    sample_lfp = pjoin(TESTDATADIR, "sample_lfp.mat")
+    sync_points = np.array([3, 6, 9])
+    time_range = (-0.01, 0.01)
+
+    # process without, then with cache
+    full = brain.process_raw_lfp(sample_lfp, sync_points, time_range)
+    brain.process_raw_lfp(sample_lfp, sync_points, time_range,
+                          cache=str(tmp_path))
+    output = brain.process_raw_lfp(sample_lfp, sync_points, time_range,
+                                   cache=str(tmp_path))
+
+    # compare!
+    for b in range(len(full[0])):
+        assert np.array_equal(output[0][b], full[0][b])
+        assert np.array_equal(output[1][b], full[1][b])
+    assert np.all(output[2] == full[2])
+    assert np.all(output[3].ID == full[3].ID)
+
+
+def test_cache_key(tmp_path):
+    # copy of sample data, so it can be changed
+    sample_spk = str(tmp_path / "spk.mat")
+    shutil.copy(pjoin(TESTDATADIR, "sample_spk.mat"), sample_spk)
+    cache = SessionCache(str(tmp_path / "cache"))
+
+    params = {"sync_point": np.array([1., 2.]), "channels": -1}
+    key = cache.key(sample_spk, "process_raw_spk", params)
+
+    # same contents and parameters -> same key
+    assert key == cache.key(sample_spk, "process_raw_spk",
+                            {"channels": -1,
+                             "sync_point": np.array([1., 2.])})
+
+    # different parameters or contents -> different key
+    params["sync_point"] = np.array([1., 3.])
+    assert key != cache.key(sample_spk, "process_raw_spk", params)
+
+    old_hash = file_hash(sample_spk)
+    with open(sample_spk, "ab") as f:
+        f.write(b"0")
+    assert file_hash(sample_spk) != old_hash
+
+
+def test_cache_key_version(tmp_path, monkeypatch):
+    # use saved mini sample data
+    sample_spk = pjoin(TESTDATADIR, "sample_spk.mat")
+    cache = SessionCache(str(tmp_path / "cache"))
+    key = cache.key(sample_spk, "process_raw_spk", {})
+
+    # new process: no in-memory hashes, file not read again
+    monkeypatch.setattr(ephyspipe.cache, "_file_hashes", dict())
+    monkeypatch.setattr(ephyspipe.cache, "file_hash", None)
+
+    # compare! same key from saved hash, new key for new code version
+    assert cache.key(sample_spk, "process_raw_spk", {}) == key
+    monkeypatch.setattr(ephyspipe.cache, "CACHE_VERSION",
+                        ephyspipe.cache.CACHE_VERSION + 1)
+    assert cache.key(sample_spk, "process_raw_spk", {}) != key
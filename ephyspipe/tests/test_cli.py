@@ -0,0 +1,81 @@
+from ephyspipe import cli
+from ephyspipe.config import TESTDATADIR
+from os.path import join as pjoin
+import h5py
+import json
+import numpy as np
+import pandas as pd
+
+
+def test_cli(tmp_path):
+    # manifest with one session of saved mini sample data
+    manifest = str(tmp_path / "manifest.json")
+    with open(manifest, "w") as f:
+        json.dump([{"name": "sample",
+                    "bhv": [pjoin(TESTDATADIR, "sample_bhv.mat")],
+                    "spk": pjoin(TESTDATADIR, "sample_spk.mat"),
+                    "sync_code": 9,
+                    "window": [-0.1, 0.1]}], f)
+    out_dir = str(tmp_path / "out")
+
+    # run (with stage timings), then run again
+    timings = str(tmp_path / "timings.jsonl")
+    assert cli.main([manifest, "-o", out_dir, "-t", timings]) == 0
+    first = pd.read_csv(pjoin(out_dir, "summary.csv"))
+    assert cli.main([manifest, "-o", out_dir]) == 0
+    second = pd.read_csv(pjoin(out_dir, "summary.csv"))
+
+    # compare! second run skips the up to date session
+    assert list(first.status) == ["done"]
+    assert list(second.status) == ["skipped"]
+    trialinfo = pd.read_csv(pjoin(out_dir, "sample", "trialinfo.csv"))
+    assert np.all(trialinfo.sync.round(1) == [12.7, 134.7, 139.2])
+    with h5py.File(pjoin(out_dir, "sample", "spk.h5"), "r") as f:
+        assert f["fr"].shape == (3, 200, 2)
+    with open(timings) as f:
+        stages = [json.loads(line)["stage"] for line in f]
+    assert "load_bhv" in stages
+
+
+def test_cli_failed_session(tmp_path):
+    # csv manifest, with a missing spk file
+    manifest = str(tmp_path / "manifest.csv")
+    pd.DataFrame({"name": ["missing"],
+                  "bhv": [pjoin(TESTDATADIR, "sample_bhv.mat")],
+                  "spk": [str(tmp_path / "missing_spk.mat")],
+                  "sync_code": [9],
+                  "window": ["-0.1;0.1"]}).to_csv(manifest, index=False)
+    out_dir = str(tmp_path / "out")
+
+    # compare! other sessions would go on; failure is in the summary
+    assert cli.main([manifest, "-o", out_dir, "-n", "2"]) == 1
+    summary = pd.read_csv(pjoin(out_dir, "summary.csv"))
+    assert list(summary.status) == ["failed"]
+
+
+def test_cli_append_block(tmp_path):
+    # session recorded in blocks: saved mini sample data, twice
+    sample_bhv = pjoin(TESTDATADIR, "sample_bhv.mat")
+    sample_spk = pjoin(TESTDATADIR, "sample_spk.mat")
+    manifest = str(tmp_path / "manifest.json")
+    out_dir = str(tmp_path / "out")
+
+    # run with first block, then again once second block is recorded
+    statuses = []
+    for nblocks in [1, 2]:
+        with open(manifest, "w") as f:
+            json.dump([{"name": "blocks",
+                        "bhv": [sample_bhv] * nblocks,
+                        "spk": [sample_spk] * nblocks,
+                        "sync_code": 9,
+                        "window": [-0.1, 0.1]}], f)
+        assert cli.main([manifest, "-o", out_dir]) == 0
+        statuses += list(pd.read_csv(pjoin(out_dir, "summary.csv")).status)
+
+    # compare! second block's trials appended to first's
+    assert statuses == ["done", "appended"]
+    trialinfo = pd.read_csv(pjoin(out_dir, "blocks", "trialinfo.csv"))
+    assert list(trialinfo.block) == [0, 0, 0, 1, 1, 1]
+    with h5py.File(pjoin(out_dir, "blocks", "spk.h5"), "r") as f:
+        assert f["fr"].shape == (6, 200, 2)
+        assert np.array_equal(f["fr"][:3], f["fr"][3:])
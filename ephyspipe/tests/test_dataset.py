@@ -0,0 +1,107 @@
+import ephyspipe.behavior as bhv
+import ephyspipe.brain as brain
+from ephyspipe import cli
+from ephyspipe.config import TESTDATADIR
+from ephyspipe.dataset import (TrialDataset, save_dataset,
+                               session_to_dataset)
+from ephyspipe.filters import DEFAULT_BANDS
+from os.path import join as pjoin
+import h5py
+import json
+import numpy as np
+import pandas as pd
+
+
+def test_dataset(tmp_path):
+    # trial info, chopped spikes and lfp from saved mini sample data
+    sample_bhv = pjoin(TESTDATADIR, "sample_bhv.mat")
+    columns = bhv.load_bhv_columns([sample_bhv],
+                                   ["Trial"] + bhv.TRIALINFO_FIELDS)
+    trialinfo = bhv.get_trialinfo(columns)
+    trialinfo["sync"] = [2, 6.5, 11]
+    time_range = (-0.5, 0.5)
+    mag, phs, ts_chopped, lfp_meta = brain.process_raw_lfp(
+        pjoin(TESTDATADIR, "sample_lfp.mat"), trialinfo.sync, time_range)
+    raster, fr, unit_meta = brain.process_raw_spk(
+        pjoin(TESTDATADIR, "sample_spk.mat"))
+    fr_chopped = brain.chop(fr, trialinfo.sync, time_range)
+
+    # small chunks: one trial each
+    bands = dict(zip(DEFAULT_BANDS, zip(mag, phs)))
+    fname = save_dataset(str(tmp_path / "dataset.h5"), trialinfo,
+                         ts_chopped, {"fr": fr_chopped}, unit_meta, bands,
+                         lfp_meta, chunk_bytes=8000)
+
+    # free trials (0 and 2), channel 2, beta band, -0.2 to 0.3 sec
+    with TrialDataset(fname) as ds:
+        beta, ts, trials, channels = ds.lfp(
+            "beta", trials="trialtype == 'free'", channels=[2],
+            time_range=(-0.2, 0.3))
+        unit, _, _, units = ds.spk("fr", trials=[1],
+                                   units=["SPK_SPKC001b"])
+        chunks = ds.file["lfp/phs/beta"].chunks
+
+    # compare!
+    assert np.array_equal(beta, mag[3][[0, 2], 300:800, 1:2])
+    assert np.allclose(ts, ts_chopped[300:800])
+    assert list(trials.trialtype) == ["free", "free"]
+    assert list(channels.ID) == ["FP002"]
+    assert np.array_equal(unit, fr_chopped[1:2, :, 1:2])
+    assert list(units.ID) == ["SPK_SPKC001b"]
+    assert chunks == (1, 1000, 1)
+
+
+def test_dataset_single(tmp_path):
+    # one unit and one channel, chopped (squeezed to 2D) from sample data
+    sample_bhv = pjoin(TESTDATADIR, "sample_bhv.mat")
+    columns = bhv.load_bhv_columns([sample_bhv],
+                                   ["Trial"] + bhv.TRIALINFO_FIELDS)
+    trialinfo = bhv.get_trialinfo(columns)
+    trialinfo["sync"] = [2, 6.5, 11]
+    time_range = (-0.5, 0.5)
+    raster, fr, unit_meta = brain.process_raw_spk(
+        pjoin(TESTDATADIR, "sample_spk.mat"))
+    fr_chopped = brain.chop(fr[:1], trialinfo.sync, time_range)
+    mag, phs, ts_chopped, lfp_meta = brain.process_raw_lfp(
+        pjoin(TESTDATADIR, "sample_lfp.mat"), trialinfo.sync, time_range,
+        channels=[2])
+    beta = (mag[3][:, :, 0], phs[3][:, :, 0])
+
+    fname = save_dataset(str(tmp_path / "dataset.h5"), trialinfo,
+                         ts_chopped, {"fr": fr_chopped}, unit_meta[:1],
+                         {"beta": beta}, lfp_meta)
+
+    # compare! stored 3D, one unit / channel
+    with TrialDataset(fname) as ds:
+        unit = ds.spk("fr")[0]
+        channel = ds.lfp("beta")[0]
+    assert fr_chopped.ndim == 2
+    assert np.array_equal(unit, fr_chopped[:, :, None])
+    assert np.array_equal(channel, mag[3])
+
+
+def test_session_to_dataset(tmp_path):
+    # process saved mini sample session
+    manifest = str(tmp_path / "manifest.json")
+    with open(manifest, "w") as f:
+        json.dump([{"name": "sample",
+                    "bhv": [pjoin(TESTDATADIR, "sample_bhv.mat")],
+                    "spk": pjoin(TESTDATADIR, "sample_spk.mat"),
+                    "sync_code": 9,
+                    "window": [-0.1, 0.1]}], f)
+    out_dir = str(tmp_path / "out")
+    assert cli.main([manifest, "-o", out_dir]) == 0
+
+    # gather into one dataset
+    session_dir = pjoin(out_dir, "sample")
+    fname = session_to_dataset(session_dir)
+
+    # compare!
+    with TrialDataset(fname) as ds, \
+            h5py.File(pjoin(session_dir, "spk.h5"), "r") as store:
+        raster = ds.spk("raster")[0]
+        assert np.array_equal(raster, store["raster"][()])
+        assert np.allclose(ds.trials.sync, pd.read_csv(
+            pjoin(session_dir, "trialinfo.csv")).sync)
+        assert list(ds.units.ID) == ["SPK_SPKC001a", "SPK_SPKC001b"]
+        assert ds.channels is None
@@ -0,0 +1,98 @@
+import ephyspipe.filters as filters
+from ephyspipe.filters import ChannelSpectrum, FilterBank, odd_ext
+import ephyspipe.brain as brain
+from ephyspipe.config import TESTDATADIR
+from os.path import join as pjoin
+import numpy as np
+import pytest
+import scipy.signal as signal
+
+
+def make_fake_channel(ntimes=30000, seed=1):
+    # sines in each band plus noise
+    rng = np.random.default_rng(seed)
+    t = np.arange(ntimes) / 1000
+    lfp = rng.normal(0, 1, ntimes)
+    for hz in [3, 6, 10, 20, 45, 100]:
+        lfp += np.sin(2 * np.pi * hz * t + rng.uniform(0, 6))
+
+    return lfp
+
+
+def test_odd_ext():
+    fake_x = np.array([1., 2., 4., 7.])
+
+    # expected: reflect about end points
+    fake_ext = np.array([-2., 0., 1., 2., 4., 7., 10., 12.])
+
+    # compare!
+    assert np.all(odd_ext(fake_x, 2) == fake_ext)
+
+
+def test_bandpass_matches_filtfilt():
+    fake_lfp = make_fake_channel()
+    spectrum = ChannelSpectrum(fake_lfp)
+
+    for band in [[2, 4], [12, 30], [70, 200]]:
+        coeffs = signal.firwin(1000, band, pass_zero=False, fs=1000)
+
+        # expected: filtfilt, then hilbert
+        fake_bandpassed = signal.filtfilt(coeffs, 1, fake_lfp)
+        fake_analytic = signal.hilbert(fake_bandpassed)
+
+        # get analytic signal from shared spectrum
+        output = spectrum.analytic(coeffs)
+        scale = np.abs(fake_analytic).mean()
+
+        # compare! bandpass identical; hilbert differs near edges only
+        assert np.allclose(output.real, fake_bandpassed, atol=1e-10)
+        interior = slice(10000, -10000)
+        assert np.abs(output - fake_analytic)[interior].max() < 0.005 * scale
+
+
+def test_filter_bank():
+    # custom bands @ 2 kHz
+    bands = {"theta": [4, 8], "beta": [12, 30]}
+    bank = FilterBank(fs=2000, notch_hz=[50], bands=bands, ntaps=501,
+                      cache_dir=None)
+
+    # expected designs
+    fake_notch = signal.iirnotch(50, 50, 2000)
+    fake_band = signal.firwin(501, [12, 30], pass_zero=False, fs=2000)
+
+    # compare!
+    assert bank.band_names == ["theta", "beta"]
+    assert np.all(bank.notch_filts[0][0] == fake_notch[0])
+    assert np.all(bank.notch_filts[0][1] == fake_notch[1])
+    assert np.all(bank.band_filts[1] == fake_band)
+
+    # same spec reuses designs; responses are memoized too
+    again = FilterBank(fs=2000, notch_hz=[50], bands=bands, ntaps=501,
+                       cache_dir=None)
+    assert again.band_filts[1] is bank.band_filts[1]
+    assert bank.response("beta", 4096) is again.response(1, 4096)
+    assert np.allclose(bank.response("beta", 4096),
+                       np.abs(np.fft.rfft(fake_band, 4096)) ** 2)
+
+    # LFP is processed at 1 kHz; 2 kHz designs are refused, not misused
+    with pytest.raises(ValueError):
+        bank.check_fs(1000)
+    with pytest.raises(ValueError):
+        brain.process_raw_lfp(pjoin(TESTDATADIR, "sample_lfp.mat"),
+                              np.array([2]), (-0.5, 0.5), filter_bank=bank)
+
+
+def test_filter_bank_saved(tmp_path):
+    bands = {"gamma": [30, 60]}
+    bank = FilterBank(bands=bands, cache_dir=str(tmp_path))
+    assert len(list(tmp_path.glob("filterbank_*.npz"))) == 1
+    assert not list(tmp_path.glob("*.tmp"))  # written aside, then moved
+
+    # forget in-process designs, load from disk instead
+    filters._designs.clear()
+    loaded = FilterBank(bands=bands, cache_dir=str(tmp_path))
+
+    # compare!
+    assert loaded.band_filts[0] is not bank.band_filts[0]
+    assert np.all(loaded.band_filts[0] == bank.band_filts[0])
+    assert np.all(loaded.notch_filts[2][1] == bank.notch_filts[2][1])
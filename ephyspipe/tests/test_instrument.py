@@ -0,0 +1,103 @@
+import ephyspipe.brain as brain
+from ephyspipe import instrument
+from ephyspipe.config import TESTDATADIR
+from os.path import join as pjoin
+import json
+import multiprocessing
+import numpy as np
+import tracemalloc
+
+
+def test_stage_records():
+    # use saved mini sample lfp
+    sample_lfp = pjoin(TESTDATADIR, "sample_lfp.mat")
+    sync_points = np.array([3, 6, 9])
+    time_range = (-0.01, 0.01)
+
+    # collect records with a callback
+    records = []
+    with instrument.recording(records.append):
+        brain.process_raw_lfp(sample_lfp, sync_points, time_range,
+                              nthreads=1)
+
+    # compare! every stage, for every channel (and band)
+    stages = [r["stage"] for r in records]
+    for name in ["load", "notch"]:
+        assert stages.count(name) == 2
+    for name in ["bandpass", "hilbert", "magnitude", "zscore", "chop"]:
+        assert stages.count(name) == 12
+    load = records[stages.index("load")]
+    assert load["channel"] == "FP001"
+    assert load["nbytes"] == 8 * 15000
+    assert all(r["seconds"] >= 0 for r in records)
+
+    # nothing recorded once done
+    brain.process_raw_lfp(sample_lfp, sync_points, time_range,
+                          channels=[1])
+    assert len(records) == len(stages)
+
+
+def test_stage_options_change():
+    # memory tracing (already running) turned on while a stage is open
+    records = []
+    inner = []
+    tracemalloc.start()
+    try:
+        with instrument.recording(records.append):
+            with instrument.stage("outer"):
+                with instrument.recording(inner.append, trace_memory=True):
+                    with instrument.stage("inner"):
+                        np.ones(1000)
+    finally:
+        tracemalloc.stop()
+
+    # compare! only the stage started with tracing on has memory
+    assert [r["stage"] for r in records] == ["inner", "outer"]
+    assert "alloc_bytes" in records[0]
+    assert "alloc_bytes" not in records[1]
+
+
+def test_json_lines_profile(tmp_path):
+    # json lines file, with profile and memory tracing
+    fname = str(tmp_path / "timings.jsonl")
+    with instrument.recording(fname, profile=True, trace_memory=True):
+        with instrument.stage("outer", session="test") as record:
+            with instrument.stage("inner"):
+                data = np.ones(10**6)
+            instrument.add_array(record, data)
+
+    with open(fname) as f:
+        records = [json.loads(line) for line in f]
+
+    # compare! inner stage finishes first; outer one got the profile
+    assert [r["stage"] for r in records] == ["inner", "outer"]
+    assert records[1]["session"] == "test"
+    assert records[1]["nbytes"] == 8 * 10**6
+    assert "profile" in records[1] and "profile" not in records[0]
+    assert records[1]["peak_alloc_bytes"] >= 8 * 10**6
+
+
+def write_records(fname, tag):
+    # long records, well past any write buffer
+    sink = instrument.JsonLinesSink(fname)
+    for i in range(20):
+        sink({"stage": tag, "i": i, "profile": tag * 200000})
+
+
+def test_json_lines_processes(tmp_path):
+    # two processes appending to one file at once
+    fname = str(tmp_path / "timings.jsonl")
+    ctx = multiprocessing.get_context()
+    procs = [ctx.Process(target=write_records, args=(fname, tag))
+             for tag in ["a", "b"]]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    with open(fname) as f:
+        records = [json.loads(line) for line in f]
+
+    # compare! every line whole
+    assert sorted(r["stage"] for r in records) == ["a"] * 20 + ["b"] * 20
+    assert all(r["profile"] == r["stage"] * 200000 for r in records)
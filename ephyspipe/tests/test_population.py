@@ -0,0 +1,95 @@
+import ephyspipe.population as population
+from ephyspipe.config import TESTDATADIR
+from os.path import join as pjoin
+import mat73
+import numpy as np
+
+
+def test_cross_correlograms():
+    # saved mini sample units, plus one firing right after the first
+    data = mat73.loadmat(pjoin(TESTDATADIR, "sample_spk.mat"))
+    timestamps = [data["SPK_SPKC001a"], data["SPK_SPKC001b"]]
+    timestamps.append(timestamps[0] + 0.0105)
+    max_lag, bin_size = 0.05, 0.002
+
+    ccgs, lags, pairs = population.cross_correlograms(
+        timestamps, max_lag, bin_size, nthreads=3)
+
+    # every pair of spikes, the slow way
+    edges = np.linspace(-max_lag, max_lag, lags.shape[0] + 1)
+    for (u, v), ccg in zip(pairs, ccgs):
+        diffs = (timestamps[v][None, :] - timestamps[u][:, None]).ravel()
+        if u == v:
+            diffs = diffs[~np.eye(timestamps[u].shape[0], dtype=bool)
+                          .ravel()]
+        expected, _ = np.histogram(diffs, edges)
+
+        # compare!
+        assert np.array_equal(ccg, expected)
+
+    # compare! shifted copy shows up at +10.5 ms
+    assert pairs.tolist() == [[0, 0], [0, 1], [0, 2], [1, 1], [1, 2],
+                              [2, 2]]
+    assert np.allclose(lags[np.argmax(ccgs[2])], 0.011)
+    assert ccgs[2].max() == timestamps[0].shape[0]
+
+
+def test_psth_by_condition():
+    # fake firing rates: 6 trials x 4 time x 2 units
+    rng = np.random.default_rng(0)
+    chopped = rng.random((6, 4, 2))
+    conditions = np.array(["free", "forced", "free", None, "forced", "free"],
+                          dtype=object)
+
+    psth, sem, labels = population.psth_by_condition(chopped, conditions)
+
+    # compare!
+    assert labels.tolist() == ["forced", "free"]
+    for c, label in enumerate(labels):
+        trials = chopped[conditions == label]
+        assert np.allclose(psth[c], trials.mean(axis=0))
+        assert np.allclose(sem[c], trials.std(axis=0, ddof=1) /
+                           np.sqrt(trials.shape[0]))
+
+
+def test_psth_nan_trials():
+    # fake firing rates, with a missing sync point (all NaN) in each
+    # condition, and one unit missing from a trial
+    rng = np.random.default_rng(2)
+    chopped = rng.random((7, 4, 2))
+    chopped[[1, 3]] = np.nan
+    chopped[6, :, 1] = np.nan
+    conditions = np.array(["a", "a", "b", None, "b", "a", "b"],
+                          dtype=object)
+
+    psth, sem, labels = population.psth_by_condition(chopped, conditions)
+    noise = population.noise_correlations(chopped, conditions)
+
+    # compare! NaN left out, not spread to every condition
+    for c, label in enumerate(labels):
+        trials = chopped[conditions == label]
+        assert np.allclose(psth[c], np.nanmean(trials, axis=0))
+        count = np.sum(~np.isnan(trials), axis=0)
+        assert np.allclose(sem[c], np.nanstd(trials, axis=0, ddof=1) /
+                           np.sqrt(count))
+    assert not np.any(np.isnan(noise))
+
+
+def test_correlations():
+    # fake firing rates: 5 trials x 50 time x 3 units
+    rng = np.random.default_rng(1)
+    chopped = rng.random((5, 50, 3))
+    conditions = np.array([0, 1, 0, 1, 1])
+
+    corr = population.trial_correlations(chopped, block=2)
+    noise = population.noise_correlations(chopped, conditions)
+
+    # the slow way
+    response = chopped.sum(axis=1)
+    for c in [0, 1]:
+        response[conditions == c] -= response[conditions == c].mean(axis=0)
+
+    # compare!
+    for t in range(5):
+        assert np.allclose(corr[t], np.corrcoef(chopped[t].T))
+    assert np.allclose(noise, np.corrcoef(response.T))
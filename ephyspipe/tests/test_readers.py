@@ -0,0 +1,172 @@
+from ephyspipe.readers import (PL2MatReader, PL2Reader, load_spk,
+                               select_units, unit_channels)
+from ephyspipe.config import TESTDATADIR
+from os.path import join as pjoin
+import ephyspipe.behavior as bhv
+import ephyspipe.brain as brain
+import mat73
+import numpy as np
+import pytest
+import sys
+import types
+
+
+def test_channel_index():
+    # use saved mini sample lfp
+    sample_lfp = pjoin(TESTDATADIR, "sample_lfp.mat")
+
+    with PL2MatReader(sample_lfp) as reader:
+        output = reader.channel_names
+        nsamples = reader.length("FP001")
+
+    # compare!
+    assert output == ["FP001", "FP002"]
+    assert nsamples == 15000
+
+
+def test_read():
+    # use saved mini sample lfp; compare to full mat73 load
+    sample_lfp = pjoin(TESTDATADIR, "sample_lfp.mat")
+    expected = mat73.loadmat(sample_lfp, only_include=["FP002", "lfp_ts"])
+
+    with PL2MatReader(sample_lfp) as reader:
+        # preallocated buffer, read in chunks
+        buffer = np.empty(15000)
+        output = reader.read("FP002", out=buffer, chunk_size=4000)
+        output_ts = reader.read_ts()
+        output_part = reader.read("FP002", start=100, stop=200)
+
+        # iterate over chunks
+        output_chunks = np.concatenate([chunk.copy() for _, chunk in
+                                        reader.iter_chunks("FP002", 6000)])
+
+    # compare!
+    assert output is buffer
+    assert np.all(output == expected["FP002"])
+    assert np.all(output_ts == expected["lfp_ts"])
+    assert np.all(output_part == expected["FP002"][100:200])
+    assert np.all(output_chunks == expected["FP002"])
+
+
+def test_read_events():
+    # use saved mini sample spk; compare to full mat73 load
+    sample_spk = pjoin(TESTDATADIR, "sample_spk.mat")
+    expected = mat73.loadmat(sample_spk)
+
+    with PL2MatReader(sample_spk) as reader:
+        output = reader.read_events()
+        output_spikes = reader.read("SPK_SPKC001a")
+
+    # compare!
+    assert np.all(output["event_codes"] == expected["event_codes"])
+    assert np.all(output["event_ts"] == expected["event_ts"])
+    assert np.all(output_spikes == expected["SPK_SPKC001a"])
+
+
+def test_select_units():
+    # use saved mini sample spk
+    sample_spk = pjoin(TESTDATADIR, "sample_spk.mat")
+
+    with PL2MatReader(sample_spk) as reader:
+        info = reader.read_unit_info()
+        by_count, duration = select_units(reader, min_spikes=3)
+        by_rate, _ = select_units(reader, min_rate=0.03)
+        by_channel, _ = select_units(reader, channels=[2])
+        data = load_spk(reader, ["SPK_SPKC001b"])
+
+    # compare! 4 and 2 spikes over 82.67 sec
+    assert list(info.nspikes) == [4, 2]
+    assert np.allclose(info.last_spk, [35, 81.67])
+    assert np.isclose(duration, 82.67)
+    assert list(by_count.ID) == ["SPK_SPKC001a"]
+    assert list(by_rate.ID) == ["SPK_SPKC001a"]
+    assert by_channel.shape[0] == 0
+    assert "SPK_SPKC001a" not in data
+    assert np.allclose(data["SPK_SPKC001b"], [80.01, 81.67])
+    assert list(unit_channels(["SPK_SPKC012a", "SPK_SPKC101bb"])) == \
+        [12, 101]
+
+
+def fake_pypl2(spk, lfp):
+    # stand-in for Plexon's SDK, serving the saved .mat contents
+    spikes = np.concatenate([spk["SPK_SPKC001a"], spk["SPK_SPKC001b"]])
+    units = np.repeat([1, 2], [len(spk["SPK_SPKC001a"]),
+                               len(spk["SPK_SPKC001b"])])
+    order = np.argsort(spikes)
+
+    pypl2 = types.ModuleType("pypl2")
+    pypl2.pl2_info = lambda fname: (
+        [(0, b"SPK_SPKC001", (7, len(spk["SPK_SPKC001a"]),
+                              len(spk["SPK_SPKC001b"]), 0, 0))],
+        [(0, b"Strobed", len(spk["event_codes"]))],
+        [(0, b"WB001", 15000), (1, b"FP001", 15000), (2, b"FP002", 15000)])
+    pypl2.pl2_spikes = lambda fname, ch: (len(spikes), spikes[order],
+                                          units[order], None)
+    pypl2.pl2_events = lambda fname, ch: (len(spk["event_ts"]),
+                                          spk["event_ts"],
+                                          spk["event_codes"])
+    pypl2.pl2_ad = lambda fname, ch: (1000, 15000, (0,), (15000,), lfp[ch])
+
+    return pypl2
+
+
+def test_pl2_reader_platform(tmp_path, monkeypatch):
+    # pypl2 there, but not on Windows
+    monkeypatch.setitem(sys.modules, "pypl2", types.ModuleType("pypl2"))
+    monkeypatch.setattr(sys, "platform", "linux")
+
+    # compare! clear error, pointing to .mat
+    with pytest.raises(ImportError, match="only runs on Windows"):
+        PL2Reader(str(tmp_path / "session.pl2"))
+
+
+def test_pl2_reader(tmp_path, monkeypatch):
+    # serve saved mini samples as if read from .pl2
+    sample_spk = pjoin(TESTDATADIR, "sample_spk.mat")
+    sample_lfp = pjoin(TESTDATADIR, "sample_lfp.mat")
+    spk = mat73.loadmat(sample_spk)
+    lfp = mat73.loadmat(sample_lfp)
+    monkeypatch.setitem(sys.modules, "pypl2", fake_pypl2(spk, lfp))
+    monkeypatch.setattr(sys, "platform", "win32")
+    fake_pl2 = str(tmp_path / "session.pl2")
+
+    with PL2Reader(fake_pl2) as reader:
+        channel_names = reader.channel_names
+        unit_names = reader.read_unit_names()
+        output_part = reader.read("FP002", start=100, stop=200)
+        output_ts = reader.read_ts()
+    output_spk = load_spk(fake_pl2)
+    output_codes = bhv.load_pl2_codes(fake_pl2)
+
+    # units on one spike channel share a load, picking them included
+    pypl2 = sys.modules["pypl2"]
+    calls = []
+    pl2_spikes = pypl2.pl2_spikes
+    monkeypatch.setattr(pypl2, "pl2_spikes",
+                        lambda fname, ch: calls.append(ch) or
+                        pl2_spikes(fname, ch))
+    with PL2Reader(fake_pl2) as reader:
+        unit_info, _ = select_units(reader)
+        load_spk(reader, list(unit_info.ID))
+
+    # compare!
+    assert channel_names == ["FP001", "FP002"]
+    assert unit_names == ["SPK_SPKC001a", "SPK_SPKC001b"]
+    assert np.all(output_part == lfp["FP002"][100:200])
+    assert np.all(output_ts == lfp["lfp_ts"])
+    assert np.all(output_spk["SPK_SPKC001b"] == spk["SPK_SPKC001b"])
+    assert np.all(output_codes["event_codes"] == spk["event_codes"])
+    assert calls == ["SPK_SPKC001"]
+
+    # whole pipeline, .pl2 vs .mat
+    sync_points = np.array([1.5, 6, 11])
+    expected = brain.process_raw_lfp(sample_lfp, sync_points, (-0.5, 0.5))
+    output = brain.process_raw_lfp(fake_pl2, sync_points, (-0.5, 0.5))
+    expected_spk = brain.process_raw_spk(sample_spk)
+    output_spk = brain.process_raw_spk(fake_pl2)
+
+    # compare!
+    for b in range(len(expected[0])):
+        assert np.array_equal(output[0][b], expected[0][b])
+    assert np.array_equal(output_spk[0], expected_spk[0])
+    assert output_spk[2].equals(expected_spk[2])
@@ -0,0 +1,73 @@
+import ephyspipe.behavior as bhv
+import ephyspipe.brain as brain
+from ephyspipe.config import TESTDATADIR
+from ephyspipe.dataset import TrialDataset
+from ephyspipe.session import load_session
+from ephyspipe.tests.test_brain import make_fake_lfp
+from os.path import join as pjoin
+import ephyspipe.session as session_module
+import numpy as np
+import pytest
+import time
+
+
+def test_load_session(tmp_path):
+    # saved mini sample data; fake lfp long enough for all trials
+    sample_bhv = pjoin(TESTDATADIR, "sample_bhv.mat")
+    sample_spk = pjoin(TESTDATADIR, "sample_spk.mat")
+    fake_lfp = str(tmp_path / "fake_lfp.mat")
+    make_fake_lfp(fake_lfp, nchannels=1, ntimes=145000)
+    time_range = (-0.5, 0.5)
+
+    # everything at once
+    session = load_session([sample_bhv], sample_spk, fake_lfp, 9,
+                           time_range, spk_kwargs={"sparse": True})
+
+    # one after another
+    columns = bhv.load_bhv_columns([sample_bhv],
+                                   ["Trial"] + bhv.TRIALINFO_FIELDS)
+    sync_points = bhv.get_trial_events(columns,
+                                       bhv.load_pl2_codes(sample_spk), 9)
+    raster, fr, unit_meta = brain.process_raw_spk(sample_spk, sparse=True)
+    mag, phs, ts_chopped, lfp_meta = brain.process_raw_lfp(
+        fake_lfp, sync_points, time_range)
+
+    # compare!
+    assert np.array_equal(session.sync_points, sync_points)
+    assert np.array_equal(session.trialinfo.sync, sync_points)
+    assert list(session.trialinfo.trialtype) == ["free", "forced", "free"]
+    assert np.array_equal(session.spk["fr"],
+                          brain.chop(fr, sync_points, time_range),
+                          equal_nan=True)
+    assert session.unit_meta.equals(unit_meta)
+    assert np.array_equal(session.lfp["beta"][0], mag[3], equal_nan=True)
+    assert np.array_equal(session.lfp["delta"][1], phs[0], equal_nan=True)
+    assert np.all(session.lfp_meta.ID == lfp_meta.ID)
+
+    # and saved as one dataset
+    with TrialDataset(session.save(str(tmp_path / "session.h5"))) as ds:
+        assert ds.band_names == list(session.lfp)
+        assert ds.units.ID.tolist() == unit_meta.ID.tolist()
+
+
+def test_load_session_error(monkeypatch):
+    # behavior fails while spikes are loading
+    state = []
+
+    def read_bhv_columns(*args):
+        raise ValueError("bad bhv file")
+
+    def process_raw_spk(*args, **kwargs):
+        state.append("start")
+        time.sleep(0.5)
+        state.append("done")
+
+    monkeypatch.setattr(bhv, "read_bhv_columns", read_bhv_columns)
+    monkeypatch.setattr(bhv, "load_pl2_codes", lambda fname: dict())
+    monkeypatch.setattr(session_module, "process_raw_spk", process_raw_spk)
+
+    with pytest.raises(ValueError):
+        load_session(["a.mat", "b.mat"], "spk.mat", None, 9, (-0.5, 0.5))
+
+    # compare! nothing left running
+    assert state in [[], ["start", "done"]]
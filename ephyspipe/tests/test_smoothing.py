@@ -0,0 +1,58 @@
+import ephyspipe.smoothing as smoothing
+import numpy as np
+
+
+def test_smooth_matches_convolve():
+    # make fake spike trains
+    rng = np.random.default_rng(0)
+    fake_raster = (rng.random((4, 500)) < 0.05).astype(float)
+
+    kernels = [smoothing.boxcar_kernel(49),
+               smoothing.boxcar_kernel(10),
+               smoothing.gaussian_kernel(3),
+               smoothing.gaussian_kernel(20),
+               smoothing.exponential_kernel(5)]
+
+    for kernel in kernels:
+        # expected: np.convolve one row at a time
+        fake_fr = np.stack([np.convolve(row, kernel, "same")
+                            for row in fake_raster])
+
+        # compare!
+        for method in ["auto", "fft", "direct"]:
+            output = smoothing.smooth(fake_raster, kernel, axis=1,
+                                      method=method)
+            assert np.allclose(output, fake_fr)
+
+        # smoothing along first axis is the same
+        output = smoothing.smooth(fake_raster.T, kernel, axis=0)
+        assert np.allclose(output.T, fake_fr)
+
+
+def test_running_sum():
+    # make fake data; compare to direct sums with zero padded edges
+    fake_data = np.arange(20, dtype=float).reshape((2, -1))
+
+    for width in [1, 4, 5]:
+        padded = np.pad(fake_data, ((0, 0), (width // 2, (width - 1) // 2)))
+        fake_summed = np.stack([padded[:, i:i + width].sum(axis=1)
+                                for i in range(fake_data.shape[1])], axis=1)
+
+        # compare!
+        output = smoothing.running_sum(fake_data, width, axis=1)
+        assert np.all(output == fake_summed)
+
+
+def test_exponential_causal():
+    # single spike in the middle
+    fake_train = np.zeros(100)
+    fake_train[50] = 1
+
+    # get smoothed train
+    output = smoothing.smooth(fake_train, smoothing.exponential_kernel(4))
+
+    # compare! nothing before the spike, decays after
+    assert np.all(output[:50] == 0)
+    assert output[50] > 0
+    assert np.all(np.diff(output[50:]) <= 0)
+    assert np.isclose(output.sum(), 1)
@@ -0,0 +1,76 @@
+import ephyspipe.brain as brain
+from ephyspipe.spikes import SpikeRaster, window_spikes
+import numpy as np
+
+
+def test_from_timestamps():
+    # make some fake data
+    fake_ts = [np.array([0, 0.001, 0.0011, 0.005]), np.array(0.010)]
+    ntimes = 20
+
+    # expected spike trains; repeats in same ms collapse to one spike
+    fake_raster = np.zeros((2, ntimes))
+    fake_raster[0, [0, 1, 5]] = 1
+    fake_raster[1, 10] = 1
+
+    # make sparse raster
+    output = SpikeRaster.from_timestamps(fake_ts, ntimes)
+
+    # compare!
+    assert output.shape == (2, ntimes)
+    assert output.nspikes == 4
+    assert np.all(output.toarray() == fake_raster)
+    assert np.all(output.toarray(3, 12) == fake_raster[:, 3:12])
+
+
+def test_smoothed_toarray():
+    # make some fake spikes, including near session edges
+    ntimes = 300
+    fake_ts = [np.array([0.002, 0.100, 0.101, 0.290]),
+               np.array([0.150])]
+    sparse = SpikeRaster.from_timestamps(fake_ts, ntimes)
+
+    # dense firing rates for whole session
+    fake_fr = brain.get_fr(sparse.toarray())
+
+    # get lazily smoothed snippets
+    sparse_fr = brain.get_fr(sparse)
+
+    # compare!
+    assert np.allclose(sparse_fr.toarray(), fake_fr)
+    assert np.allclose(sparse_fr.toarray(90, 160), fake_fr[:, 90:160])
+    assert np.allclose(sparse_fr.toarray(0, 10), fake_fr[:, :10])
+
+
+def test_window_mean():
+    # make some fake spikes
+    ntimes = 1000
+    rng = np.random.default_rng(0)
+    fake_ts = [np.sort(rng.uniform(0, 0.999, 50)) for i in range(3)]
+    sparse = SpikeRaster.from_timestamps(fake_ts, ntimes)
+    dense = sparse.toarray()
+
+    # windows of 20 ms, every 10 ms; small blocks to check block edges
+    starts = np.arange(0, ntimes - 20, 10)
+    fake_means = np.stack([dense[:, s:s + 20].mean(axis=1) for s in starts],
+                          axis=1)
+
+    # get window averages
+    output = sparse.window_mean(starts, 20, block=95)
+
+    # compare!
+    assert np.allclose(output, fake_means)
+
+
+def test_window_spikes():
+    # fake spikes and overlapping windows, one of them empty
+    fake_spikes = np.array([2, 5, 6, 11, 30])
+    starts = np.array([0, 4, 12, 10])
+    stops = starts + 8
+
+    # get (window, spike) pairs
+    win, spk = window_spikes(fake_spikes, starts, stops)
+
+    # compare!
+    assert np.all(win == [0, 0, 0, 1, 1, 1, 3])
+    assert np.all(spk == [2, 5, 6, 5, 6, 11, 11])
@@ -0,0 +1,139 @@
+import ephyspipe.brain as brain
+import ephyspipe.stream as stream
+from ephyspipe.config import TESTDATADIR
+from ephyspipe.tests.test_brain import make_fake_lfp
+from os.path import join as pjoin
+import h5py
+import mat73
+import numpy as np
+
+
+def test_stream_spk(tmp_path):
+    # use saved mini sample data
+    sample_spk = pjoin(TESTDATADIR, "sample_spk.mat")
+    data = mat73.loadmat(sample_spk)
+    timestamps = [data["SPK_SPKC001a"], data["SPK_SPKC001b"]]
+    sync_points = np.array([20, -1, 80.01, 81.6])
+    window = (-0.1, 0.1)
+
+    # stream a few sync points at a time
+    out_fname = stream.stream_spk(sample_spk, str(tmp_path / "spk.h5"),
+                                  sync_points, window, block=500)
+
+    # compare!
+    with h5py.File(out_fname, "r") as f:
+        assert np.allclose(f["fr"][()], brain.chop_spikes(
+            timestamps, sync_points, window))
+        assert np.all(f["raster"][()] == brain.chop_spikes(
+            timestamps, sync_points, window, fr=False))
+        assert [u.decode() for u in f["unit_names"]] == \
+            ["SPK_SPKC001a", "SPK_SPKC001b"]
+
+
+def test_stream_lfp(tmp_path):
+    # make fake lfp; events near block edges
+    fake_lfp = str(tmp_path / "fake_lfp.mat")
+    make_fake_lfp(fake_lfp, nchannels=1, ntimes=30000)
+    sync_points = np.array([8, 12.2, -1, 21])
+    time_range = (-0.5, 0.5)
+
+    # filter entire session vs stream in blocks
+    full = brain.process_raw_lfp(fake_lfp, sync_points, time_range)
+    out_fname = stream.stream_lfp(fake_lfp, str(tmp_path / "lfp.h5"),
+                                  sync_points, time_range, block=12000)
+
+    # compare! close, up to edge effects; missing event is nan
+    present = sync_points != -1
+    with h5py.File(out_fname, "r") as f:
+        for b, band in enumerate(f["band_names"].asstr()):
+            mag_diff = full[0][b][present] - f["mag"][band][()][present]
+            phs_diff = np.angle(np.exp(1j * (full[1][b][present] -
+                                             f["phs"][band][()][present])))
+            assert np.abs(mag_diff).max() < 0.05
+            assert np.abs(phs_diff).max() < 0.01
+            assert np.all(np.isnan(f["mag"][band][()][~present]))
+        assert np.all(f["ts_chopped"][()] == full[2])
+
+
+def test_stream_spk_append(tmp_path):
+    # use saved mini sample spk as two blocks of one session
+    sample_spk = pjoin(TESTDATADIR, "sample_spk.mat")
+    sync_points = np.array([20, -1, 80.01])
+    window = (-0.1, 0.1)
+    out_fname = str(tmp_path / "spk.h5")
+
+    # first block, then add second
+    stream.stream_spk(sample_spk, out_fname, sync_points, window)
+    with h5py.File(out_fname, "r") as f:
+        first = f["fr"][()]
+        mean_fr = f["mean_fr"][()]
+    stream.stream_spk(sample_spk, out_fname, sync_points[:2], window,
+                      append=True)
+
+    # compare! new sync points after old ones; same rates
+    with h5py.File(out_fname, "r") as f:
+        assert f["fr"].shape == (5, 200, 2)
+        assert np.array_equal(f["fr"][:3], first, equal_nan=True)
+        assert np.array_equal(f["fr"][3:], first[:2], equal_nan=True)
+        assert np.allclose(f["mean_fr"][()], mean_fr)
+
+
+def test_stream_lfp_append(tmp_path):
+    # make fake lfp, and split it into two files
+    fake_lfp = str(tmp_path / "fake_lfp.mat")
+    make_fake_lfp(fake_lfp, nchannels=2, ntimes=30000)
+    split = 14000
+    with h5py.File(fake_lfp, "r") as f:
+        for part, cut in [("part1", np.s_[:split]), ("part2", np.s_[split:])]:
+            with h5py.File(str(tmp_path / (part + ".mat")), "w") as p:
+                for name in f:
+                    p[name] = f[name][:, cut]
+    sync_points = np.array([8, 13.8, -1, 14.2, 21])
+    time_range = (-0.5, 0.5)
+
+    # whole file vs first part, then second part appended
+    full = brain.process_raw_lfp(fake_lfp, sync_points, time_range)
+    parts = str(tmp_path / "parts.h5")
+    stream.stream_lfp(str(tmp_path / "part1.mat"), parts, sync_points[:3],
+                      time_range)
+    stream.stream_lfp(str(tmp_path / "part2.mat"), parts,
+                      sync_points[3:] - split / 1000, time_range,
+                      append=True)
+
+    # compare! close, up to edge effects; windows across the junction too
+    present = sync_points != -1
+    with h5py.File(parts, "r") as f:
+        assert np.allclose(f["sync_point"][()], sync_points)
+        for b, band in enumerate(f["band_names"].asstr()):
+            mag_diff = full[0][b][present] - f["mag"][band][()][present]
+            phs_diff = np.angle(np.exp(1j * (full[1][b][present] -
+                                             f["phs"][band][()][present])))
+            assert np.abs(mag_diff).max() < 0.05
+            assert np.abs(phs_diff).max() < 0.01
+            assert np.all(np.isnan(f["mag"][band][()][~present]))
+
+
+def test_stream_lfp_chunks(tmp_path):
+    # make fake lfp; many sync points, in and across blocks
+    fake_lfp = str(tmp_path / "fake_lfp.mat")
+    make_fake_lfp(fake_lfp, nchannels=2, ntimes=20000)
+    sync_points = np.arange(1, 19, 0.1)
+    sync_points[[10, 50]] = -1
+    time_range = (-0.5, 0.5)
+
+    # one block vs many
+    one = stream.stream_lfp(fake_lfp, str(tmp_path / "one.h5"),
+                            sync_points, time_range, block=20000)
+    many = stream.stream_lfp(fake_lfp, str(tmp_path / "many.h5"),
+                             sync_points, time_range, block=2500)
+
+    # compare! chunks hold a run of sync points; close, up to edge effects
+    present = sync_points != -1
+    with h5py.File(one, "r") as f, h5py.File(many, "r") as g:
+        assert f["mag/beta"].chunks == (131, 1000, 1)
+        mag_diff = f["mag/beta"][()] - g["mag/beta"][()]
+        phs_diff = np.angle(np.exp(1j * (f["phs/beta"][()] -
+                                         g["phs/beta"][()])))
+        assert np.abs(mag_diff[present]).max() < 0.05
+        assert np.abs(phs_diff[present]).max() < 0.01
+        assert np.all(np.isnan(g["mag/beta"][()][~present]))
@@ -32,9 +32,14 @@ setup(
         python_requires='>=3',
         license="MIT",
         packages=['ephyspipe', 'ephyspipe.tests'],
+        entry_points={'console_scripts': ['ephyspipe = ephyspipe.cli:main']},
         platforms=['any'],
         setup_requires=['pytest-runner'],
         tests_require=['pytest'],
+        # reading .pl2 directly (readers.PL2Reader) also needs Plexon's
+        # Python PL2 SDK (pypl2): Windows only, and not on PyPI, so it
+        # can't be an extra; download it from Plexon, or convert .pl2 to
+        # .mat with matlab/convert_raw_*.m
         install_requires=['h5py==3.6.0',
                           'mat73==0.59',
                           'numpy==1.21.6',